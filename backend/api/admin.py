@@ -5,9 +5,23 @@ from django.contrib.auth.models import User as AuthUser
 from django.utils.translation import gettext_lazy as _
 from .models import (
     User, Dentist, Patient, DentalImage, Disease, 
-    ImageAnalysis, ImageClassification, Appointment, 
+    ImageAnalysis, ImageClassification, DetectionCount, Appointment, DentistPatient,
     Treatment, WorkSchedule
 )
+from .caching import invalidate_analysis_fragment
+from .budgets import QueryBudget
+
+# Session, user, two counts and the page: related objects shown in a list
+# must come from list_select_related / get_queryset, not one query per row
+CHANGELIST_BUDGET = {'changelist': QueryBudget(queries=8, ms=1000)}
+
+
+class TombstoneDeleteMixin:
+    """'Delete selected' through each object's delete(), which writes the tombstones delta sync relies on."""
+
+    def delete_queryset(self, request, queryset):
+        for obj in queryset:
+            obj.delete()
 
 
 class DentistInline(admin.StackedInline):
@@ -22,6 +36,7 @@ class PatientInline(admin.StackedInline):
 
 @admin.register(User)
 class UserAdmin(BaseUserAdmin):
+    query_budget = CHANGELIST_BUDGET
     list_display = ('username', 'email', 'first_name', 'last_name', 'gender','role', 'is_staff','profile_picture', 'profile_picture_url')
     list_filter = ('role', 'is_staff', 'is_superuser')
     fieldsets = (
@@ -68,18 +83,21 @@ class UserAdmin(BaseUserAdmin):
 
 @admin.register(Dentist)
 class DentistAdmin(admin.ModelAdmin):
+    query_budget = CHANGELIST_BUDGET
     list_display = ('user', 'specialization', 'experience', 'qualification')
     search_fields = ('user__username', 'user__email', 'specialization')
 
 @admin.register(Patient)
 class PatientAdmin(admin.ModelAdmin):
+    query_budget = CHANGELIST_BUDGET
     list_display = ('user', 'emergency_contact', 'allergies', 'member_since')
     search_fields = ('user__username', 'user__email', 'allergies')
     list_filter = ('member_since',)
 
 
 @admin.register(DentalImage)
-class DentalImageAdmin(admin.ModelAdmin):
+class DentalImageAdmin(TombstoneDeleteMixin, admin.ModelAdmin):
+    query_budget = CHANGELIST_BUDGET
     list_display = ('id', 'image_url', 'uploaded_at')
     list_filter = ('uploaded_at',)
 
@@ -87,6 +105,7 @@ class DentalImageAdmin(admin.ModelAdmin):
 
 @admin.register(Disease)
 class DiseaseAdmin(admin.ModelAdmin):
+    query_budget = CHANGELIST_BUDGET
     list_display = ('name', 'description')
     search_fields = ('name',)
 
@@ -94,37 +113,55 @@ class ImageClassificationInline(admin.TabularInline):
     model = ImageClassification
     extra = 1
 
+class DetectionCountInline(admin.TabularInline):
+    model = DetectionCount
+    extra = 0
+
 @admin.register(ImageAnalysis)
-class ImageAnalysisAdmin(admin.ModelAdmin):
+class ImageAnalysisAdmin(TombstoneDeleteMixin, admin.ModelAdmin):
+    query_budget = CHANGELIST_BUDGET
     list_display = ('id', 'user', 'original_image', 'analyzed_image_url', 
-                   'image_type','created_at','total_conditions', 'calculus_count', 'caries_count', 
-                       'gingivitis_count', 'hypodontia_count', 'tooth_discolation_count', 
-                       'ulcer_count','calculus_count', 'caries_count', 'gingivitis_count',
-            'hypodontia_count', 'tooth_discolation_count', 'ulcer_count',
-            'cavity_count', 'fillings_count', 'impacted_tooth_count', 'implant_count',  )
+                   'image_type','created_at','total_conditions', 'detections')
     list_filter = ('created_at',)
     search_fields = ('user__username', 'user__email')
-    inlines = [ImageClassificationInline]
-    readonly_fields = ('total_conditions', 'calculus_count', 'caries_count', 
-                       'gingivitis_count', 'hypodontia_count', 'tooth_discolation_count', 
-                       'ulcer_count','calculus_count', 'caries_count', 'gingivitis_count',
-            'hypodontia_count', 'tooth_discolation_count', 'ulcer_count',
-            'cavity_count', 'fillings_count', 'impacted_tooth_count', 'implant_count')
+    inlines = [ImageClassificationInline, DetectionCountInline]
+    readonly_fields = ('total_conditions',)
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).select_related('user', 'original_image').prefetch_related('detection_counts')
+
+    def detections(self, obj):
+        return ", ".join(f"{name}: {count}" for name, count in obj.count_map().items())
+
+    def save_related(self, request, form, formsets, change):
+        super().save_related(request, form, formsets, change)
+        # Inline edits change the cached serialized form
+        invalidate_analysis_fragment(form.instance.pk, form.instance.created_at)
 
 @admin.register(Appointment)
-class AppointmentAdmin(admin.ModelAdmin):
+class AppointmentAdmin(TombstoneDeleteMixin, admin.ModelAdmin):
+    query_budget = CHANGELIST_BUDGET
     list_display = ('id', 'patient', 'dentist', 'detail','date', 'start_time', 'end_time', 'treatment','approved', 'analyzed_image_id')
     list_filter = ('approved', 'date')
     search_fields = ('patient__user__username', 'dentist__user__username')
 
+@admin.register(DentistPatient)
+class DentistPatientAdmin(admin.ModelAdmin):
+    query_budget = CHANGELIST_BUDGET
+    list_display = ('dentist', 'patient', 'first_visit', 'last_visit', 'visit_count')
+    list_select_related = ('dentist__user', 'patient__user')
+    search_fields = ('patient__user__username', 'dentist__user__username')
+
 @admin.register(Treatment)
 class TreatmentAdmin(admin.ModelAdmin):
+    query_budget = CHANGELIST_BUDGET
     list_display = ('id', 'patient', 'dentist', 'date')
     list_filter = ('date',)
     search_fields = ('patient__user__username', 'dentist__user__username', 'detail')
 
 @admin.register(WorkSchedule)
 class WorkScheduleAdmin(admin.ModelAdmin):
+    query_budget = CHANGELIST_BUDGET
     list_display = ['dentist', 'day', 'start_hour', 'end_hour']
     list_filter = ['day']
     search_fields = ['dentist__user__first_name', 'dentist__user__last_name', 'day']
@@ -0,0 +1,60 @@
+# api/async_api.py
+"""
+Async dispatch for DRF views, for the read endpoints served under ASGI
+(crud.asgi:application).
+
+DRF's APIView.dispatch is synchronous, so an ``async def get`` on a plain
+view would hand Django an un-awaited coroutine. AsyncAPIMixin swaps in an
+async dispatch: authentication, permissions and throttles (which may read
+the session or user tables) run through sync_to_async, ``async def``
+handlers are awaited on the event loop and use the async ORM, and the
+remaining sync handlers (writes, ?fields=/?expand= shapes) run in a thread
+exactly as before.
+
+Django's async ORM still executes each query in a thread; what the event
+loop saves is the thread held around everything else in the request.
+Under WSGI Django runs these views through async_to_sync, which works but
+costs an extra hop per request.
+"""
+from functools import update_wrapper
+
+from asgiref.sync import iscoroutinefunction, sync_to_async
+
+
+class AsyncAPIMixin:
+    view_is_async = True
+
+    @classmethod
+    def as_view(cls, *args, **kwargs):
+        view = super().as_view(*args, **kwargs)
+        if iscoroutinefunction(view):
+            return view
+
+        # ViewSetMixin.as_view wraps dispatch() in a plain function; await its coroutine
+        async def async_view(request, *args, **kwargs):
+            return await view(request, *args, **kwargs)
+
+        return update_wrapper(async_view, view)
+
+    async def dispatch(self, request, *args, **kwargs):
+        self.args = args
+        self.kwargs = kwargs
+        request = self.initialize_request(request, *args, **kwargs)
+        self.request = request
+        self.headers = self.default_response_headers
+
+        try:
+            await sync_to_async(self.initial)(request, *args, **kwargs)
+            if request.method.lower() in self.http_method_names:
+                handler = getattr(self, request.method.lower(), self.http_method_not_allowed)
+            else:
+                handler = self.http_method_not_allowed
+            if iscoroutinefunction(handler):
+                response = await handler(request, *args, **kwargs)
+            else:
+                response = await sync_to_async(handler)(request, *args, **kwargs)
+        except Exception as exc:
+            response = self.handle_exception(exc)
+
+        self.response = self.finalize_response(request, response, *args, **kwargs)
+        return self.response
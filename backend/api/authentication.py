@@ -0,0 +1,86 @@
+# api/authentication.py
+from django.core.cache import cache
+from django.utils.translation import gettext_lazy as _
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.utils import get_md5_hash_password
+
+from .caching import AUTH_USER_TIMEOUT, auth_user_key, auth_user_version
+from .replicas import primary
+
+
+PROFILE_RELATIONS = ('patient', 'dentist')
+
+
+class CachedJWTAuthentication(JWTAuthentication):
+    """
+    JWTAuthentication that resolves the user from the cache instead of the
+    database. The entry holds the User's columns except the password hash,
+    plus the ids of its patient/dentist profile; request.user.patient /
+    .dentist come back as id-only instances (enough for hasattr(), .pk and
+    foreign keys) whose other fields load on first access. Entries are keyed
+    by the user's token version, which User/Patient/Dentist saves and
+    deletes bump (see api/caching.py).
+
+    With the per-process LocMem default cache, a bump is only seen by the
+    worker that made it: other workers keep authenticating from their
+    entry, for at most AUTH_USER_TIMEOUT seconds, a user that was since
+    deactivated or deleted. Set CACHE_URL to share the stamps.
+    """
+    def get_user(self, validated_token):
+        try:
+            user_id = validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError as e:
+            raise InvalidToken(_("Token contained no recognizable user identification")) from e
+
+        key = auth_user_key(user_id, auth_user_version(user_id))
+        entry = cache.get(key)
+        if entry is None:
+            try:
+                # Cached under the current version, so never from a lagging replica
+                with primary():
+                    user = self.user_model.objects.select_related(*PROFILE_RELATIONS).get(
+                        **{api_settings.USER_ID_FIELD: user_id}
+                    )
+            except self.user_model.DoesNotExist as e:
+                raise AuthenticationFailed(_("User not found"), code="user_not_found") from e
+            entry = self.cache_entry(user)
+            cache.set(key, entry, AUTH_USER_TIMEOUT)
+        user = self.user_from_entry(entry)
+
+        if api_settings.CHECK_USER_IS_ACTIVE and not user.is_active:
+            raise AuthenticationFailed(_("User is inactive"), code="user_inactive")
+
+        if api_settings.CHECK_REVOKE_TOKEN:
+            if validated_token.get(api_settings.REVOKE_TOKEN_CLAIM) != entry['password_hash']:
+                raise AuthenticationFailed(_("The user's password has been changed."), code="password_changed")
+
+        return user
+
+    def cache_entry(self, user):
+        return {
+            'db': user._state.db,
+            'values': {
+                field.attname: getattr(user, field.attname)
+                for field in user._meta.concrete_fields if field.attname != 'password'
+            },
+            'profiles': {
+                name: getattr(user, name).pk if hasattr(user, name) else None for name in PROFILE_RELATIONS
+            },
+            'password_hash': get_md5_hash_password(user.password) if api_settings.CHECK_REVOKE_TOKEN else None,
+        }
+
+    def user_from_entry(self, entry):
+        """A User with the password deferred and id-only profiles, built from a cache entry."""
+        db, values = entry['db'], entry['values']
+        user = self.user_model.from_db(db, list(values), list(values.values()))
+        for name, pk in entry['profiles'].items():
+            relation = self.user_model._meta.get_field(name)
+            profile = None
+            if pk is not None:
+                profile = relation.related_model.from_db(db, [relation.field.attname], [pk])
+                relation.field.set_cached_value(profile, user)
+            # Cached None: hasattr(user, 'patient') is False without a query
+            relation.set_cached_value(user, profile)
+        return user
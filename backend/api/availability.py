@@ -0,0 +1,118 @@
+# api/availability.py
+"""
+Free-slot computation for a dentist.
+
+Working hours come from WorkSchedule (one row per weekday, hours stored as
+strings); booked intervals come from Appointment. Each day's free intervals
+are cached per dentist and day and dropped when an appointment on that day
+or the dentist's schedule changes, or after AVAILABILITY_CACHE_SECONDS
+(see api/caching.py).
+"""
+from datetime import time, timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+
+from .caching import availability_key, availability_version
+from .models import Appointment, WorkSchedule
+from .replicas import primary
+
+MAX_RANGE_DAYS = 62
+
+
+def _minutes(value):
+    return value.hour * 60 + value.minute
+
+
+def _as_time(minutes):
+    return time(minutes // 60, minutes % 60)
+
+
+def subtract_intervals(free, busy):
+    """
+    Remove `busy` intervals from the sorted, non-overlapping `free` intervals.
+    Both are lists of (start, end) minute pairs; `busy` must be sorted by start.
+    Runs in one merge pass, O(len(free) + len(busy)).
+    """
+    result = []
+    i = 0
+    for start, end in free:
+        cursor = start
+        # Skip bookings that end before this free interval starts
+        while i < len(busy) and busy[i][1] <= cursor:
+            i += 1
+        j = i
+        while j < len(busy) and busy[j][0] < end:
+            busy_start, busy_end = busy[j]
+            if busy_start > cursor:
+                result.append((cursor, busy_start))
+            cursor = max(cursor, busy_end)
+            j += 1
+        if cursor < end:
+            result.append((cursor, end))
+    return result
+
+
+def _working_hours(dentist_id):
+    hours = {}
+    for schedule in WorkSchedule.objects.filter(dentist_id=dentist_id):
+        try:
+            start, end = int(schedule.start_hour), int(schedule.end_hour)
+        except ValueError:
+            continue
+        if 0 <= start < end <= 24:
+            hours[schedule.day.strip().lower()] = (start * 60, end * 60)
+    return hours
+
+
+def free_intervals(dentist_id, date_from, date_to):
+    """
+    Map each date in [date_from, date_to] to its free (start, end) minute pairs.
+    Uncached days are filled from a single appointment range query.
+    """
+    days = [date_from + timedelta(days=n) for n in range((date_to - date_from).days + 1)]
+    version = availability_version(dentist_id)
+    keys = {availability_key(dentist_id, day, version): day for day in days}
+    cached = cache.get_many(keys.keys())
+    result = {keys[key]: value for key, value in cached.items()}
+
+    missing = [day for day in days if day not in result]
+    if missing:
+        # Cached under the current version: read from the primary, not a lagging replica
+        with primary():
+            hours = _working_hours(dentist_id)
+            booked = list(Appointment.objects.filter(
+                dentist_id=dentist_id, date__range=(missing[0], missing[-1])
+            ).order_by('date', 'start_time').values_list('date', 'start_time', 'end_time'))
+        busy = {day: [] for day in missing}
+        for day, start, end in booked:
+            if day in busy:
+                busy[day].append((_minutes(start), _minutes(end)))
+
+        computed = {}
+        for day in missing:
+            window = hours.get(day.strftime('%A').lower())
+            computed[day] = subtract_intervals([window], busy[day]) if window else []
+        cache.set_many(
+            {availability_key(dentist_id, day, version): value for day, value in computed.items()},
+            settings.AVAILABILITY_CACHE_SECONDS,
+        )
+        result.update(computed)
+    return result
+
+
+def open_slots(dentist_id, date_from, date_to, duration):
+    """Slots of `duration` minutes, laid back to back inside each free interval."""
+    availability = []
+    for day, intervals in sorted(free_intervals(dentist_id, date_from, date_to).items()):
+        slots = []
+        for start, end in intervals:
+            cursor = start
+            while cursor + duration <= end:
+                slots.append({
+                    'start_time': _as_time(cursor).strftime('%H:%M'),
+                    'end_time': _as_time(cursor + duration).strftime('%H:%M') if cursor + duration < 24 * 60 else '24:00',
+                })
+                cursor += duration
+        availability.append({'date': day.isoformat(), 'slots': slots})
+    return availability
@@ -0,0 +1,119 @@
+# api/batch.py
+"""
+Batched API calls: several sub-requests in one HTTP round-trip.
+
+Each sub-request is resolved through the URL conf and dispatched straight
+to its view, skipping the middleware stack. The batch request's user and
+token are forced onto every sub-request, so the JWT is verified and the
+user resolved once. Consecutive GETs run concurrently; any other method
+is a barrier, so a GET listed after a write sees that write.
+"""
+import io
+import json
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+from asgiref.sync import async_to_sync, iscoroutinefunction
+from django.core.handlers.wsgi import WSGIRequest
+from django.db import connections
+from django.http.request import split_domain_port
+from django.urls import Resolver404, resolve
+from rest_framework.response import Response
+
+logger = logging.getLogger('api.batch')
+
+BATCH_MAX_REQUESTS = 20
+BATCH_MAX_WORKERS = 4
+BATCH_PATH_PREFIX = '/api/'
+BATCH_PATH = '/api/batch/'
+
+
+def _sub_request(request, method, path, body):
+    url = urlsplit(path)
+    payload = json.dumps(body).encode() if body is not None else b''
+    environ = {
+        key: value for key, value in request.META.items()
+        if key.startswith(('HTTP_', 'SERVER_', 'REMOTE_', 'wsgi.')) and not key.startswith('HTTP_IF_')
+    }
+    # ASGI requests have no wsgi.* keys; without them the sub-request's URLs come out as None://host/
+    server_name, server_port = split_domain_port(request.get_host())
+    environ.update({
+        'wsgi.url_scheme': request.scheme,
+        'SERVER_NAME': server_name,
+        'SERVER_PORT': server_port or ('443' if request.is_secure() else '80'),
+        'REQUEST_METHOD': method,
+        'PATH_INFO': url.path,
+        'SCRIPT_NAME': '',
+        'QUERY_STRING': url.query,
+        'CONTENT_TYPE': 'application/json',
+        'CONTENT_LENGTH': str(len(payload)),
+        'wsgi.input': io.BytesIO(payload),
+    })
+    sub_request = WSGIRequest(environ)
+    # Picked up by rest_framework.request.Request: reuse the batch's authentication
+    sub_request._force_auth_user = request.user
+    sub_request._force_auth_token = request.auth
+    return sub_request
+
+
+def _body(response):
+    if isinstance(response, Response):
+        return response.data
+    content = getattr(response, 'content', b'')
+    if not content:
+        return None
+    if response.get('Content-Type', '').startswith('application/json'):
+        return json.loads(content)
+    return content.decode(response.charset or 'utf-8', errors='replace')
+
+
+def _dispatch(request, item):
+    path = item['path']
+    if not path.startswith(BATCH_PATH_PREFIX) or urlsplit(path).path == BATCH_PATH:
+        return {'status': 400, 'body': {'detail': f"Only {BATCH_PATH_PREFIX} endpoints can be batched."}}
+    try:
+        match = resolve(urlsplit(path).path)
+    except Resolver404:
+        return {'status': 404, 'body': {'detail': 'Not found.'}}
+    view = async_to_sync(match.func) if iscoroutinefunction(match.func) else match.func
+    try:
+        response = view(_sub_request(request, item['method'], path, item.get('body')), *match.args, **match.kwargs)
+    except Exception:
+        # The exception text can hold internals (SQL, paths); it goes to the log only
+        logger.exception("Batch sub-request %s %s failed", item['method'], path)
+        return {'status': 500, 'body': {'detail': 'Internal server error.'}}
+    return {'status': response.status_code, 'body': _body(response)}
+
+
+def _dispatch_in_thread(request, item):
+    try:
+        return _dispatch(request, item)
+    finally:
+        connections.close_all()
+
+
+def run_batch(request, items):
+    """Dispatch the validated sub-requests and return their results in order."""
+    results = [None] * len(items)
+    pending_gets = []
+
+    def flush():
+        if len(pending_gets) == 1:
+            index = pending_gets[0]
+            results[index] = _dispatch(request, items[index])
+        elif pending_gets:
+            with ThreadPoolExecutor(max_workers=min(BATCH_MAX_WORKERS, len(pending_gets))) as pool:
+                futures = {index: pool.submit(_dispatch_in_thread, request, items[index]) for index in pending_gets}
+            for index, future in futures.items():
+                results[index] = future.result()
+        pending_gets.clear()
+
+    for index, item in enumerate(items):
+        if item['method'] == 'GET':
+            pending_gets.append(index)
+            continue
+        flush()
+        results[index] = _dispatch(request, item)
+    flush()
+    return [{'id': item.get('id', index), **result} for index, (item, result) in enumerate(zip(items, results))]
@@ -0,0 +1,156 @@
+# api/booking.py
+"""
+Atomic appointment booking.
+
+The overlap check and the write run in one transaction while holding a
+per-dentist lock: the Dentist row is locked with SELECT ... FOR UPDATE
+(PostgreSQL/MySQL), and a process-local lock covers SQLite, which has no
+row locks. Two requests for the same slot therefore cannot both pass the
+check before either has written.
+"""
+import threading
+from contextlib import contextmanager, ExitStack
+
+from django.db import transaction
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.exceptions import APIException
+
+from .caching import invalidate_availability_day
+from .events import publish_appointment_events
+from .models import Appointment, Dentist, DentistPatient, Tombstone
+
+_locks_guard = threading.Lock()
+_dentist_locks = {}
+
+
+class SlotUnavailable(APIException):
+    # An APIException so any view that lets it escape still answers 409
+    status_code = status.HTTP_409_CONFLICT
+    default_detail = "The dentist already has an appointment at this time."
+    default_code = 'slot_unavailable'
+
+
+def _process_lock(dentist_id):
+    with _locks_guard:
+        return _dentist_locks.setdefault(dentist_id, threading.Lock())
+
+
+@contextmanager
+def dentist_lock(dentist_id):
+    """Serialize writes to one dentist's calendar for the duration of the block."""
+    with _process_lock(dentist_id):
+        with transaction.atomic():
+            list(Dentist.objects.select_for_update().filter(pk=dentist_id).values_list('pk'))
+            yield
+
+
+def overlapping(dentist_id, day, start_time, end_time, exclude_pk=None):
+    # Served by the (dentist, date, start_time) index
+    queryset = Appointment.objects.filter(
+        dentist_id=dentist_id, date=day,
+        start_time__lt=end_time, end_time__gt=start_time,
+    )
+    if exclude_pk is not None:
+        queryset = queryset.exclude(pk=exclude_pk)
+    return queryset.exists()
+
+
+def save_booking(serializer):
+    """Save an AppointmentSerializer, refusing slots that overlap an existing appointment."""
+    instance = serializer.instance
+    data = serializer.validated_data
+    if instance is not None and not {'dentist', 'date', 'start_time', 'end_time'} & set(data):
+        return serializer.save()
+
+    dentist = data.get('dentist', instance.dentist if instance else None)
+    day = data.get('date', instance.date if instance else None)
+    start_time = data.get('start_time', instance.start_time if instance else None)
+    end_time = data.get('end_time', instance.end_time if instance else None)
+
+    with dentist_lock(dentist.pk):
+        if overlapping(dentist.pk, day, start_time, end_time, exclude_pk=instance.pk if instance else None):
+            raise SlotUnavailable("The dentist already has an appointment at this time.")
+        return serializer.save()
+
+
+def _scope(user):
+    if user.role == 'dentist':
+        return Appointment.objects.filter(dentist_id=user.pk)
+    if user.role == 'patient':
+        return Appointment.objects.filter(patient_id=user.pk)
+    return Appointment.objects.none()
+
+
+def apply_bulk_operations(user, operations):
+    """
+    Apply approve/reschedule/cancel operations for `user` in one transaction.
+
+    Ownership is checked with a single query; approvals are one UPDATE and
+    cancellations one DELETE. Reschedules are checked for overlaps under the
+    dentist lock and written one UPDATE each. Returns {id: status}.
+    """
+    ids = [operation['id'] for operation in operations]
+    rows = {
+        row['id']: row for row in _scope(user).filter(pk__in=ids).values(
+            'id', 'dentist_id', 'patient_id', 'date', 'start_time', 'end_time', 'approved'
+        )
+    }
+    results = {pk: 'not_found' for pk in ids if pk not in rows}
+    by_op = {'approve': [], 'reschedule': [], 'cancel': []}
+    for operation in operations:
+        if operation['id'] not in rows:
+            continue
+        if operation['op'] == 'approve' and user.role != 'dentist':
+            results[operation['id']] = 'forbidden'
+            continue
+        by_op[operation['op']].append(operation)
+
+    moved = [rows[operation['id']] for operation in by_op['cancel'] + by_op['reschedule']]
+    touched = {(row['dentist_id'], row['patient_id']) for row in moved}
+    days = {(row['dentist_id'], row['date']) for row in moved}
+    dentist_ids = sorted({row['dentist_id'] for row in moved})
+
+    with ExitStack() as stack:
+        # Lock in a stable order so two bulk requests cannot deadlock
+        for dentist_id in dentist_ids:
+            stack.enter_context(dentist_lock(dentist_id))
+
+        cancel_ids = [operation['id'] for operation in by_op['cancel']]
+        if cancel_ids:
+            Tombstone.record_appointments(Appointment.objects.filter(pk__in=cancel_ids))
+            Appointment.objects.filter(pk__in=cancel_ids).delete()
+            results.update({pk: 'cancelled' for pk in cancel_ids})
+            publish_appointment_events('deleted', [rows[pk] for pk in cancel_ids])
+
+        approve_ids = [operation['id'] for operation in by_op['approve']]
+        if approve_ids:
+            Appointment.objects.filter(pk__in=approve_ids).update(approved=True, updated_at=timezone.now())
+            results.update({pk: 'approved' for pk in approve_ids})
+            publish_appointment_events('approved', [dict(rows[pk], approved=True) for pk in approve_ids])
+
+        for operation in by_op['reschedule']:
+            pk, dentist_id = operation['id'], rows[operation['id']]['dentist_id']
+            if overlapping(dentist_id, operation['date'], operation['start_time'], operation['end_time'], exclude_pk=pk):
+                results[pk] = 'conflict'
+                continue
+            Appointment.objects.filter(pk=pk).update(
+                date=operation['date'],
+                start_time=operation['start_time'],
+                end_time=operation['end_time'],
+                updated_at=timezone.now(),
+            )
+            days.add((dentist_id, operation['date']))
+            results[pk] = 'rescheduled'
+            publish_appointment_events('updated', [dict(
+                rows[pk], date=operation['date'],
+                start_time=operation['start_time'], end_time=operation['end_time'],
+            )])
+
+        # Queryset update()/delete() skip Appointment.save()/delete(), so
+        # refresh the derived data here
+        for dentist_id, patient_id in touched:
+            DentistPatient.refresh(dentist_id, patient_id)
+    for dentist_id, day in days:
+        invalidate_availability_day(dentist_id, day)
+    return results
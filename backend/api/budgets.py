@@ -0,0 +1,187 @@
+# api/budgets.py
+"""
+Per-endpoint SQL query and wall-time budgets.
+
+A view declares its budget next to its code:
+
+    class DashboardStatsView(APIView):
+        query_budget = QueryBudget(queries=10, ms=300)
+
+or one per action (ViewSets), per method (APIViews) or per admin view
+('changelist', 'change', ...) on a ModelAdmin:
+
+    query_budget = {'list': QueryBudget(queries=4), 'retrieve': QueryBudget(queries=3)}
+
+The budget-harness tests in api/test.py call every endpoint against a
+seeded dataset and fail when one goes over. QueryBudgetMiddleware applies
+the same budgets to live traffic when QUERY_BUDGET_MODE is 'log': an
+over-budget request is logged to 'api.budgets' with its most repeated
+query fingerprints, which is where an N+1 shows up. Wall-time budgets are
+multiplied by QUERY_BUDGET_TIME_SCALE for slower machines.
+
+Queries are counted by an execute wrapper installed on every connection,
+reporting to a ContextVar, so async views (whose ORM calls run through
+sync_to_async) are counted too. Outside a recorded block it costs one
+ContextVar lookup per query.
+"""
+import logging
+import re
+import time
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import connections
+from django.db.backends.signals import connection_created
+
+logger = logging.getLogger('api.budgets')
+
+_recorder = ContextVar('query_recorder', default=None)
+
+_LITERAL = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+_PLACEHOLDER_LIST = re.compile(r'\(\s*\?(?:\s*,\s*\?)+\s*\)')
+_WHITESPACE = re.compile(r'\s+')
+
+
+class QueryBudget:
+    def __init__(self, queries, ms=500):
+        self.queries = queries
+        self.ms = ms
+
+    def __repr__(self):
+        return f'QueryBudget(queries={self.queries}, ms={self.ms})'
+
+    def violations(self, recorder):
+        """Why `recorder` is over this budget; empty when it is within."""
+        problems = []
+        if recorder.count > self.queries:
+            problems.append(f'{recorder.count} queries (budget {self.queries})')
+        limit = self.ms * settings.QUERY_BUDGET_TIME_SCALE
+        if recorder.ms > limit:
+            problems.append(f'{recorder.ms:.0f} ms (budget {limit:.0f} ms)')
+        return problems
+
+
+def fingerprint(sql):
+    """`sql` with literals and parameters replaced by ?, and IN lists collapsed."""
+    sql = _LITERAL.sub('?', sql.replace('%s', '?'))
+    sql = _PLACEHOLDER_LIST.sub('(...)', sql)
+    return _WHITESPACE.sub(' ', sql).strip()
+
+
+class QueryRecorder:
+    def __init__(self, parent=None):
+        # An enclosing recorder (a test around the middleware's) sees the same queries
+        self.parent = parent
+        self.queries = []
+        self.started = time.perf_counter()
+        self.finished = None
+
+    @property
+    def count(self):
+        return len(self.queries)
+
+    @property
+    def ms(self):
+        return ((self.finished or time.perf_counter()) - self.started) * 1000
+
+    def fingerprints(self, limit=5):
+        """The `limit` most repeated query shapes as (count, fingerprint)."""
+        counts = Counter(fingerprint(sql) for sql in self.queries)
+        return [(count, sql) for sql, count in counts.most_common(limit)]
+
+
+def _record(execute, sql, params, many, context):
+    recorder = _recorder.get()
+    while recorder is not None:
+        recorder.queries.append(sql)
+        recorder = recorder.parent
+    return execute(sql, params, many, context)
+
+
+def _install(sender=None, connection=None, **kwargs):
+    # First in the list: execute_wrapper() blocks pop the last entry on exit
+    if _record not in connection.execute_wrappers:
+        connection.execute_wrappers.insert(0, _record)
+
+
+def install():
+    """Count queries on every connection, including ones opened later."""
+    connection_created.connect(_install, dispatch_uid='api.budgets')
+    for connection in connections.all(initialized_only=True):
+        _install(connection=connection)
+
+
+@contextmanager
+def record_queries():
+    """Record the queries and wall time of the block."""
+    install()
+    recorder = QueryRecorder(parent=_recorder.get())
+    token = _recorder.set(recorder)
+    try:
+        yield recorder
+    finally:
+        recorder.finished = time.perf_counter()
+        _recorder.reset(token)
+
+
+def budget_for(resolver_match, method):
+    """The QueryBudget declared for the view `resolver_match` points at, or None."""
+    if resolver_match is None:
+        return None
+    func = resolver_match.func
+    owner = getattr(func, 'model_admin', None) or getattr(func, 'cls', None) or getattr(func, 'view_class', None)
+    budget = getattr(owner, 'query_budget', None)
+    if isinstance(budget, dict):
+        if hasattr(func, 'model_admin'):
+            key = resolver_match.url_name.rsplit('_', 1)[-1]
+        elif getattr(func, 'actions', None):
+            key = func.actions.get(method.lower())
+        else:
+            key = method.lower()
+        budget = budget.get(key)
+    return budget
+
+
+class QueryBudgetMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.enabled = settings.QUERY_BUDGET_MODE == 'log'
+        if self.enabled:
+            install()
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        if not self.enabled:
+            return self.get_response(request)
+        with record_queries() as recorder:
+            response = self.get_response(request)
+        self.check(request, recorder)
+        return response
+
+    async def __acall__(self, request):
+        if not self.enabled:
+            return await self.get_response(request)
+        with record_queries() as recorder:
+            response = await self.get_response(request)
+        self.check(request, recorder)
+        return response
+
+    def check(self, request, recorder):
+        budget = budget_for(getattr(request, 'resolver_match', None), request.method)
+        if budget is None:
+            return
+        problems = budget.violations(recorder)
+        if problems:
+            logger.warning(
+                "%s %s over budget: %s\n%s", request.method, request.path, ', '.join(problems),
+                '\n'.join(f'  {count}x {sql}' for count, sql in recorder.fingerprints()),
+            )
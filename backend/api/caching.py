@@ -0,0 +1,123 @@
+# api/caching.py
+"""
+Cache keys and invalidation helpers.
+
+Kept free of model imports so models.py can call the invalidation hooks
+from save()/delete() without a circular import.
+"""
+import time
+
+from django.core.cache import cache, caches
+
+def _version(key):
+    version = cache.get(key)
+    if version is None:
+        version = 1
+        cache.add(key, version, None)
+    return version
+
+
+def _bump(key):
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.set(key, 2, None)
+
+
+# Availability: one entry per dentist and day, versioned per dentist so a
+# schedule change drops every day at once. Entries live for
+# settings.AVAILABILITY_CACHE_SECONDS: with the per-process default cache
+# the invalidation only reaches the worker that wrote, so the others can
+# show a booked slot as free until then (booking it still answers 409).
+
+def availability_version(dentist_id):
+    return _version(f'availability:version:{dentist_id}')
+
+
+def availability_key(dentist_id, day, version):
+    return f'availability:{dentist_id}:v{version}:{day}'
+
+
+def invalidate_availability_day(dentist_id, day):
+    cache.delete(availability_key(dentist_id, day, availability_version(dentist_id)))
+
+
+def invalidate_availability(dentist_id):
+    _bump(f'availability:version:{dentist_id}')
+
+
+def _stamp(key):
+    """
+    Version stamp in unix seconds. Unlike _version(), a stamp that is
+    evicted comes back larger than any value handed out before.
+    """
+    stamp = cache.get(key)
+    if stamp is None:
+        stamp = int(time.time())
+        if not cache.add(key, stamp, None):
+            stamp = cache.get(key, stamp)
+    return stamp
+
+
+def _restamp(key):
+    cache.set(key, max(int(time.time()), cache.get(key, 0) + 1), None)
+
+
+# Dentist directory: a single stamp drives ETag/Last-Modified and the
+# rendered-body cache keys.
+
+DIRECTORY_VERSION_KEY = 'directory:version'
+DIRECTORY_TIMEOUT = 60 * 60
+
+
+def directory_version():
+    return _stamp(DIRECTORY_VERSION_KEY)
+
+
+def directory_body_key(version, variant):
+    return f'directory:body:{version}:{variant}'
+
+
+def invalidate_directory():
+    _restamp(DIRECTORY_VERSION_KEY)
+
+
+# Authenticated users: the User row with its patient/dentist profile,
+# cached per user under a token version that every save/delete bumps
+# (password change, profile edit, account deletion).
+
+AUTH_USER_TIMEOUT = 60
+
+
+def auth_user_version(user_id):
+    return _stamp(f'auth:version:{user_id}')
+
+
+def auth_user_key(user_id, version):
+    return f'auth:user:{user_id}:v{version}'
+
+
+def invalidate_auth_user(user_id):
+    _restamp(f'auth:version:{user_id}')
+
+
+# Serialized ImageAnalysis fragments. An analysis does not change once
+# AnalyzeImageView has written it, so entries carry no version; created_at
+# is part of the key so a reused primary key can never hit a stale entry.
+# Fragments are request independent (relative file URLs).
+
+FRAGMENT_CACHE_ALIAS = 'fragments'
+ANALYSIS_FRAGMENT_TIMEOUT = 24 * 60 * 60
+
+
+def fragment_cache():
+    return caches[FRAGMENT_CACHE_ALIAS]
+
+
+def analysis_fragment_key(analysis_id, created_at):
+    stamp = created_at.timestamp() if created_at is not None else 'none'
+    return f'analysis:fragment:{analysis_id}:{stamp}'
+
+
+def invalidate_analysis_fragment(analysis_id, created_at):
+    fragment_cache().delete(analysis_fragment_key(analysis_id, created_at))
@@ -0,0 +1,56 @@
+# api/detection_classes.py
+"""
+Registry of the detection classes each YOLO model can emit.
+
+Adding a class only means adding it here; counts are stored per class in
+DetectionCount, so no new column or migration is needed.
+"""
+
+# Model weights per image type, relative to BASE_DIR/model
+MODEL_FILES = {
+    'normal': 'best_model.pt',
+    'xray': 'x-ray_model.pt',
+}
+
+# Class name -> box colour, per image type
+DETECTION_CLASSES = {
+    'normal': {
+        "calculus": "#FFD700",
+        "caries": "#FF0000",
+        "gingivitis": "#FF69B4",
+        "hypodontia": "#800080",
+        "tooth_discolation": "#A0522D",
+        "ulcer": "#FFA500",
+    },
+    'xray': {
+        "cavity": "#FF0000",
+        "fillings": "#0000FF",
+        "impacted_tooth": "#00FF00",
+        "implant": "#800080",
+    },
+}
+
+# Raw model labels that differ from our class names
+CLASS_NAME_ALIASES = {
+    'calculuss': 'calculus',
+    'tooth_discolations': 'tooth_discolation',
+    'fillings': 'fillings',
+    'impacted tooth': 'impacted_tooth',
+}
+
+ALL_CLASS_NAMES = [name for classes in DETECTION_CLASSES.values() for name in classes]
+
+
+def class_names_for(image_type):
+    return list(DETECTION_CLASSES.get(image_type, DETECTION_CLASSES['normal']))
+
+
+def normalize_class_name(raw_name):
+    name = raw_name.lower()
+    return CLASS_NAME_ALIASES.get(name, name)
+
+
+def camel_case_count_key(class_name):
+    """'impacted_tooth' -> 'impactedToothCount' (AnalyzeImageView response keys)."""
+    head, *rest = class_name.split('_')
+    return head + ''.join(part.capitalize() for part in rest) + 'Count'
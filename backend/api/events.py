@@ -0,0 +1,202 @@
+# api/events.py
+"""
+Per-user push of appointment events, streamed as Server-Sent Events from
+an async view (serve crud.asgi:application under an ASGI server).
+
+Writers call publish_appointment_events(); once the transaction commits
+the events go to the broker, which fans them out to every open stream of
+the patient and dentist involved. The default InProcessBroker gives each
+connection a bounded asyncio.Queue, so an idle subscriber costs a
+suspended coroutine rather than a thread. It only reaches streams held by
+the worker that published; with several workers set EVENT_BROKER_URL, which
+switches EVENT_BROKER to RedisBroker: events go through Redis pub/sub and
+a listener thread in each worker hands them to its own streams.
+
+EventSource cannot send an Authorization header, and a JWT in the query
+string ends up in access logs. Clients POST to the ticket endpoint with
+their token and open the stream with ?ticket=: a signed ticket that is
+valid for STREAM_TICKET_SECONDS and accepted once. The stream ends when
+the access token it was issued for expires.
+
+Kept free of model imports so models.py can publish from save()/delete().
+"""
+import asyncio
+import json
+import logging
+import secrets
+import threading
+from collections import defaultdict
+
+from django.conf import settings
+from django.core import signing
+from django.core.cache import cache
+from django.db import transaction
+from django.utils.module_loading import import_string
+
+logger = logging.getLogger('api.events')
+
+EVENT_QUEUE_SIZE = 100
+EVENT_KEEPALIVE_SECONDS = 20
+STREAM_TICKET_SECONDS = 30
+_TICKET_SALT = 'api.events.ticket'
+
+
+class Subscription:
+    def __init__(self, user_id, loop):
+        self.user_id = user_id
+        self.loop = loop
+        self.queue = asyncio.Queue(maxsize=EVENT_QUEUE_SIZE)
+
+    def push(self, event):
+        # A consumer this far behind should resync (/api/sync/); keep the newest events
+        if self.queue.full():
+            self.queue.get_nowait()
+        self.queue.put_nowait(event)
+
+    async def get(self):
+        return await self.queue.get()
+
+
+class InProcessBroker:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscriptions = defaultdict(set)
+
+    def subscribe(self, user_id):
+        subscription = Subscription(user_id, asyncio.get_running_loop())
+        with self._lock:
+            self._subscriptions[user_id].add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            subscriptions = self._subscriptions.get(subscription.user_id)
+            if subscriptions is not None:
+                subscriptions.discard(subscription)
+                if not subscriptions:
+                    del self._subscriptions[subscription.user_id]
+
+    def subscriber_count(self):
+        with self._lock:
+            return sum(len(subscriptions) for subscriptions in self._subscriptions.values())
+
+    def publish(self, user_ids, event):
+        """Thread safe; callable from sync views and from the event loop."""
+        with self._lock:
+            targets = [
+                subscription for user_id in set(user_ids)
+                for subscription in self._subscriptions.get(user_id, ())
+            ]
+        for subscription in targets:
+            try:
+                subscription.loop.call_soon_threadsafe(subscription.push, event)
+            except RuntimeError:
+                # The connection's loop is gone
+                self.unsubscribe(subscription)
+
+
+class RedisBroker(InProcessBroker):
+    """Fans events out to the streams of every worker through Redis pub/sub."""
+    CHANNEL = 'api:appointment-events'
+
+    def __init__(self):
+        super().__init__()
+        import redis
+        self._redis = redis.Redis.from_url(settings.EVENT_BROKER_URL)
+        self._redis_error = redis.RedisError
+        self._listener = None
+        self._listener_lock = threading.Lock()
+
+    def subscribe(self, user_id):
+        self._listen()
+        return super().subscribe(user_id)
+
+    def publish(self, user_ids, event):
+        # Runs from on_commit: an outage must not turn the committed write into a 500.
+        # Streams that miss the event catch up through /api/sync/.
+        try:
+            self._redis.publish(self.CHANNEL, json.dumps({'users': list(set(user_ids)), 'event': event}))
+        except self._redis_error:
+            logger.exception("Dropped %s for users %s: Redis publish failed", event.get('type'), sorted(set(user_ids)))
+
+    def _deliver(self, message):
+        payload = json.loads(message['data'])
+        super().publish(payload['users'], payload['event'])
+
+    def _listen(self):
+        with self._listener_lock:
+            if self._listener is None:
+                pubsub = self._redis.pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(**{self.CHANNEL: self._deliver})
+                self._listener = pubsub.run_in_thread(sleep_time=1, daemon=True)
+
+
+_broker = None
+_broker_lock = threading.Lock()
+
+
+def get_broker():
+    global _broker
+    if _broker is None:
+        with _broker_lock:
+            if _broker is None:
+                _broker = import_string(getattr(settings, 'EVENT_BROKER', 'api.events.InProcessBroker'))()
+    return _broker
+
+
+def issue_stream_ticket(user_id, expires_at):
+    """A ticket for ?ticket= on the event stream; `expires_at` (unix time) ends the stream."""
+    return signing.dumps(
+        {'user': user_id, 'exp': expires_at, 'nonce': secrets.token_urlsafe(12)}, salt=_TICKET_SALT
+    )
+
+
+def redeem_stream_ticket(ticket):
+    """(user id, expires_at) for a valid ticket used for the first time, else None."""
+    try:
+        payload = signing.loads(ticket, salt=_TICKET_SALT, max_age=STREAM_TICKET_SECONDS)
+    except signing.BadSignature:
+        return None
+    # Single use across workers needs the shared default cache (CACHE_URL)
+    if not cache.add(f"events:ticket:{payload['nonce']}", 1, STREAM_TICKET_SECONDS):
+        return None
+    return payload['user'], payload['exp']
+
+
+def _iso(value):
+    return value.isoformat() if hasattr(value, 'isoformat') else value
+
+
+def appointment_event(kind, appointment):
+    """
+    kind: created | updated | approved | deleted. `appointment` is an
+    Appointment or a dict with the same attribute names.
+    """
+    get = appointment.get if isinstance(appointment, dict) else lambda name: getattr(appointment, name)
+    return {
+        'type': f'appointment.{kind}',
+        'id': get('id'),
+        'patient': get('patient_id'),
+        'dentist': get('dentist_id'),
+        'date': _iso(get('date')),
+        'start_time': _iso(get('start_time')),
+        'end_time': _iso(get('end_time')),
+        'approved': get('approved'),
+    }
+
+
+def publish_appointment_events(kind, appointments, extra_recipients=()):
+    """Queue one event per appointment for its patient and dentist, sent on commit."""
+    events = [
+        ({event['patient'], event['dentist'], *extra_recipients}, event)
+        for event in (appointment_event(kind, appointment) for appointment in appointments)
+    ]
+    if not events:
+        return
+
+    def send():
+        broker = get_broker()
+        for recipients, event in events:
+            broker.publish(recipients, event)
+
+    transaction.on_commit(send)
@@ -0,0 +1,251 @@
+# api/fast_serializers.py
+"""
+Read-only fast path for the hot list endpoints.
+
+Builds the exact dicts AppointmentSerializer / ImageAnalysisSerializer
+would produce, but from .values() rows and a handful of bulk queries
+instead of one serializer instance and several method calls per row.
+Dates, times and file URLs go through the same DRF field classes so the
+rendered JSON is byte-identical to the serializer output.
+
+Only used for the default (legacy) shape; requests with ?fields=/?expand=
+still go through the serializers. ImageAnalysis dicts are kept in the
+fragment cache (see api/caching.py) and shared with ImageAnalysisSerializer.
+The a*-prefixed variants read through the async ORM for async views.
+"""
+from collections import defaultdict
+
+from asgiref.sync import sync_to_async
+
+from django.core.files.storage import default_storage
+from rest_framework import serializers
+
+from .caching import ANALYSIS_FRAGMENT_TIMEOUT, analysis_fragment_key, fragment_cache
+from .models import Appointment, DetectionCount, ImageAnalysis, ImageClassification
+from .detection_classes import ALL_CLASS_NAMES
+from .replicas import primary
+
+_date = serializers.DateField()
+_time = serializers.TimeField()
+_datetime = serializers.DateTimeField()
+
+
+def _file_url(name, request):
+    if not name:
+        return None
+    url = default_storage.url(name)
+    if request is not None:
+        return request.build_absolute_uri(url)
+    return url
+
+
+def _optional(field, value):
+    return field.to_representation(value) if value is not None else None
+
+
+def _build_analysis_fragments(ids):
+    """Request-independent dicts for the given analysis ids; three queries on the primary."""
+    with primary():
+        return _analysis_fragments_from_db(ids)
+
+
+def _analysis_fragments_from_db(ids):
+    rows = ImageAnalysis.objects.filter(pk__in=ids).values(
+        'id', 'user_id', 'analyzed_image_url', 'total_conditions', 'image_type', 'created_at',
+        'original_image__id', 'original_image__image', 'original_image__image_url',
+        'original_image__uploaded_at',
+    )
+
+    counts = defaultdict(dict)
+    for analysis_id, class_name, count in DetectionCount.objects.filter(
+        analysis_id__in=ids
+    ).order_by('id').values_list('analysis_id', 'class_name', 'count'):
+        counts[analysis_id][class_name] = count
+
+    diseases = defaultdict(list)
+    for analysis_id, disease_id, name, description in ImageClassification.objects.filter(
+        analysis_id__in=ids
+    ).order_by('disease_id').values_list('analysis_id', 'disease_id', 'disease__name', 'disease__description'):
+        diseases[analysis_id].append({'id': disease_id, 'name': name, 'description': description})
+
+    fragments = {}
+    for row in rows:
+        analysis_counts = counts.get(row['id'], {})
+        data = {
+            'id': row['id'],
+            'user': row['user_id'],
+            'original_image': {
+                'id': row['original_image__id'],
+                'image': _file_url(row['original_image__image'], None),
+                'image_url': row['original_image__image_url'],
+                'uploaded_at': _optional(_datetime, row['original_image__uploaded_at']),
+            },
+            'analyzed_image_url': row['analyzed_image_url'],
+            'total_conditions': row['total_conditions'],
+            'image_type': row['image_type'],
+            'created_at': _optional(_datetime, row['created_at']),
+        }
+        for class_name in ALL_CLASS_NAMES:
+            data[f'{class_name}_count'] = analysis_counts.get(class_name, 0)
+        data['diseases'] = diseases.get(row['id'], [])
+        data['detection_counts'] = dict(analysis_counts)
+        fragments[row['id']] = data
+    return fragments
+
+
+def analysis_fragments(pairs):
+    """
+    {id: fragment} for (id, created_at) pairs. One get_many on the fragment
+    cache; misses are built in bulk and written back with set_many.
+    """
+    keys = {analysis_id: analysis_fragment_key(analysis_id, created_at) for analysis_id, created_at in pairs}
+    if not keys:
+        return {}
+    store = fragment_cache()
+    cached = store.get_many(list(keys.values()))
+    fragments = {analysis_id: cached[key] for analysis_id, key in keys.items() if key in cached}
+    missing = [analysis_id for analysis_id in keys if analysis_id not in fragments]
+    if missing:
+        built = _build_analysis_fragments(missing)
+        store.set_many({keys[analysis_id]: data for analysis_id, data in built.items()}, ANALYSIS_FRAGMENT_TIMEOUT)
+        fragments.update(built)
+    return fragments
+
+
+def for_request(fragment, request):
+    """Copy of a cached fragment with the image URL made absolute for this request."""
+    if request is None or fragment['original_image']['image'] is None:
+        return fragment
+    original_image = dict(fragment['original_image'], image=request.build_absolute_uri(fragment['original_image']['image']))
+    return dict(fragment, original_image=original_image)
+
+
+def analysis_rows(analyses, request=None):
+    """
+    Serialize ImageAnalysis rows (a queryset or a list of ids) to dicts.
+    Returns a list in queryset order; one query when every fragment is
+    cached, four when none is.
+    """
+    if isinstance(analyses, (list, tuple, set)):
+        analyses = ImageAnalysis.objects.filter(pk__in=list(analyses))
+    pairs = list(analyses.prefetch_related(None).values_list('id', 'created_at'))
+    fragments = analysis_fragments(pairs)
+    return [for_request(fragments[analysis_id], request) for analysis_id, _ in pairs if analysis_id in fragments]
+
+
+def analysis_summary_rows(analyses, request=None):
+    """
+    Lightweight list entries (?summary=1): id, date, type, total and the
+    original image URL. One query.
+    """
+    rows = analyses.prefetch_related(None).values(
+        'id', 'created_at', 'image_type', 'total_conditions', 'original_image__image',
+    )
+    return [
+        {
+            'id': row['id'],
+            'created_at': _optional(_datetime, row['created_at']),
+            'image_type': row['image_type'],
+            'total_conditions': row['total_conditions'],
+            'image_url': _file_url(row['original_image__image'], request),
+        }
+        for row in rows
+    ]
+
+
+def _appointment_values(appointments):
+    order = None
+    if isinstance(appointments, (list, tuple)):
+        order = list(appointments)
+        appointments = Appointment.objects.filter(pk__in=order)
+    return appointments.prefetch_related(None).values(
+        'id', 'detail', 'date', 'start_time', 'end_time', 'approved',
+        'patient_id', 'dentist_id', 'created_at', 'analyzed_image_id', 'treatment',
+        'patient__user__first_name', 'patient__user__last_name',
+        'dentist__user__first_name', 'dentist__user__last_name',
+    ), order
+
+
+def _sorted(rows, order):
+    if order is not None:
+        position = {pk: index for index, pk in enumerate(order)}
+        rows.sort(key=lambda row: position[row['id']])
+    return rows
+
+
+def _analysis_ids(rows):
+    return list({row['analyzed_image_id'] for row in rows if row['analyzed_image_id'] is not None})
+
+
+def _appointment_dicts(rows, analyses):
+    result = []
+    for row in rows:
+        patient_name = f"{row['patient__user__first_name']} {row['patient__user__last_name']}".strip()
+        dentist_name = f"{row['dentist__user__first_name']} {row['dentist__user__last_name']}".strip()
+        result.append({
+            'id': row['id'],
+            'detail': row['detail'],
+            'date': _optional(_date, row['date']),
+            'start_time': _optional(_time, row['start_time']),
+            'end_time': _optional(_time, row['end_time']),
+            'approved': row['approved'],
+            'patient': row['patient_id'],
+            'dentist': row['dentist_id'],
+            'created_at': _optional(_datetime, row['created_at']),
+            'analyzed_image': analyses.get(row['analyzed_image_id']),
+            'analyzed_image_id': row['analyzed_image_id'],
+            'treatment': row['treatment'],
+            'patient_name': patient_name or "Unknown Patient",
+            'dentist_name': dentist_name or "Unknown Dentist",
+        })
+    return result
+
+
+def appointment_rows(appointments, request=None):
+    """
+    Serialize Appointment rows (a queryset or a list of ids, in the order
+    given) to dicts matching AppointmentSerializer.
+    """
+    queryset, order = _appointment_values(appointments)
+    rows = _sorted(list(queryset), order)
+    analysis_ids = _analysis_ids(rows)
+    analyses = {}
+    if analysis_ids:
+        analyses = {data['id']: data for data in analysis_rows(analysis_ids, request)}
+    return _appointment_dicts(rows, analyses)
+
+
+async def aanalysis_fragments(pairs):
+    """analysis_fragments() for async views; misses are built in a thread."""
+    keys = {analysis_id: analysis_fragment_key(analysis_id, created_at) for analysis_id, created_at in pairs}
+    if not keys:
+        return {}
+    store = fragment_cache()
+    cached = await store.aget_many(list(keys.values()))
+    fragments = {analysis_id: cached[key] for analysis_id, key in keys.items() if key in cached}
+    missing = [analysis_id for analysis_id in keys if analysis_id not in fragments]
+    if missing:
+        built = await sync_to_async(_build_analysis_fragments)(missing)
+        await store.aset_many({keys[analysis_id]: data for analysis_id, data in built.items()}, ANALYSIS_FRAGMENT_TIMEOUT)
+        fragments.update(built)
+    return fragments
+
+
+async def aanalysis_rows(analyses, request=None):
+    """analysis_rows() through the async ORM."""
+    if isinstance(analyses, (list, tuple, set)):
+        analyses = ImageAnalysis.objects.filter(pk__in=list(analyses))
+    pairs = [pair async for pair in analyses.prefetch_related(None).values_list('id', 'created_at')]
+    fragments = await aanalysis_fragments(pairs)
+    return [for_request(fragments[analysis_id], request) for analysis_id, _ in pairs if analysis_id in fragments]
+
+
+async def aappointment_rows(appointments, request=None):
+    """appointment_rows() through the async ORM."""
+    queryset, order = _appointment_values(appointments)
+    rows = _sorted([row async for row in queryset], order)
+    analysis_ids = _analysis_ids(rows)
+    analyses = {}
+    if analysis_ids:
+        analyses = {data['id']: data for data in await aanalysis_rows(analysis_ids, request)}
+    return _appointment_dicts(rows, analyses)
@@ -0,0 +1,103 @@
+# api/management/commands/_bench_data.py
+from django.utils import timezone
+
+from api.models import (
+    User, Dentist, Patient, Appointment, DentalImage, Disease, ImageAnalysis, ImageClassification, DetectionCount,
+    DentistPatient,
+)
+
+
+def seed_bench_data(rows):
+    """Create one dentist and patient with `rows` analyses and appointments; returns the users."""
+    dentist = User.objects.create_user(
+        username='bench_dentist', email='bench_dentist@dentalcare.com', password='x',
+        first_name='Bench', last_name='Dentist'
+    ).dentist
+    patient_user = User.objects.create_user(
+        username='bench_patient', email='bench_patient@example.com', password='x',
+        first_name='Bench', last_name='Patient'
+    )
+    image = DentalImage.objects.create(image='dental_images/bench.jpg', image_url='/media/dental_images/bench.jpg')
+    disease, _ = Disease.objects.get_or_create(name='Caries')
+    analyses = ImageAnalysis.objects.bulk_create([
+        ImageAnalysis(user=patient_user, original_image=image, total_conditions=2) for _ in range(rows)
+    ])
+    ImageClassification.objects.bulk_create([
+        ImageClassification(analysis=analysis, disease=disease, confidence=0.9) for analysis in analyses
+    ])
+    DetectionCount.objects.bulk_create([
+        DetectionCount(analysis=analysis, class_name='caries', count=2) for analysis in analyses
+    ])
+    start = timezone.now().date()
+    Appointment.objects.bulk_create([
+        Appointment(
+            patient=patient_user.patient, dentist=dentist, analyzed_image=analysis,
+            date=start + timezone.timedelta(days=n // 8), start_time=f'{9 + n % 8}:00', end_time=f'{9 + n % 8}:30',
+        ) for n, analysis in enumerate(analyses)
+    ])
+    # bulk_create skips Appointment.save(), so rebuild the derived links
+    DentistPatient.rebuild(dentist_id=dentist.pk)
+    return dentist.user, patient_user
+
+
+DATASET_DISEASES = ('Caries', 'Calculus', 'Gingivitis', 'Hypodontia', 'Ulcer', 'Fillings', 'Implant', 'Impacted tooth')
+
+
+def seed_dataset(dentists=20, patients=400, appointments_per_patient=20, analyses_per_patient=10):
+    """
+    A clinic-sized dataset for query-plan and query-budget checks: every
+    patient sees a few dentists, has analyses with classifications and
+    detection counts, and membership dates spread over two years. Returns
+    (dentist users, patient users). Bulk inserts, so model save() side
+    effects (caches, events) do not run.
+    """
+    today = timezone.now().date()
+    users = User.objects.bulk_create(
+        [User(username=f'dataset_dentist_{n}', email=f'dataset_dentist_{n}@dentalcare.com', role='dentist',
+              first_name='Dentist', last_name=str(n), password='!')
+         for n in range(dentists)]
+        + [User(username=f'dataset_patient_{n}', email=f'dataset_patient_{n}@example.com', role='patient',
+                first_name='Patient', last_name=str(n), password='!', gender=('male', 'female')[n % 2])
+           for n in range(patients)],
+        batch_size=500,
+    )
+    dentist_users, patient_users = users[:dentists], users[dentists:]
+    Dentist.objects.bulk_create([Dentist(user=user) for user in dentist_users])
+    Patient.objects.bulk_create([
+        Patient(user=user, member_since=today - timezone.timedelta(days=n * 730 // patients))
+        for n, user in enumerate(patient_users)
+    ], batch_size=500)
+
+    diseases = []
+    for name in DATASET_DISEASES:
+        diseases.append(Disease.objects.get_or_create(name=name)[0])
+    image = DentalImage.objects.create(image='dental_images/dataset.jpg', image_url='/media/dental_images/dataset.jpg')
+    analyses = ImageAnalysis.objects.bulk_create([
+        ImageAnalysis(user=user, original_image=image, total_conditions=2)
+        for user in patient_users for _ in range(analyses_per_patient)
+    ], batch_size=500)
+    ImageClassification.objects.bulk_create([
+        ImageClassification(analysis=analysis, disease=diseases[(n + offset) % len(diseases)], confidence=0.8)
+        for n, analysis in enumerate(analyses) for offset in (0, 1)
+    ], batch_size=500)
+    DetectionCount.objects.bulk_create([
+        DetectionCount(analysis=analysis, class_name=diseases[(n + offset) % len(diseases)].name.lower(), count=1 + n % 3)
+        for n, analysis in enumerate(analyses) for offset in (0, 1)
+    ], batch_size=500)
+
+    appointments = []
+    for n, user in enumerate(patient_users):
+        own_analyses = analyses[n * analyses_per_patient:(n + 1) * analyses_per_patient]
+        for k in range(appointments_per_patient):
+            slot = n * appointments_per_patient + k
+            appointments.append(Appointment(
+                patient_id=user.pk, dentist_id=dentist_users[(n + k % 3) % dentists].pk,
+                date=today + timezone.timedelta(days=slot % 365 - 180),
+                start_time=f'{8 + slot % 10}:00', end_time=f'{8 + slot % 10}:30',
+                approved=slot % 4 != 0,
+                # Every other visit comes with one of the patient's analyses
+                analyzed_image=own_analyses[k % len(own_analyses)] if own_analyses and k % 2 == 0 else None,
+            ))
+    Appointment.objects.bulk_create(appointments, batch_size=500)
+    DentistPatient.rebuild()
+    return dentist_users, patient_users
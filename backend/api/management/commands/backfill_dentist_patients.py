@@ -0,0 +1,15 @@
+# api/management/commands/backfill_dentist_patients.py
+from django.core.management.base import BaseCommand
+
+from api.models import DentistPatient
+
+
+class Command(BaseCommand):
+    help = "Rebuild the DentistPatient links from existing appointments"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dentist', type=int, help="Only rebuild links for this dentist id")
+
+    def handle(self, *args, **options):
+        created = DentistPatient.rebuild(dentist_id=options.get('dentist'))
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt {created} dentist-patient links"))
@@ -0,0 +1,136 @@
+# api/management/commands/bench_asgi.py
+import asyncio
+import resource
+import statistics
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import httpx
+from django.core.asgi import get_asgi_application
+from django.core.management.base import BaseCommand
+from django.core.wsgi import get_wsgi_application
+from django.urls import reverse
+from rest_framework_simplejwt.tokens import AccessToken
+
+from api.models import DentalImage, User, WorkSchedule
+from api.throttling import UsernameCheckThrottle
+
+from ._bench_data import seed_bench_data
+
+BENCH_USERNAMES = ('bench_dentist', 'bench_patient')
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare p50/p99 latency and throughput of the async read endpoints served by the "
+        "WSGI handler on a thread pool and by the ASGI handler on one event loop, each mode "
+        "in a fresh process so peak RSS is comparable (data is deleted afterwards)"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=2000)
+        parser.add_argument('--concurrency', type=int, default=64, help="Requests in flight")
+        parser.add_argument('--threads', type=int, default=8, help="WSGI worker threads (gunicorn --threads)")
+        parser.add_argument('--rows', type=int, default=50)
+        parser.add_argument('--mode', choices=('both', 'wsgi', 'asgi'), default='both')
+
+    def handle(self, *args, **options):
+        if options['mode'] != 'both':
+            return self.run_mode(options)
+
+        try:
+            # Committed, since the WSGI threads read through their own connections
+            dentist_user, _ = seed_bench_data(options['rows'])
+            WorkSchedule.objects.bulk_create([
+                WorkSchedule(dentist_id=dentist_user.pk, day=day)
+                for day in ('Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday')
+            ])
+            for mode in ('wsgi', 'asgi'):
+                command = [
+                    sys.executable, sys.argv[0], 'bench_asgi', '--mode', mode,
+                    '--requests', str(options['requests']), '--concurrency', str(options['concurrency']),
+                    '--threads', str(options['threads']),
+                ]
+                self.stdout.write(subprocess.run(command, capture_output=True, text=True, check=True).stdout, ending='')
+        finally:
+            User.objects.filter(username__in=BENCH_USERNAMES).delete()
+            DentalImage.objects.filter(image='dental_images/bench.jpg').delete()
+
+    def endpoints(self):
+        dentist = User.objects.get(username='bench_dentist')
+        patient = User.objects.get(username='bench_patient')
+        dentist_auth = {'Authorization': f'Bearer {AccessToken.for_user(dentist)}'}
+        patient_auth = {'Authorization': f'Bearer {AccessToken.for_user(patient)}'}
+        return [
+            ('profile', reverse('user-profile'), patient_auth),
+            ('appointments', reverse('appointment-list'), dentist_auth),
+            ('schedule', reverse('dentist-schedule-list', kwargs={'dentist_pk': dentist.pk}), patient_auth),
+            ('check-username', reverse('check-username') + '?username=bench_free', {}),
+        ]
+
+    def run_mode(self, options):
+        # Measure the handlers, not the per-IP limit
+        UsernameCheckThrottle.THROTTLE_RATES = {**UsernameCheckThrottle.THROTTLE_RATES, 'username_check': None}
+        endpoints = self.endpoints()
+        plan = [endpoints[n % len(endpoints)] for n in range(options['requests'])]
+        latencies = {label: [] for label, _, _ in endpoints}
+
+        def record(label, started, response):
+            assert response.status_code == 200, (label, response.status_code, response.text[:200])
+            latencies[label].append(time.perf_counter() - started)
+
+        started = time.perf_counter()
+        if options['mode'] == 'wsgi':
+            self.run_wsgi(plan, options, record)
+        else:
+            asyncio.run(self.run_asgi(plan, options, record))
+        elapsed = time.perf_counter() - started
+
+        self.stdout.write(
+            f"{options['mode'].upper()}  {len(plan) / elapsed:8.1f} req/s  "
+            f"peak RSS {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:6.1f} MB"
+        )
+        for label, samples in latencies.items():
+            samples.sort()
+            self.stdout.write(
+                f"  {label:<15} p50 {statistics.median(samples) * 1000:8.1f} ms  "
+                f"p99 {samples[int(len(samples) * 0.99) - 1] * 1000:8.1f} ms"
+            )
+
+    def run_wsgi(self, plan, options, record):
+        # Like gunicorn --threads: at most --threads requests run, the rest queue inside the server
+        application = get_wsgi_application()
+        slots = threading.BoundedSemaphore(options['threads'])
+
+        def server(environ, start_response):
+            with slots:
+                return list(application(environ, start_response))
+
+        transport = httpx.WSGITransport(app=server)
+        local = threading.local()
+
+        def call(label, url, headers):
+            if not hasattr(local, 'client'):
+                local.client = httpx.Client(transport=transport, base_url='http://localhost')
+            started = time.perf_counter()
+            record(label, started, local.client.get(url, headers=headers))
+
+        # --concurrency clients, each sending its next request once the previous one answered
+        with ThreadPoolExecutor(max_workers=options['concurrency']) as pool:
+            for future in [pool.submit(call, *item) for item in plan]:
+                future.result()
+
+    async def run_asgi(self, plan, options, record):
+        gate = asyncio.Semaphore(options['concurrency'])
+        async with httpx.AsyncClient(
+            transport=httpx.ASGITransport(app=get_asgi_application()), base_url='http://localhost'
+        ) as client:
+            async def call(label, url, headers):
+                async with gate:
+                    started = time.perf_counter()
+                    record(label, started, await client.get(url, headers=headers))
+
+            await asyncio.gather(*(call(*item) for item in plan))
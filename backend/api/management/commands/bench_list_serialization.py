@@ -0,0 +1,54 @@
+# api/management/commands/bench_list_serialization.py
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from rest_framework.renderers import JSONRenderer
+
+from api.fast_serializers import appointment_rows, analysis_rows
+from api.models import Appointment, ImageAnalysis
+from api.serializers import AppointmentSerializer, ImageAnalysisSerializer
+
+from ._bench_data import seed_bench_data
+
+
+class Command(BaseCommand):
+    help = "Compare rows/second of the serializer and fast list paths (data is rolled back)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=10000)
+
+    def handle(self, *args, **options):
+        rows = options['rows']
+        with transaction.atomic():
+            seed_bench_data(rows)
+            appointments = Appointment.objects.filter(dentist__user__username='bench_dentist')
+            analyses = ImageAnalysis.objects.filter(user__username='bench_patient')
+
+            self.compare(
+                'appointments',
+                lambda: AppointmentSerializer(appointments.select_related(
+                    'analyzed_image', 'analyzed_image__original_image', 'patient__user', 'dentist__user'
+                ).prefetch_related('analyzed_image__diseases', 'analyzed_image__detection_counts'), many=True).data,
+                lambda: appointment_rows(appointments),
+                rows,
+            )
+            self.compare(
+                'analyses',
+                lambda: ImageAnalysisSerializer(analyses.select_related('original_image').prefetch_related(
+                    'diseases', 'detection_counts'), many=True).data,
+                lambda: analysis_rows(analyses),
+                rows,
+            )
+            transaction.set_rollback(True)
+
+    def compare(self, label, slow, fast, rows):
+        results = []
+        for name, build in (('serializer', slow), ('fast path', fast)):
+            started = time.perf_counter()
+            data = build()
+            elapsed = time.perf_counter() - started
+            results.append(JSONRenderer().render(data))
+            self.stdout.write(f"{label:<12} {name:<10} {elapsed:7.3f}s  {rows / elapsed:10.0f} rows/s")
+        identical = "identical" if results[0] == results[1] else "DIFFERENT"
+        self.stdout.write(f"{label:<12} output {identical} ({len(results[0])} bytes)")
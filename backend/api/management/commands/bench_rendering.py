@@ -0,0 +1,54 @@
+# api/management/commands/bench_rendering.py
+import gzip
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.urls import reverse
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIClient
+
+from api.renderers import ORJSONRenderer
+
+from ._bench_data import seed_bench_data
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+class Command(BaseCommand):
+    help = "Measure JSON render time and bytes on the wire for the largest endpoints (data is rolled back)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=5000)
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            dentist_user, patient_user = seed_bench_data(options['rows'])
+            endpoints = [
+                ('appointments', dentist_user, reverse('appointment-list')),
+                ('patients', dentist_user, reverse('patient-list') + '?appointments_limit=50'),
+                ('dashboard', dentist_user, reverse('dashboard-stats')),
+                ('analyses', patient_user, reverse('user-analyses')),
+            ]
+            client = APIClient(HTTP_HOST='localhost')
+            for label, user, url in endpoints:
+                client.force_authenticate(user=user)
+                data = client.get(url, HTTP_ACCEPT='application/json').data
+                self.report(label, data)
+            transaction.set_rollback(True)
+
+    def report(self, label, data):
+        timings = {}
+        for name, renderer in (('json', JSONRenderer()), ('orjson', ORJSONRenderer())):
+            started = time.perf_counter()
+            body = renderer.render(data)
+            timings[name] = time.perf_counter() - started
+        sizes = f"raw {len(body):>10} B  gzip {len(gzip.compress(body, 6)):>9} B"
+        if brotli is not None:
+            sizes += f"  br {len(brotli.compress(body, quality=4)):>9} B"
+        self.stdout.write(
+            f"{label:<13} render json {timings['json'] * 1000:8.1f} ms  orjson {timings['orjson'] * 1000:7.1f} ms  {sizes}"
+        )
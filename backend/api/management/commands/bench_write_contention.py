@@ -0,0 +1,106 @@
+# api/management/commands/bench_write_contention.py
+import logging
+import statistics
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, timedelta
+
+import httpx
+from django.core.management.base import BaseCommand
+from django.core.wsgi import get_wsgi_application
+from django.db import connection, connections
+from django.urls import reverse
+from rest_framework_simplejwt.tokens import AccessToken
+
+from api.models import Appointment, User
+
+# Django's stock SQLite connection: rollback journal, 5 s timeout, deferred transactions
+SQLITE_DEFAULT_OPTIONS = {'init_command': 'PRAGMA journal_mode=DELETE'}
+
+
+class Command(BaseCommand):
+    help = (
+        "Book appointments from concurrent writers through the WSGI handler and report "
+        "bookings/s, p50/p99 and failures. On SQLite, compares Django's default connection "
+        "settings with the tuned ones from crud/databases.py. Runs in a scratch test database."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--writers', type=int, default=8, help="Concurrent clients, one dentist each")
+        parser.add_argument('--bookings', type=int, default=40, help="Appointments per writer")
+
+    def handle(self, *args, **options):
+        # Failed bookings are counted below; skip their tracebacks
+        logging.getLogger('django.request').setLevel(logging.CRITICAL)
+        old_name = connection.settings_dict['NAME']
+        if connection.vendor == 'sqlite':
+            # A file, not the in-memory test database, so the journal settings apply
+            scratch = tempfile.NamedTemporaryFile(suffix='.sqlite3', delete=False)
+            connection.settings_dict.setdefault('TEST', {})['NAME'] = scratch.name
+        connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            writers = self.seed(options['writers'])
+            if connection.vendor == 'sqlite':
+                tuned = connection.settings_dict['OPTIONS']
+                profiles = [('django defaults', SQLITE_DEFAULT_OPTIONS), ('tuned', tuned)]
+            else:
+                profiles = [('configured', connection.settings_dict['OPTIONS'])]
+            for label, db_options in profiles:
+                connections.close_all()
+                # Connections opened from here on (one per writer thread) use these options
+                connection.settings_dict['OPTIONS'] = db_options
+                Appointment.objects.all().delete()
+                self.run(label, writers, options['bookings'])
+        finally:
+            connections.close_all()
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+    def seed(self, count):
+        writers = []
+        for n in range(count):
+            dentist = User.objects.create_user(
+                username=f'bench_dentist_{n}', email=f'bench_dentist_{n}@dentalcare.com', password='x'
+            )
+            patient = User.objects.create_user(
+                username=f'bench_patient_{n}', email=f'bench_patient_{n}@example.com', password='x'
+            )
+            writers.append((dentist.pk, {'Authorization': f'Bearer {AccessToken.for_user(patient)}'}))
+        return writers
+
+    def run(self, label, writers, bookings):
+        transport = httpx.WSGITransport(app=get_wsgi_application())
+        url = reverse('appointment-list')
+        latencies, failures = [], []
+        lock = threading.Lock()
+
+        def write(dentist_id, headers):
+            with httpx.Client(transport=transport, base_url='http://localhost') as client:
+                for n in range(bookings):
+                    payload = {
+                        'dentist': dentist_id,
+                        'date': (date(2030, 1, 1) + timedelta(days=n // 8)).isoformat(),
+                        'start_time': f'{9 + n % 8:02d}:00:00', 'end_time': f'{9 + n % 8:02d}:30:00',
+                    }
+                    started = time.perf_counter()
+                    response = client.post(url, json=payload, headers=headers)
+                    with lock:
+                        if response.status_code == 201:
+                            latencies.append(time.perf_counter() - started)
+                        else:
+                            failures.append(response.status_code)
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=len(writers)) as pool:
+            for future in [pool.submit(write, *writer) for writer in writers]:
+                future.result()
+        elapsed = time.perf_counter() - started
+
+        latencies.sort()
+        p99 = latencies[int(len(latencies) * 0.99) - 1] if latencies else 0
+        p50 = statistics.median(latencies) if latencies else 0
+        self.stdout.write(
+            f"{label:<16} {len(latencies) / elapsed:8.1f} bookings/s  p50 {p50 * 1000:7.1f} ms  "
+            f"p99 {p99 * 1000:8.1f} ms  failed {len(failures)}/{len(writers) * bookings}"
+        )
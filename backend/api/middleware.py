@@ -0,0 +1,93 @@
+# api/middleware.py
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.utils.cache import patch_vary_headers
+from django.utils.text import compress_string
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover - gzip only
+    brotli = None
+
+
+def accepted_encodings(header):
+    """{coding: q} from an Accept-Encoding header, without the ones refused with q=0."""
+    accepted = {}
+    for part in header.split(','):
+        coding, *params = [piece.strip() for piece in part.split(';')]
+        if not coding:
+            continue
+        quality = 1.0
+        for param in params:
+            name, _, value = param.partition('=')
+            if name.strip().lower() == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        accepted[coding.lower()] = quality
+    wildcard = accepted.pop('*', None)
+    if wildcard:
+        for coding in ('br', 'gzip'):
+            accepted.setdefault(coding, wildcard)
+    return {coding: quality for coding, quality in accepted.items() if quality > 0}
+
+
+class CompressionMiddleware:
+    """
+    Compress responses with brotli (when installed and accepted) or gzip,
+    but only above RESPONSE_COMPRESSION_MIN_SIZE bytes; smaller bodies are
+    not worth the CPU. Modelled on django.middleware.gzip.GZipMiddleware.
+
+    Paths under RESPONSE_COMPRESSION_SKIP_PATHS are never compressed: their
+    bodies carry tokens, which compressed next to attacker-chosen input are
+    open to BREACH-style length probing.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.min_size = getattr(settings, 'RESPONSE_COMPRESSION_MIN_SIZE', 1024)
+        self.skip_paths = tuple(getattr(settings, 'RESPONSE_COMPRESSION_SKIP_PATHS', ()))
+        # Native under ASGI too, so async views are not pushed back onto a thread here
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        return self.compress(request, self.get_response(request))
+
+    async def __acall__(self, request):
+        return self.compress(request, await self.get_response(request))
+
+    def compress(self, request, response):
+        if response.streaming or response.has_header('Content-Encoding'):
+            return response
+        if request.path.startswith(self.skip_paths) or len(response.content) < self.min_size:
+            return response
+
+        patch_vary_headers(response, ('Accept-Encoding',))
+        accepted = accepted_encodings(request.META.get('HTTP_ACCEPT_ENCODING', ''))
+        if brotli is None:
+            accepted.pop('br', None)
+        if not accepted.keys() & {'br', 'gzip'}:
+            return response
+        # Highest q wins; brotli on a tie
+        if accepted.get('br', 0) >= accepted.get('gzip', 0):
+            encoding, compressed = 'br', brotli.compress(response.content, quality=4)
+        else:
+            encoding, compressed = 'gzip', compress_string(response.content)
+        if len(compressed) >= len(response.content):
+            return response
+
+        response.content = compressed
+        response.headers['Content-Length'] = str(len(response.content))
+        # A strong ETag no longer matches the encoded bytes
+        etag = response.get('ETag')
+        if etag and etag.startswith('"'):
+            response.headers['ETag'] = 'W/' + etag
+        response.headers['Content-Encoding'] = encoding
+        return response
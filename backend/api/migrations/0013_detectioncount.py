@@ -0,0 +1,66 @@
+# Generated by Django 5.1.6 on 2026-10-19 16:24
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+LEGACY_COUNT_CLASSES = [
+    'calculus', 'caries', 'gingivitis', 'hypodontia', 'tooth_discolation', 'ulcer',
+    'cavity', 'fillings', 'impacted_tooth', 'implant',
+]
+
+
+def copy_counts_forward(apps, schema_editor):
+    ImageAnalysis = apps.get_model('api', 'ImageAnalysis')
+    DetectionCount = apps.get_model('api', 'DetectionCount')
+    rows = []
+    columns = [f'{name}_count' for name in LEGACY_COUNT_CLASSES]
+    for values in ImageAnalysis.objects.values_list('id', *columns).iterator():
+        analysis_id, counts = values[0], values[1:]
+        for class_name, count in zip(LEGACY_COUNT_CLASSES, counts):
+            if count:
+                rows.append(DetectionCount(analysis_id=analysis_id, class_name=class_name, count=count))
+    DetectionCount.objects.bulk_create(rows, batch_size=500)
+
+
+def copy_counts_backward(apps, schema_editor):
+    ImageAnalysis = apps.get_model('api', 'ImageAnalysis')
+    DetectionCount = apps.get_model('api', 'DetectionCount')
+    for detection in DetectionCount.objects.filter(class_name__in=LEGACY_COUNT_CLASSES).iterator():
+        ImageAnalysis.objects.filter(pk=detection.analysis_id).update(
+            **{f'{detection.class_name}_count': detection.count}
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0012_imageanalysis_image_type'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DetectionCount',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('class_name', models.CharField(max_length=50)),
+                ('count', models.PositiveIntegerField(default=0)),
+                ('analysis', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='detection_counts', to='api.imageanalysis')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='detectioncount',
+            index=models.Index(fields=['class_name', 'count', 'analysis'], name='detection_class_count_idx'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='detectioncount',
+            unique_together={('analysis', 'class_name')},
+        ),
+        migrations.RunPython(copy_counts_forward, copy_counts_backward),
+    ] + [
+        migrations.RemoveField(
+            model_name='imageanalysis',
+            name=f'{class_name}_count',
+        )
+        for class_name in LEGACY_COUNT_CLASSES
+    ]
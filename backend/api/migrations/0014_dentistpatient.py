@@ -0,0 +1,44 @@
+# Generated by Django 5.1.6 on 2026-10-19 16:25
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count, Max, Min
+
+
+def backfill_links(apps, schema_editor):
+    Appointment = apps.get_model('api', 'Appointment')
+    DentistPatient = apps.get_model('api', 'DentistPatient')
+    rows = Appointment.objects.values('dentist_id', 'patient_id').annotate(
+        first_visit=Min('date'), last_visit=Max('date'), visit_count=Count('id'),
+    ).order_by()
+    DentistPatient.objects.bulk_create([DentistPatient(**row) for row in rows], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0013_detectioncount'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DentistPatient',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('first_visit', models.DateField()),
+                ('last_visit', models.DateField()),
+                ('visit_count', models.PositiveIntegerField(default=0)),
+                ('dentist', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='patient_links', to='api.dentist')),
+                ('patient', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='dentist_links', to='api.patient')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='dentistpatient',
+            index=models.Index(fields=['dentist', '-last_visit'], name='dentistpatient_last_visit_idx'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='dentistpatient',
+            unique_together={('dentist', 'patient')},
+        ),
+        migrations.RunPython(backfill_links, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 5.1.6 on 2026-10-19 16:31
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0015_appointment_dentist_slot_idx'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='appointment',
+            index=models.Index(fields=['patient', 'date', 'start_time'], name='appointment_patient_slot_idx'),
+        ),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 5.1.6 on 2026-10-19 16:38
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0016_appointment_patient_slot_idx'),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='detectioncount',
+            options={'ordering': ['id']},
+        ),
+        migrations.AlterModelOptions(
+            name='disease',
+            options={'ordering': ['id']},
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 5.1.6 on 2026-10-19 16:50
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0017_disease_detectioncount_ordering'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='imageanalysis',
+            index=models.Index(fields=['user', '-created_at'], name='analysis_user_created_idx'),
+        ),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 5.1.6 on 2026-10-19 17:31
+
+from django.db import migrations, models
+
+
+def merge_duplicate_diseases(apps, schema_editor):
+    # get_or_create(name=...) could race and leave two rows per name; keep the oldest
+    Disease = apps.get_model('api', 'Disease')
+    ImageClassification = apps.get_model('api', 'ImageClassification')
+    duplicated = (
+        Disease.objects.values('name').annotate(rows=models.Count('id'), keep=models.Min('id'))
+        .filter(rows__gt=1).order_by()
+    )
+    for row in duplicated:
+        extra = Disease.objects.filter(name=row['name']).exclude(pk=row['keep'])
+        # An analysis linked to both copies keeps its link to the survivor only
+        linked = ImageClassification.objects.filter(disease_id=row['keep']).values('analysis_id')
+        ImageClassification.objects.filter(disease__in=extra, analysis_id__in=linked).delete()
+        ImageClassification.objects.filter(disease__in=extra).update(disease_id=row['keep'])
+        extra.delete()
+
+# Its own migration: PostgreSQL refuses to ALTER api_disease (0022) in a
+# transaction that still has deferred foreign key checks against it
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0020_sync_updated_at_tombstone'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicate_diseases, migrations.RunPython.noop),
+    ]
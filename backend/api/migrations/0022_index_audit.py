@@ -0,0 +1,22 @@
+# Generated by Django 5.1.6 on 2026-10-19 17:31
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0021_merge_duplicate_diseases'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='disease',
+            name='name',
+            field=models.CharField(max_length=50, unique=True),
+        ),
+        migrations.AddIndex(
+            model_name='patient',
+            index=models.Index(fields=['member_since'], name='patient_member_since_idx'),
+        ),
+    ]
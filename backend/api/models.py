@@ -4,6 +4,16 @@ from django.contrib.auth.models import AbstractUser, BaseUserManager
 from django.utils import timezone
 from django.contrib.auth.models import Group, Permission
 from django.db import transaction
+from django.db.models.functions import Lower
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .caching import (
+    invalidate_availability, invalidate_availability_day, invalidate_directory,
+    invalidate_analysis_fragment, invalidate_auth_user,
+)
+from .usernames import usernames
+from .events import publish_appointment_events
 
 
 class CustomUserManager(BaseUserManager):
@@ -68,6 +78,12 @@ class User(AbstractUser):
     )
     
     objects = CustomUserManager()
+
+    class Meta(AbstractUser.Meta):
+        indexes = [
+            # Case-insensitive username availability checks (api/usernames.py)
+            models.Index(Lower('username'), name='user_username_lower_idx'),
+        ]
     
     def __str__(self):
         return self.username
@@ -85,7 +101,12 @@ class User(AbstractUser):
             super().save(*args, **kwargs)
             self.profile_picture_url = self.profile_picture.url
            
-            return super().save(update_fields=['profile_picture_url'])
+            result = super().save(update_fields=['profile_picture_url'])
+            invalidate_auth_user(self.pk)
+            usernames.add(self.username)
+            if self.role == 'dentist':
+                invalidate_directory()
+            return result
         super().save(*args, **kwargs)
         
         
@@ -95,14 +116,27 @@ class User(AbstractUser):
                 Dentist.objects.create(user=self)
             elif self.role == 'patient' and not hasattr(self, 'patient'):
                 Patient.objects.create(user=self, member_since=timezone.now().date())
+        invalidate_auth_user(self.pk)
+        usernames.add(self.username)
+        if self.role == 'dentist':
+            invalidate_directory()
 
     def delete(self, *args, **kwargs):
+        user_id = self.pk
         with transaction.atomic():
             
             self.groups.clear()
             self.user_permissions.clear()
+            # The other party of each cascaded appointment needs a tombstone;
+            # this user's own ones go with the user
+            Tombstone.record_appointments(
+                Appointment.objects.filter(models.Q(patient_id=user_id) | models.Q(dentist_id=user_id))
+            )
             
             super().delete(*args, **kwargs)
+        invalidate_auth_user(user_id)
+        if self.role == 'dentist':
+            invalidate_directory()
 
 
 class Dentist(models.Model):
@@ -114,24 +148,104 @@ class Dentist(models.Model):
     def __str__(self):
         return f"{self.user.username} - Dentist"
 
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        invalidate_auth_user(self.user_id)
+        invalidate_directory()
+
+    def delete(self, *args, **kwargs):
+        user_id = self.user_id
+        result = super().delete(*args, **kwargs)
+        invalidate_auth_user(user_id)
+        invalidate_directory()
+        return result
+
 
 class Patient(models.Model):
     user = models.OneToOneField('User', on_delete=models.CASCADE, primary_key=True, related_name='patient')
     emergency_contact = models.CharField(max_length=15, blank=True, null=True)
     allergies = models.TextField(blank=True, null=True)
     member_since = models.DateField(default=timezone.now)
+
+    class Meta:
+        indexes = [
+            # Dashboard "new patients" window
+            models.Index(fields=['member_since'], name='patient_member_since_idx'),
+        ]
     
     def __str__(self):
         return f"{self.user.username} - Patient"
 
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        invalidate_auth_user(self.user_id)
+
+    def delete(self, *args, **kwargs):
+        user_id = self.user_id
+        result = super().delete(*args, **kwargs)
+        invalidate_auth_user(user_id)
+        return result
+
+    @property
+    def visible_appointments(self):
+        # PatientViewSet prefetches a scoped, capped list into this attribute
+        return getattr(self, 'prefetched_appointments', self.appointment.all())
+
 
 class Disease(models.Model):
-    name = models.CharField(max_length=50)
+    # Unique: analyses look diseases up (and create them) by name
+    name = models.CharField(max_length=50, unique=True)
     description = models.TextField(blank=True, null=True)
+
+    # name -> id for this process (see ids_for)
+    _ids_by_name = {}
+
+    class Meta:
+        # Stable order for nested 'diseases' lists (see fast_serializers)
+        ordering = ['id']
     
     def __str__(self):
         return self.name
 
+    @classmethod
+    def ids_for(cls, names):
+        """
+        {name: id} for the named diseases, creating the missing ones. Served
+        from a process-level cache; a miss costs a SELECT, plus an INSERT and
+        a second SELECT for names never seen before. Ids learned inside a
+        transaction are cached once it commits, so a rollback cannot leave
+        ids of rows that do not exist. Deletes in this process (queryset ones
+        included) clear the cache through signals; a delete in another
+        process surfaces as an IntegrityError on the referencing insert,
+        after which the caller calls forget_ids() and retries.
+        """
+        cached = cls._ids_by_name
+        ids = {name: cached.get(name) for name in names}
+        missing = [name for name, pk in ids.items() if pk is None]
+        if not missing:
+            return ids
+        found = dict(cls.objects.filter(name__in=missing).values_list('name', 'id'))
+        new = [name for name in missing if name not in found]
+        if new:
+            # ignore_conflicts: another request may create the same name concurrently
+            cls.objects.bulk_create(
+                [cls(name=name, description=f'AI detected {name}') for name in new], ignore_conflicts=True
+            )
+            found.update(cls.objects.filter(name__in=new).values_list('name', 'id'))
+        transaction.on_commit(lambda: cached.update(found))
+        ids.update(found)
+        return ids
+
+    @classmethod
+    def forget_ids(cls):
+        cls._ids_by_name.clear()
+
+
+@receiver([post_save, post_delete], sender=Disease)
+def _forget_disease_ids(sender, **kwargs):
+    # Signals rather than save()/delete(): QuerySet.delete() and the admin skip those
+    Disease.forget_ids()
+
 
 class DentalImage(models.Model):
     image = models.ImageField(upload_to='dental_images/')
@@ -141,33 +255,106 @@ class DentalImage(models.Model):
     def __str__(self):
         return f"Dental Image {self.id}"
 
+    @classmethod
+    def store(cls, *files):
+        """
+        Save `files` to storage, then insert their rows, image_url included,
+        with one query. Returns the saved instances in order.
+        """
+        field = cls._meta.get_field('image')
+        images = []
+        for content in files:
+            name = field.storage.save(
+                field.generate_filename(None, content.name), content, max_length=field.max_length
+            )
+            images.append(cls(image=name, image_url=field.storage.url(name)))
+        return cls.objects.bulk_create(images)
+
+    def delete(self, *args, **kwargs):
+        with transaction.atomic():
+            # The CASCADE to analyses would skip ImageAnalysis.delete() and its tombstones
+            for analysis in self.imageanalysis_set.all():
+                analysis.delete()
+            return super().delete(*args, **kwargs)
+
+class ImageAnalysisQuerySet(models.QuerySet):
+    def with_min_count(self, class_name, minimum):
+        """Analyses with at least `minimum` detections of `class_name` (index-backed)."""
+        if minimum <= 0:
+            # Every analysis qualifies, including ones without a row for the class
+            return self
+        return self.filter(
+            detection_counts__class_name=class_name,
+            detection_counts__count__gte=minimum,
+        )
+
+
 class ImageAnalysis(models.Model):
     user = models.ForeignKey('User', on_delete=models.CASCADE)
     original_image = models.ForeignKey(DentalImage, on_delete=models.CASCADE)
     analyzed_image_url = models.CharField(max_length=255, default="none")
     created_at = models.DateTimeField(auto_now_add=True)
+    # Delta sync change column (api/sync.py)
+    updated_at = models.DateTimeField(auto_now=True)
     image_type = models.CharField(max_length=10, choices=[('normal', 'Normal'), ('xray', 'X-ray')], default='normal')
     diseases = models.ManyToManyField(Disease, through='ImageClassification')
     
     
     total_conditions = models.IntegerField(default=0)
-    calculus_count = models.IntegerField(default=0)
-    caries_count = models.IntegerField(default=0)
-    gingivitis_count = models.IntegerField(default=0)
-    hypodontia_count = models.IntegerField(default=0)
-    tooth_discolation_count = models.IntegerField(default=0)
-    ulcer_count = models.IntegerField(default=0)
-
-    cavity_count = models.IntegerField(default=0)
-    fillings_count = models.IntegerField(default=0)
-    impacted_tooth_count = models.IntegerField(default=0)
-    implant_count = models.IntegerField(default=0)
+
+    objects = ImageAnalysisQuerySet.as_manager()
     
     def __str__(self):
         return f"Analysis {self.id} for {self.user.username}"
+
+    def count_for(self, class_name):
+        # Iterates .all() so a prefetch of 'detection_counts' is reused
+        for detection in self.detection_counts.all():
+            if detection.class_name == class_name:
+                return detection.count
+        return 0
+
+    def count_map(self):
+        return {detection.class_name: detection.count for detection in self.detection_counts.all()}
+
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        invalidate_analysis_fragment(self.pk, self.created_at)
+
+    def delete(self, *args, **kwargs):
+        pk, created_at, user_id = self.pk, self.created_at, self.user_id
+        with transaction.atomic():
+            # SET_NULL on appointments is a plain UPDATE; mark them changed for sync
+            Appointment.objects.filter(analyzed_image_id=pk).update(updated_at=timezone.now())
+            result = super().delete(*args, **kwargs)
+            Tombstone.record(Tombstone.ANALYSIS, [(pk, [user_id])])
+        invalidate_analysis_fragment(pk, created_at)
+        return result
     
     class Meta:
         verbose_name_plural = "Image Analyses"
+        indexes = [
+            # A user's analyses, newest first (UserAnalysisListView keyset pagination)
+            models.Index(fields=['user', '-created_at'], name='analysis_user_created_idx'),
+            models.Index(fields=['user', 'updated_at', 'id'], name='analysis_user_sync_idx'),
+        ]
+
+
+class DetectionCount(models.Model):
+    """Number of detections of one class in one analysis; zero counts are not stored."""
+    analysis = models.ForeignKey(ImageAnalysis, on_delete=models.CASCADE, related_name='detection_counts')
+    class_name = models.CharField(max_length=50)
+    count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        unique_together = ('analysis', 'class_name')
+        ordering = ['id']
+        indexes = [
+            models.Index(fields=['class_name', 'count', 'analysis'], name='detection_class_count_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.class_name}: {self.count} (analysis {self.analysis_id})"
 
 
 class ImageClassification(models.Model):
@@ -206,6 +393,8 @@ class Appointment(models.Model):
     patient = models.ForeignKey(Patient, on_delete=models.CASCADE, related_name='appointment')
     dentist = models.ForeignKey(Dentist, on_delete=models.CASCADE)
     created_at = models.DateTimeField(auto_now_add=True)
+    # Delta sync change column (api/sync.py); queryset update()s set it explicitly
+    updated_at = models.DateTimeField(auto_now=True)
     analyzed_image = models.ForeignKey(
         ImageAnalysis,
         on_delete=models.SET_NULL,
@@ -221,9 +410,147 @@ class Appointment(models.Model):
         null=True
     )
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['dentist', 'date', 'start_time'], name='appointment_dentist_slot_idx'),
+            models.Index(fields=['patient', 'date', 'start_time'], name='appointment_patient_slot_idx'),
+            models.Index(fields=['dentist', 'updated_at', 'id'], name='appointment_dentist_sync_idx'),
+            models.Index(fields=['patient', 'updated_at', 'id'], name='appointment_patient_sync_idx'),
+        ]
+
     def __str__(self):
         return f"Appointment: {self.patient.user.username} with {self.dentist.user.username} on {self.date}"
 
+    def save(self, *args, **kwargs):
+        previous = None
+        if self.pk is not None:
+            previous = Appointment.objects.filter(pk=self.pk).values_list(
+                'dentist_id', 'patient_id', 'date', 'approved'
+            ).first()
+        super().save(*args, **kwargs)
+        DentistPatient.refresh(self.dentist_id, self.patient_id)
+        invalidate_availability_day(self.dentist_id, self.date)
+        if previous:
+            if previous[:2] != (self.dentist_id, self.patient_id):
+                DentistPatient.refresh(*previous[:2])
+                # Delta sync: the row left the old parties' streams, so they need a tombstone;
+                # one left earlier for a party that sees it again would drop it from their copy
+                current = {self.dentist_id, self.patient_id}
+                Tombstone.record(Tombstone.APPOINTMENT, [(self.pk, set(previous[:2]) - current)])
+                Tombstone.objects.filter(
+                    kind=Tombstone.APPOINTMENT, object_id=self.pk, user_id__in=current - set(previous[:2])
+                ).delete()
+            invalidate_availability_day(previous[0], previous[2])
+            kind = 'approved' if self.approved and not previous[3] else 'updated'
+            publish_appointment_events(kind, [self], extra_recipients=previous[:2])
+        else:
+            publish_appointment_events('created', [self])
+
+    def delete(self, *args, **kwargs):
+        pk, dentist_id, patient_id, day = self.pk, self.dentist_id, self.patient_id, self.date
+        with transaction.atomic():
+            result = super().delete(*args, **kwargs)
+            Tombstone.record(Tombstone.APPOINTMENT, [(pk, [patient_id, dentist_id])])
+            publish_appointment_events('deleted', [{
+                'id': pk, 'patient_id': patient_id, 'dentist_id': dentist_id, 'date': day,
+                'start_time': self.start_time, 'end_time': self.end_time, 'approved': self.approved,
+            }])
+        DentistPatient.refresh(dentist_id, patient_id)
+        invalidate_availability_day(dentist_id, day)
+        return result
+
+
+class DentistPatient(models.Model):
+    """
+    Denormalized dentist <-> patient link, maintained from Appointment writes.
+    Lets "my patients" queries avoid a DISTINCT join over all appointments.
+    """
+    dentist = models.ForeignKey(Dentist, on_delete=models.CASCADE, related_name='patient_links')
+    patient = models.ForeignKey(Patient, on_delete=models.CASCADE, related_name='dentist_links')
+    first_visit = models.DateField()
+    last_visit = models.DateField()
+    visit_count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        unique_together = ('dentist', 'patient')
+        indexes = [
+            models.Index(fields=['dentist', '-last_visit'], name='dentistpatient_last_visit_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.dentist} / {self.patient} ({self.visit_count} visits)"
+
+    @classmethod
+    def refresh(cls, dentist_id, patient_id):
+        """Recompute the link for one pair from its appointments; drop it when none remain."""
+        stats = Appointment.objects.filter(dentist_id=dentist_id, patient_id=patient_id).aggregate(
+            first_visit=models.Min('date'),
+            last_visit=models.Max('date'),
+            visit_count=models.Count('id'),
+        )
+        if not stats['visit_count']:
+            cls.objects.filter(dentist_id=dentist_id, patient_id=patient_id).delete()
+            return None
+        link, _ = cls.objects.update_or_create(
+            dentist_id=dentist_id, patient_id=patient_id, defaults=stats
+        )
+        return link
+
+    @classmethod
+    def rebuild(cls, dentist_id=None):
+        """Rebuild all links (or one dentist's) from the appointment table."""
+        appointments = Appointment.objects.all()
+        links = cls.objects.all()
+        if dentist_id is not None:
+            appointments = appointments.filter(dentist_id=dentist_id)
+            links = links.filter(dentist_id=dentist_id)
+        rows = appointments.values('dentist_id', 'patient_id').annotate(
+            first_visit=models.Min('date'),
+            last_visit=models.Max('date'),
+            visit_count=models.Count('id'),
+        ).order_by()
+        with transaction.atomic():
+            links.delete()
+            created = cls.objects.bulk_create([cls(**row) for row in rows], batch_size=500)
+        return len(created)
+
+class Tombstone(models.Model):
+    """
+    Left behind when an Appointment or ImageAnalysis is deleted, one per
+    user who could see it, so delta sync can tell clients to drop the row.
+    Written by the models' delete() methods; QuerySet.delete() bypasses them.
+    """
+    APPOINTMENT = 'appointment'
+    ANALYSIS = 'analysis'
+    KIND_CHOICES = ((APPOINTMENT, 'Appointment'), (ANALYSIS, 'Image analysis'))
+
+    user = models.ForeignKey('User', on_delete=models.CASCADE, related_name='tombstones')
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES)
+    object_id = models.IntegerField()
+    deleted_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'deleted_at', 'id'], name='tombstone_user_sync_idx'),
+        ]
+
+    @classmethod
+    def record(cls, kind, deletions):
+        """deletions: iterable of (object_id, user ids that could see it)."""
+        cls.objects.bulk_create([
+            cls(user_id=user_id, kind=kind, object_id=object_id)
+            for object_id, user_ids in deletions
+            for user_id in set(user_ids)
+        ])
+
+    @classmethod
+    def record_appointments(cls, appointments):
+        cls.record(cls.APPOINTMENT, [
+            (pk, [patient_id, dentist_id])
+            for pk, patient_id, dentist_id in appointments.values_list('id', 'patient_id', 'dentist_id')
+        ])
+
+
 class Treatment(models.Model):
     detail = models.TextField()
     date = models.DateField()
@@ -253,4 +580,16 @@ class WorkSchedule(models.Model):
     def __str__(self):
         return f"{self.dentist.user.get_full_name()} - {self.day} ({self.start_hour}:00 - {self.end_hour}:00)"
 
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        invalidate_availability(self.dentist_id)
+        invalidate_directory()
+
+    def delete(self, *args, **kwargs):
+        dentist_id = self.dentist_id
+        result = super().delete(*args, **kwargs)
+        invalidate_availability(dentist_id)
+        invalidate_directory()
+        return result
+
 
@@ -0,0 +1,37 @@
+# api/pagination.py
+from rest_framework.pagination import CursorPagination
+
+
+class OptInCursorPagination(CursorPagination):
+    """
+    Keyset pagination that only kicks in when the client asks for it with
+    ?page_size= or ?cursor=, so existing clients keep getting a plain list.
+    """
+    page_size = 50
+    page_size_query_param = 'page_size'
+    max_page_size = 200
+
+    def paginate_queryset(self, queryset, request, view=None):
+        params = request.query_params
+        if self.cursor_query_param not in params and self.page_size_query_param not in params:
+            return None
+        return super().paginate_queryset(queryset, request, view)
+
+
+class AppointmentCursorPagination(OptInCursorPagination):
+    # Matches the (dentist|patient, date, start_time) indexes
+    ordering = ('date', 'start_time', 'id')
+
+
+class PatientCursorPagination(OptInCursorPagination):
+    # 'last_visit' is annotated from DentistPatient for a dentist's patient list
+    ordering = ('-last_visit', 'user_id')
+
+
+class DentistCursorPagination(OptInCursorPagination):
+    ordering = ('user_id',)
+
+
+class AnalysisCursorPagination(OptInCursorPagination):
+    # Matches the (user, -created_at) index
+    ordering = ('-created_at', '-id')
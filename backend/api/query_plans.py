@@ -0,0 +1,65 @@
+# api/query_plans.py
+"""
+Query-plan audit helpers: record the SELECTs a block of code runs, EXPLAIN
+each one and report the full table scans. Used by the query-plan tests in
+api/test.py against a seeded dataset (see _bench_data.seed_dataset).
+
+A full scan is SQLite's "SCAN <table>" (with or without a covering index:
+either way every row is visited) or PostgreSQL's "Seq Scan on <table>".
+Only the tables that grow with usage are audited; lookup tables with a
+handful of rows are cheaper to scan than to search.
+"""
+import re
+from contextlib import contextmanager
+
+from django.db import connections
+
+AUDITED_TABLES = frozenset({
+    'api_user', 'api_patient', 'api_appointment', 'api_dentistpatient', 'api_imageanalysis',
+    'api_imageclassification', 'api_detectioncount', 'api_disease', 'api_tombstone',
+})
+
+_SQLITE_SCAN = re.compile(r'^SCAN (\w+)')
+# SQLite plans name aliased tables by alias (Django's U0, T3, ...)
+_TABLE_ALIAS = re.compile(r'(?:FROM|JOIN)\s+"(\w+)"(?:\s+(?:AS\s+)?("\w+"|[A-Z]\d+)\b)?')
+_POSTGRESQL_SCAN = re.compile(r'Seq Scan on (\w+)')
+
+
+@contextmanager
+def capture_selects(using='default'):
+    """Collect (sql, params) of every SELECT run on `using` inside the block."""
+    queries = []
+
+    def record(execute, sql, params, many, context):
+        if sql.lstrip().upper().startswith('SELECT'):
+            queries.append((sql, params))
+        return execute(sql, params, many, context)
+
+    with connections[using].execute_wrapper(record):
+        yield queries
+
+
+def explain(sql, params, using='default'):
+    """The query plan as a list of lines."""
+    connection = connections[using]
+    with connection.cursor() as cursor:
+        if connection.vendor == 'sqlite':
+            cursor.execute('EXPLAIN QUERY PLAN ' + sql, params)
+            return [row[-1] for row in cursor.fetchall()]
+        cursor.execute('EXPLAIN ' + sql, params)
+        return [row[0] for row in cursor.fetchall()]
+
+
+def full_scans(sql, params, tables=AUDITED_TABLES, using='default'):
+    """Plan lines that scan a whole audited table; empty when every access is indexed."""
+    if connections[using].vendor == 'sqlite':
+        pattern = _SQLITE_SCAN
+        aliases = {alias.strip('"'): table for table, alias in _TABLE_ALIAS.findall(sql) if alias}
+    else:
+        pattern, aliases = _POSTGRESQL_SCAN, {}
+    scans = []
+    for line in explain(sql, params, using):
+        match = pattern.search(line.strip())
+        if match and aliases.get(match.group(1), match.group(1)) in tables:
+            scans.append(line.strip())
+    return scans
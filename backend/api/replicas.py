@@ -0,0 +1,189 @@
+# api/replicas.py
+"""
+Read-replica routing.
+
+When DATABASES has a 'replica' alias (see crud/databases.py),
+ReplicaRoutingMiddleware marks GET/HEAD/OPTIONS requests as replica reads
+and ReadReplicaRouter sends this app's read querysets there. Writes, and
+every read outside such a request, go to 'default'. The mark lives in a
+ContextVar, so it follows the request through sync_to_async but not into
+the batch thread pool, whose sub-requests read from the primary.
+
+Read-your-writes: after a successful unsafe request the client is pinned
+to the primary for REPLICA_STICKY_SECONDS, by a cookie and by a signed
+X-DB-Pin response header that the SPA echoes back until X-DB-Pin-Max-Age
+runs out (it does not send cookies cross-origin). Both carry their own
+expiry, so a pin set by one worker is honoured by every other.
+
+Lag: the replica's lag is sampled at most every REPLICA_LAG_CHECK_INTERVAL
+seconds. While it is above REPLICA_MAX_LAG, or the replica cannot be
+reached, requests read from the primary.
+
+Version-keyed caches must not be refilled from a lagging replica, or the
+stale data would be cached under the new version. Their fill code runs
+inside primary().
+"""
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.core import signing
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, connections
+
+REPLICA_ALIAS = 'replica'
+REPLICA_PIN_COOKIE = 'db_pin'
+REPLICA_PIN_HEADER = 'X-DB-Pin'
+REPLICA_PIN_MAX_AGE_HEADER = 'X-DB-Pin-Max-Age'
+_PIN_SALT = 'api.replicas.pin'
+ROUTED_APPS = {'api'}
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+_read_alias = ContextVar('read_alias', default=None)
+
+
+def replica_configured():
+    return REPLICA_ALIAS in settings.DATABASES
+
+
+@contextmanager
+def primary():
+    """Read from the primary inside the block, whatever the request was routed to."""
+    token = _read_alias.set(None)
+    try:
+        yield
+    finally:
+        _read_alias.reset(token)
+
+
+class ReadReplicaRouter:
+    def db_for_read(self, model, **hints):
+        if model._meta.app_label in ROUTED_APPS:
+            return _read_alias.get() or DEFAULT_DB_ALIAS
+        return None
+
+    def db_for_write(self, model, **hints):
+        # Explicit, or Django would save an instance read from the replica back to it
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Same rows on both aliases
+        if {obj1._state.db, obj2._state.db} <= {'default', REPLICA_ALIAS, None}:
+            return True
+        return None
+
+
+def replica_lag(alias=REPLICA_ALIAS):
+    """Seconds the replica is behind; 0 for SQLite, which has no replication."""
+    connection = connections[alias]
+    if connection.vendor != 'postgresql':
+        return 0.0
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT CASE WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 "
+            "ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0) END"
+        )
+        return float(cursor.fetchone()[0])
+
+
+class ReplicaHealth:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._usable = False
+        self._checked_at = None
+
+    def stale(self):
+        return self._checked_at is None or time.monotonic() - self._checked_at > settings.REPLICA_LAG_CHECK_INTERVAL
+
+    def refresh(self):
+        with self._lock:
+            if not self.stale():
+                return
+            try:
+                self._usable = replica_lag() <= settings.REPLICA_MAX_LAG
+            except DatabaseError:
+                self._usable = False
+            self._checked_at = time.monotonic()
+
+    def usable(self):
+        if self.stale():
+            self.refresh()
+        return self._usable
+
+    def last_known(self):
+        return self._usable
+
+    def reset(self):
+        with self._lock:
+            self._checked_at = None
+
+
+replica_health = ReplicaHealth()
+
+
+def pin_token():
+    return signing.dumps(1, salt=_PIN_SALT)
+
+
+def _pinned(request):
+    if request.COOKIES.get(REPLICA_PIN_COOKIE):
+        return True
+    token = request.headers.get(REPLICA_PIN_HEADER)
+    if not token:
+        return False
+    try:
+        signing.loads(token, salt=_PIN_SALT, max_age=settings.REPLICA_STICKY_SECONDS)
+    except signing.BadSignature:
+        # Expired (SignatureExpired) or forged
+        return False
+    return True
+
+
+class ReplicaRoutingMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def wants_replica(self, request):
+        return replica_configured() and request.method in SAFE_METHODS and not _pinned(request)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        alias = REPLICA_ALIAS if self.wants_replica(request) and replica_health.usable() else None
+        token = _read_alias.set(alias)
+        try:
+            response = self.get_response(request)
+        finally:
+            _read_alias.reset(token)
+        return self.pin(request, response)
+
+    async def __acall__(self, request):
+        alias = None
+        if self.wants_replica(request):
+            if replica_health.stale():
+                await sync_to_async(replica_health.refresh)()
+            if replica_health.last_known():
+                alias = REPLICA_ALIAS
+        token = _read_alias.set(alias)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _read_alias.reset(token)
+        return self.pin(request, response)
+
+    def pin(self, request, response):
+        if not replica_configured() or request.method in SAFE_METHODS or response.status_code >= 400:
+            return response
+        seconds = settings.REPLICA_STICKY_SECONDS
+        response.set_cookie(REPLICA_PIN_COOKIE, '1', max_age=seconds, httponly=True, samesite='Lax')
+        response[REPLICA_PIN_HEADER] = pin_token()
+        # So the client knows when to stop sending it
+        response[REPLICA_PIN_MAX_AGE_HEADER] = str(seconds)
+        return response
@@ -7,8 +7,34 @@ from .models import (
     WorkSchedule
 )
 from django.contrib.auth import get_user_model
+from django.db import models
+from .fast_serializers import analysis_fragments, for_request
+from .detection_classes import ALL_CLASS_NAMES
+from rest_framework_simplejwt.serializers import TokenObtainPairSerializer
+from .batch import BATCH_MAX_REQUESTS
 
 User = get_user_model()  
+
+ANALYSIS_FRAGMENTS = 'analysis_fragments'
+# Pre-rendered 'patient' for UserSerializer, set by the async profile view
+PROFILE_PATIENT = 'profile_patient'
+
+
+class AnalysisFragmentListSerializer(serializers.ListSerializer):
+    """
+    Loads the cached ImageAnalysis fragments for the whole list with one
+    get_many before the children render; the child says which analyses it
+    will render through fragment_analyses().
+    """
+    def to_representation(self, data):
+        items = list(data.all() if isinstance(data, models.manager.BaseManager) else data)
+        analyses = [analysis for item in items for analysis in self.child.fragment_analyses(item)]
+        if analyses:
+            primed = self.context.setdefault(ANALYSIS_FRAGMENTS, {})
+            primed.update(analysis_fragments({(a.pk, a.created_at) for a in analyses if a.pk not in primed}))
+        return super().to_representation(items)
+
+
 class SimpleUserSerializer(serializers.ModelSerializer):
     class Meta:
         model = User
@@ -26,13 +52,20 @@ class UserSerializer(serializers.ModelSerializer):
         model = User
         fields = ['id', 'username', 'email', 'first_name', 'last_name', 'password', 
                  'phone_number', 'role', 'gender', 'patient', 'profile_picture', 'profile_picture_url','is_staff']
+        expandable_fields = ('patient',)
         extra_kwargs = {
             'password': {'write_only': True},
         }
     
     def get_patient(self, obj):
+        if PROFILE_PATIENT in self.context:
+            return self.context[PROFILE_PATIENT]
         if obj.role == 'patient' and hasattr(obj, 'patient'):
-            return PatientSerializer(obj.patient).data
+            patient = obj.patient
+            if patient.get_deferred_fields():
+                # The authentication cache only holds the profile id
+                patient.refresh_from_db(fields=patient.get_deferred_fields())
+            return PatientSerializer(patient).data
         return None
 
     def update(self, instance, validated_data):
@@ -55,6 +88,30 @@ class UserSerializer(serializers.ModelSerializer):
         instance.save()
         return instance
 
+class ProfileTokenObtainPairSerializer(TokenObtainPairSerializer):
+    """
+    Token pair plus the user's profile, so a login is a single request.
+    The access token carries role claims for checks that need no lookup.
+    """
+    @classmethod
+    def get_token(cls, user):
+        token = super().get_token(user)
+        token['role'] = user.role
+        token['is_staff'] = user.is_staff
+        # Patient and Dentist share the user's primary key
+        token['profile_id'] = user.pk if user.role in ('patient', 'dentist') else None
+        return token
+
+    def validate(self, attrs):
+        data = super().validate(attrs)
+        user = self.user
+        data['user'] = UserSerializer(user, context=self.context).data
+        data['role'] = user.role
+        data['patient_id'] = user.pk if user.role == 'patient' and hasattr(user, 'patient') else None
+        data['dentist_id'] = user.pk if user.role == 'dentist' and hasattr(user, 'dentist') else None
+        return data
+
+
 class DentistSerializer(serializers.ModelSerializer):
     user = UserSerializer(read_only=True)
     
@@ -73,17 +130,55 @@ class DiseaseSerializer(serializers.ModelSerializer):
         fields = ['id', 'name', 'description']
 
 
+class DetectionCountField(serializers.Field):
+    """Read-only count for one detection class, computed from DetectionCount rows."""
+
+    def __init__(self, class_name, **kwargs):
+        self.class_name = class_name
+        kwargs['source'] = '*'
+        kwargs['read_only'] = True
+        super().__init__(**kwargs)
+
+    def to_representation(self, obj):
+        return obj.count_for(self.class_name)
+
+
+LEGACY_COUNT_FIELDS = [f'{class_name}_count' for class_name in ALL_CLASS_NAMES]
+
+
 class ImageAnalysisSerializer(serializers.ModelSerializer):
     diseases = DiseaseSerializer(many=True, read_only=True)
     original_image = DentalImageSerializer(read_only=True)
-    
+    detection_counts = serializers.SerializerMethodField()
+
     class Meta:
         model = ImageAnalysis
+        # Legacy per-class *_count fields, kept for existing clients, one per
+        # registered detection class (see build_unknown_field)
         fields = ['id', 'user', 'original_image', 'analyzed_image_url', 'total_conditions',
-            'image_type', 'created_at',
-            'calculus_count', 'caries_count', 'gingivitis_count',
-            'hypodontia_count', 'tooth_discolation_count', 'ulcer_count',
-            'cavity_count', 'fillings_count', 'impacted_tooth_count', 'implant_count','diseases']
+            'image_type', 'created_at', *LEGACY_COUNT_FIELDS, 'diseases', 'detection_counts']
+        expandable_fields = ('original_image', 'diseases')
+        list_serializer_class = AnalysisFragmentListSerializer
+
+    def build_unknown_field(self, field_name, model_class):
+        if field_name in LEGACY_COUNT_FIELDS:
+            return DetectionCountField, {'class_name': field_name.removesuffix('_count')}
+        return super().build_unknown_field(field_name, model_class)
+
+    def get_detection_counts(self, obj):
+        return obj.count_map()
+
+    def fragment_analyses(self, instance):
+        return [] if getattr(self, 'shaped', False) else [instance]
+
+    def to_representation(self, instance):
+        # Full-shape output comes from the fragment cache, shared with the fast list path
+        if getattr(self, 'shaped', False):
+            return super().to_representation(instance)
+        fragment = self.context.get(ANALYSIS_FRAGMENTS, {}).get(instance.pk)
+        if fragment is None:
+            fragment = analysis_fragments([(instance.pk, instance.created_at)])[instance.pk]
+        return for_request(fragment, self.context.get('request'))
 
 
 
@@ -113,6 +208,14 @@ class AppointmentSerializer(serializers.ModelSerializer):
             'analyzed_image', 'analyzed_image_id', 'treatment',
             'patient_name', 'dentist_name'  
         ]
+        expandable_fields = ('analyzed_image',)
+        list_serializer_class = AnalysisFragmentListSerializer
+
+    def fragment_analyses(self, instance):
+        field = self.fields.get('analyzed_image')
+        if field is None or getattr(field, 'shaped', False) or instance.analyzed_image_id is None:
+            return []
+        return [instance.analyzed_image]
 
     def get_patient_name(self, obj):
         return f"{obj.patient.user.first_name} {obj.patient.user.last_name}".strip() or "Unknown Patient"
@@ -131,14 +234,71 @@ class AppointmentSerializer(serializers.ModelSerializer):
                 raise serializers.ValidationError({"end_time": "End time must be after start time."})
         return data
     
+class BulkAppointmentOperationSerializer(serializers.Serializer):
+    OPERATIONS = ('approve', 'reschedule', 'cancel')
+
+    id = serializers.IntegerField()
+    op = serializers.ChoiceField(choices=OPERATIONS)
+    date = serializers.DateField(required=False)
+    start_time = serializers.TimeField(required=False)
+    end_time = serializers.TimeField(required=False)
+
+    def validate(self, data):
+        if data['op'] == 'reschedule':
+            missing = [f for f in ('date', 'start_time', 'end_time') if f not in data]
+            if missing:
+                raise serializers.ValidationError({f: "Required for reschedule." for f in missing})
+            if data['start_time'] >= data['end_time']:
+                raise serializers.ValidationError({"end_time": "End time must be after start time."})
+        return data
+
+class BulkAppointmentSerializer(serializers.Serializer):
+    operations = BulkAppointmentOperationSerializer(many=True, allow_empty=False, max_length=200)
+
+    def validate_operations(self, value):
+        ids = [operation['id'] for operation in value]
+        if len(ids) != len(set(ids)):
+            raise serializers.ValidationError("Each appointment id may appear only once.")
+        return value
+    
+class BatchItemSerializer(serializers.Serializer):
+    METHODS = ('GET', 'POST', 'PUT', 'PATCH', 'DELETE')
+
+    id = serializers.CharField(required=False)
+    method = serializers.ChoiceField(choices=METHODS, default='GET')
+    path = serializers.CharField()
+    body = serializers.JSONField(required=False)
+
+    def to_internal_value(self, data):
+        if isinstance(data, dict) and isinstance(data.get('method'), str):
+            data = {**data, 'method': data['method'].upper()}
+        return super().to_internal_value(data)
+
+
+class BatchSerializer(serializers.Serializer):
+    requests = BatchItemSerializer(many=True, allow_empty=False, max_length=BATCH_MAX_REQUESTS)
+
+
 class PatientSerializer(serializers.ModelSerializer):
     user = SimpleUserSerializer(read_only=True)
     id = serializers.IntegerField(source='user_id', read_only=True)
-    appointments = AppointmentSerializer(many=True, read_only=True, source='appointment')
+    appointments = AppointmentSerializer(many=True, read_only=True, source='visible_appointments')
 
     class Meta:
         model = Patient
         fields = ['id', 'user', 'emergency_contact', 'allergies', 'member_since', 'appointments']
+        expandable_fields = ('appointments',)
+        # One fragment load for every patient's appointments on the page, not one per patient
+        list_serializer_class = AnalysisFragmentListSerializer
+
+    def fragment_analyses(self, instance):
+        field = self.fields.get('appointments')
+        if field is None:
+            return []
+        return [
+            analysis for appointment in instance.visible_appointments
+            for analysis in field.child.fragment_analyses(appointment)
+        ]
 
 class RegisterDentistSerializer(serializers.ModelSerializer):
     gender = serializers.CharField(required=True)
@@ -0,0 +1,97 @@
+# api/sparse_fields.py
+"""
+Sparse fieldsets (?fields=) and opt-in expansion (?expand=) for read views.
+
+Both parameters take comma separated, dotted paths:
+
+    /api/appointments/?fields=id,date,start_time,analyzed_image.id&expand=analyzed_image
+
+Without either parameter the full legacy shape is returned. Once a client
+sends one of them, the nested relations a serializer lists in
+Meta.expandable_fields are left out unless named in ?expand=, and
+?fields= keeps only the listed fields. Views declare which
+select_related/prefetch_related each output path needs in
+`shape_relations`, and only the ones the shaped serializer still renders
+are applied to the queryset.
+"""
+from rest_framework.serializers import BaseSerializer
+
+
+def parse_paths(value):
+    """'a,b.c,b.d' -> {'a': {}, 'b': {'c': {}, 'd': {}}}"""
+    tree = {}
+    for path in (value or '').split(','):
+        node = tree
+        for part in filter(None, path.strip().split('.')):
+            node = node.setdefault(part, {})
+    return tree
+
+
+def apply_shape(serializer, fields, expand):
+    """Drop fields not selected by the `fields`/`expand` trees, recursing into nested serializers."""
+    target = getattr(serializer, 'child', serializer)
+    # Shaped serializers bypass whole-object caches such as the analysis fragments
+    target.shaped = True
+    expandable = getattr(getattr(target, 'Meta', None), 'expandable_fields', ())
+    for name in list(target.fields):
+        if name in expandable and name not in expand:
+            target.fields.pop(name)
+        elif fields and name not in fields:
+            target.fields.pop(name)
+    for name, field in target.fields.items():
+        if isinstance(field, BaseSerializer):
+            apply_shape(field, fields.get(name) if fields else None, expand.get(name, {}))
+
+
+def rendered_paths(serializer, prefix=''):
+    """Every dotted path the serializer will render, e.g. {'id', 'analyzed_image', 'analyzed_image.id', ...}."""
+    target = getattr(serializer, 'child', serializer)
+    paths = set()
+    for name, field in target.fields.items():
+        if field.write_only:
+            continue
+        path = prefix + name
+        paths.add(path)
+        if isinstance(field, BaseSerializer):
+            paths |= rendered_paths(field, path + '.')
+    return paths
+
+
+class SparseFieldsMixin:
+    """
+    View mixin: shapes GET serializers from ?fields=/?expand= and trims the
+    queryset's joins and prefetches to what is actually rendered.
+    """
+    # output path -> (select_related paths, prefetch_related paths)
+    shape_relations = {}
+
+    def get_shape_relations(self):
+        return self.shape_relations
+
+    def get_shape(self):
+        if self.request is None or self.request.method != 'GET':
+            return None
+        params = self.request.query_params
+        if 'fields' not in params and 'expand' not in params:
+            return None
+        return parse_paths(params.get('fields')), parse_paths(params.get('expand'))
+
+    def get_serializer(self, *args, **kwargs):
+        serializer = super().get_serializer(*args, **kwargs)
+        shape = self.get_shape()
+        if shape is not None:
+            apply_shape(serializer, *shape)
+        return serializer
+
+    def shape_queryset(self, queryset):
+        paths = rendered_paths(self.get_serializer())
+        select, prefetch = [], []
+        for path, (select_paths, prefetch_paths) in self.get_shape_relations().items():
+            if path in paths:
+                select.extend(p for p in select_paths if p not in select)
+                prefetch.extend(p for p in prefetch_paths if p not in prefetch)
+        if select:
+            queryset = queryset.select_related(*select)
+        if prefetch:
+            queryset = queryset.prefetch_related(*prefetch)
+        return queryset
@@ -0,0 +1,108 @@
+# api/sync.py
+"""
+Delta sync for appointments and analyses.
+
+Every stream is read in (change column, id) order from a per-user index:
+Appointment.updated_at, ImageAnalysis.updated_at and Tombstone.deleted_at.
+The cursor is an opaque token holding the last (timestamp, id) seen per
+stream, so a client that keeps its local copy only downloads what changed
+since its previous sync. At most `limit` rows per stream are returned;
+`has_more` tells the client to call again with the new cursor.
+
+The change columns are stamped in Python before the write commits, so a
+transaction that stamps T1 but commits after one that stamped T2 > T1 would
+land behind a cursor already at T2. Once a stream is caught up, its cursor
+is therefore held SYNC_SETTLE_SECONDS behind the time of the sync: the next
+sync reads that window again and picks up rows committed late. Clients
+apply rows and tombstones by id, so the repeats are harmless. A write that
+takes longer than the window to commit can still be missed.
+
+Tombstones are written by Appointment.delete(), ImageAnalysis.delete() and
+DentalImage.delete(); a raw QuerySet.delete() on those models leaves none.
+"""
+import base64
+import json
+from datetime import timedelta
+
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from .fast_serializers import analysis_rows, appointment_rows
+from .models import Appointment, ImageAnalysis, Tombstone
+
+SYNC_PAGE_SIZE = 500
+# How far behind "now" a caught-up cursor is held (see the module docstring)
+SYNC_SETTLE_SECONDS = 300
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def encode_cursor(positions):
+    return base64.urlsafe_b64encode(json.dumps(positions, separators=(',', ':')).encode()).decode()
+
+
+def decode_cursor(value):
+    try:
+        positions = {
+            stream: (parse_datetime(stamp), int(pk))
+            for stream, (stamp, pk) in json.loads(base64.urlsafe_b64decode(value.encode())).items()
+        }
+    except (ValueError, TypeError, AttributeError):
+        raise InvalidCursor("Invalid sync cursor.")
+    if any(stamp is None for stamp, _ in positions.values()):
+        raise InvalidCursor("Invalid sync cursor.")
+    return positions
+
+
+def _page(queryset, field, position, limit, extra=()):
+    """[(id, stamp, *extra), ...] after `position` in (field, id) order, plus whether more remain."""
+    if position is not None:
+        stamp, pk = position
+        queryset = queryset.filter(Q(**{f'{field}__gt': stamp}) | Q(**{field: stamp, 'id__gt': pk}))
+    rows = list(queryset.order_by(field, 'id').values_list('id', field, *extra)[:limit + 1])
+    return rows[:limit], len(rows) > limit
+
+
+def changes_since(user, cursor=None, request=None, limit=SYNC_PAGE_SIZE):
+    positions = decode_cursor(cursor) if cursor else {}
+    settled = (timezone.now() - timedelta(seconds=SYNC_SETTLE_SECONDS), 0)
+    if user.role == 'dentist':
+        appointments = Appointment.objects.filter(dentist_id=user.pk)
+    else:
+        appointments = Appointment.objects.filter(patient_id=user.pk)
+    streams = {
+        'appointments': (appointments, 'updated_at', ()),
+        'analyses': (ImageAnalysis.objects.filter(user_id=user.pk), 'updated_at', ()),
+        'deleted': (Tombstone.objects.filter(user_id=user.pk), 'deleted_at', ('kind', 'object_id')),
+    }
+
+    pages, has_more = {}, False
+    for stream, (queryset, field, extra) in streams.items():
+        pages[stream], more = _page(queryset, field, positions.get(stream), limit, extra)
+        has_more = has_more or more
+        if pages[stream]:
+            pk, stamp = pages[stream][-1][:2]
+            positions[stream] = (stamp, pk)
+        if not more and stream in positions:
+            # Only once caught up, so a window holding more than `limit` rows still pages forward
+            positions[stream] = min(positions[stream], settled)
+
+    deleted = {'appointments': [], 'analyses': []}
+    for _, _, kind, object_id in pages['deleted']:
+        deleted['appointments' if kind == Tombstone.APPOINTMENT else 'analyses'].append(object_id)
+
+    analysis_ids = [pk for pk, _ in pages['analyses']]
+    return {
+        'appointments': appointment_rows([pk for pk, _ in pages['appointments']], request),
+        'analyses': analysis_rows(
+            ImageAnalysis.objects.filter(pk__in=analysis_ids).order_by('updated_at', 'id'), request
+        ) if analysis_ids else [],
+        'deleted': deleted,
+        'cursor': encode_cursor({
+            stream: [stamp.isoformat(), pk] for stream, (stamp, pk) in positions.items()
+        }),
+        'has_more': has_more,
+    }
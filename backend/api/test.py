@@ -1,13 +1,53 @@
-from django.test import TestCase
+from django.test import TestCase, TransactionTestCase
+from django.test.utils import CaptureQueriesContext
+from unittest import skipUnless
+from django.db import connection
+from concurrent.futures import ThreadPoolExecutor
+import time as clock
 from rest_framework.test import APITestCase, APIClient
-from django.urls import reverse
+from django.urls import resolve, reverse
 from django.core.files.uploadedfile import SimpleUploadedFile
 from django.contrib.auth import get_user_model
 from django.contrib.auth.models import Group
 from api.models import (
     User, Dentist, Patient, DentalImage, Disease, ImageAnalysis,
-    Appointment, WorkSchedule
+    Appointment, WorkSchedule, DetectionCount, DentistPatient, Treatment, Tombstone
 )
+from api.availability import subtract_intervals
+from api.views import PatientViewSet
+from api.fast_serializers import appointment_rows, analysis_rows
+from api.caching import fragment_cache, auth_user_key, auth_user_version
+from rest_framework_simplejwt.tokens import AccessToken
+from api.usernames import usernames, BloomFilter
+from api.throttling import UsernameCheckThrottle
+from api.authentication import CachedJWTAuthentication
+from api.batch import BATCH_MAX_REQUESTS
+from api.sync import changes_since
+from api.booking import apply_bulk_operations
+from api.events import get_broker, InProcessBroker, RedisBroker
+from asgiref.sync import async_to_sync, iscoroutinefunction, sync_to_async
+import asyncio
+import threading
+from django.http import HttpResponse
+from django.test import RequestFactory
+from api.middleware import CompressionMiddleware, accepted_encodings
+from api.views import run_inference, DashboardStatsView
+from api.admin import DentistPatientAdmin
+from crud.databases import database_settings
+from api.query_plans import capture_selects, explain, full_scans
+from api.budgets import QueryBudget, budget_for, fingerprint, record_queries
+from api.management.commands._bench_data import seed_dataset
+from api.replicas import (
+    ReadReplicaRouter, ReplicaRoutingMiddleware, REPLICA_PIN_COOKIE, primary, replica_health,
+)
+from django.conf import settings
+from django.db.utils import OperationalError
+from pathlib import Path
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIRequestFactory
+from api.renderers import ORJSONRenderer
+from decimal import Decimal
+import gzip
 from api.serializers import (
     UserSerializer, RegisterDentistSerializer, RegisterPatientSerializer,
     DentistSerializer, PatientSerializer, AppointmentSerializer,
@@ -17,11 +57,15 @@ from rest_framework import status
 from unittest.mock import patch
 import tempfile
 import os
+import importlib.util
 import torch
 from PIL import Image
 import io
+import json
 from datetime import date, time
 from django.utils import timezone
+from django.core.management import call_command
+from django.core.cache import cache
 
 User = get_user_model()
 
@@ -219,6 +263,47 @@ class AppointmentViewSetTests(APITestCase):
         self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
         print("test_approve_nonexistent_appointment: PASSED")
 
+    def _two_appointments(self):
+        first = Appointment.objects.create(
+            patient=self.patient_user.patient, dentist=self.dentist_user.dentist,
+            date='2025-05-01', start_time='10:00:00', end_time='11:00:00'
+        )
+        second = Appointment.objects.create(
+            patient=self.patient_user.patient, dentist=self.dentist_user.dentist,
+            date='2025-05-01', start_time='12:00:00', end_time='13:00:00'
+        )
+        return first, second
+
+    def test_put_onto_booked_slot_conflicts(self):
+        """Test a PUT moving an appointment onto another's slot gets 409 and changes nothing."""
+        print("Running test_put_onto_booked_slot_conflicts...")
+        _, second = self._two_appointments()
+        self.client.force_authenticate(user=self.patient_user)
+        response = self.client.put(
+            reverse('appointment-detail', kwargs={'pk': second.pk}),
+            {**self.appointment_data, 'start_time': '10:30:00', 'end_time': '11:30:00'}, format='json'
+        )
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+        self.assertIn('error', response.data)
+        second.refresh_from_db()
+        self.assertEqual(second.start_time, time(12, 0))
+        print("test_put_onto_booked_slot_conflicts: PASSED")
+
+    def test_patch_onto_booked_slot_conflicts(self):
+        """Test a PATCH overlap gets 409, and invalid data still gets 400 with field errors."""
+        print("Running test_patch_onto_booked_slot_conflicts...")
+        _, second = self._two_appointments()
+        self.client.force_authenticate(user=self.patient_user)
+        url = reverse('appointment-detail', kwargs={'pk': second.pk})
+        response = self.client.patch(url, {'start_time': '10:00:00', 'end_time': '11:00:00'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+        response = self.client.patch(url, {'date': 'soon'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('date', response.data)
+        response = self.client.patch(url, {'start_time': '14:00:00', 'end_time': '15:00:00'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        print("test_patch_onto_booked_slot_conflicts: PASSED")
+
 class AnalyzeImageViewTests(APITestCase):
     def setUp(self):
         self.client = APIClient()
@@ -234,6 +319,8 @@ class AnalyzeImageViewTests(APITestCase):
         self.image = SimpleUploadedFile(
             "test.jpg", image_io.read(), content_type="image/jpeg"
         )
+        # Ids cached by an earlier test point at rows that were rolled back
+        Disease.forget_ids()
 
     @patch('api.views.YOLO')
     def test_analyze_image_success(self, mock_yolo):
@@ -263,8 +350,99 @@ class AnalyzeImageViewTests(APITestCase):
         self.assertIn('analyzedImage', response.data)
         self.assertEqual(ImageAnalysis.objects.count(), 1)
         self.assertEqual(DentalImage.objects.count(), 2)  # Original + annotated
+        self.assertEqual(response.data['cariesCount'], 1)
+        self.assertEqual(response.data['cavityCount'], 0)
+        analysis = ImageAnalysis.objects.get()
+        self.assertEqual(analysis.count_map(), {'caries': 1})
         print("test_analyze_image_success: PASSED")
 
+    def _mock_detections(self, mock_yolo, detections):
+        """Make the mocked model return one box per (class name, confidence)."""
+        names = sorted({name for name, _ in detections})
+        mock_yolo.return_value.return_value = [type('MockResult', (), {
+            'boxes': [
+                type('MockBox', (), {
+                    'cls': torch.tensor([names.index(name)]),
+                    'conf': torch.tensor([confidence]),
+                    'xyxy': torch.tensor([[10, 10, 50, 50]])
+                })()
+                for name, confidence in detections
+            ],
+            'names': dict(enumerate(names))
+        })()]
+
+    def _post_image(self):
+        self.image.seek(0)
+        return self.client.post(
+            reverse('analyze-image'), {'image': self.image, 'image_type': 'normal'}, format='multipart'
+        )
+
+    @patch('api.views.YOLO')
+    def test_analysis_stores_mean_confidence(self, mock_yolo):
+        """Test each classification stores the mean confidence of its class's detections."""
+        print("Running test_analysis_stores_mean_confidence...")
+        self._mock_detections(mock_yolo, [('caries', 0.6), ('caries', 0.8), ('calculus', 0.5)])
+        response = self._post_image()
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        analysis = ImageAnalysis.objects.get(pk=response.data['analysisId'])
+        confidences = dict(analysis.imageclassification_set.values_list('disease__name', 'confidence'))
+        self.assertAlmostEqual(confidences['Caries'], 0.7, places=5)
+        self.assertAlmostEqual(confidences['Calculus'], 0.5, places=5)
+        self.assertEqual(analysis.count_map(), {'caries': 2, 'calculus': 1})
+        self.assertFalse(DentalImage.objects.filter(image_url='none').exists())
+        self.assertEqual(analysis.analyzed_image_url, DentalImage.objects.exclude(
+            pk=analysis.original_image_id).get().image_url)
+        print("test_analysis_stores_mean_confidence: PASSED")
+
+    @patch('api.views.YOLO')
+    def test_analysis_query_count_is_fixed(self, mock_yolo):
+        """Test an analysis costs the same few queries however many classes it detects."""
+        print("Running test_analysis_query_count_is_fixed...")
+        classes = ['caries', 'calculus', 'gingivitis', 'ulcer']
+        self._mock_detections(mock_yolo, [(name, 0.9) for name in classes])
+        with self.captureOnCommitCallbacks(execute=True):
+            # Warm the disease cache
+            self.assertEqual(self._post_image().status_code, status.HTTP_200_OK)
+        counts = []
+        for detected in (classes[:1], classes):
+            self._mock_detections(mock_yolo, [(name, 0.9) for name in detected])
+            with CaptureQueriesContext(connection) as queries:
+                self.assertEqual(self._post_image().status_code, status.HTTP_200_OK)
+            counts.append(len(queries))
+        self.assertEqual(counts[0], counts[1])
+        # Savepoint pair, images, analysis, counts, classifications
+        self.assertLessEqual(counts[1], 6)
+        print("test_analysis_query_count_is_fixed: PASSED")
+
+    @patch('api.views.YOLO')
+    def test_analysis_write_is_atomic(self, mock_yolo):
+        """Test a failure while saving leaves no partial analysis behind."""
+        print("Running test_analysis_write_is_atomic...")
+        self._mock_detections(mock_yolo, [('caries', 0.9)])
+        with patch('api.views.ImageClassification.objects.bulk_create', side_effect=RuntimeError('boom')):
+            response = self._post_image()
+        self.assertEqual(response.status_code, status.HTTP_500_INTERNAL_SERVER_ERROR)
+        self.assertFalse(ImageAnalysis.objects.exists())
+        self.assertFalse(DentalImage.objects.exists())
+        self.assertFalse(DetectionCount.objects.exists())
+        print("test_analysis_write_is_atomic: PASSED")
+
+    @patch('api.views.YOLO')
+    def test_queryset_delete_of_disease_forgets_cached_id(self, mock_yolo):
+        """Test a disease deleted through a queryset is not referenced by the next analysis."""
+        print("Running test_queryset_delete_of_disease_forgets_cached_id...")
+        self._mock_detections(mock_yolo, [('caries', 0.9)])
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(self._post_image().status_code, status.HTTP_200_OK)
+        stale_id = Disease.ids_for(['Caries'])['Caries']
+        Disease.objects.filter(name='Caries').delete()
+        response = self._post_image()
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        classification = ImageAnalysis.objects.get(pk=response.data['analysisId']).imageclassification_set.get()
+        self.assertNotEqual(classification.disease_id, stale_id)
+        self.assertEqual(classification.disease.name, 'Caries')
+        print("test_queryset_delete_of_disease_forgets_cached_id: PASSED")
+
     def test_analyze_image_no_image(self):
         """Test image analysis fails when no image is provided."""
         print("Running test_analyze_image_no_image...")
@@ -278,6 +456,34 @@ class AnalyzeImageViewTests(APITestCase):
         self.assertEqual(response.data['error'], 'No image provided')
         print("test_analyze_image_no_image: PASSED")
 
+class AnalyzeImageStaleDiseaseTests(TransactionTestCase):
+    # Real commits, so the deferred foreign key check fails inside the view
+    setUp = AnalyzeImageViewTests.setUp
+    _mock_detections = AnalyzeImageViewTests._mock_detections
+    _post_image = AnalyzeImageViewTests._post_image
+
+    def tearDown(self):
+        Disease.forget_ids()
+
+    @patch('api.views.YOLO')
+    def test_disease_deleted_by_another_process_is_retried(self, mock_yolo):
+        """Test an id cached before another process deleted the disease costs one retry, not a 500."""
+        print("Running test_disease_deleted_by_another_process_is_retried...")
+        self._mock_detections(mock_yolo, [('caries', 0.9)])
+        stale = Disease.objects.create(name='Caries')
+        Disease.ids_for(['Caries'])
+        # A delete in another worker sends no signal here
+        with patch('api.models.Disease.forget_ids'):
+            Disease.objects.filter(pk=stale.pk).delete()
+        self.assertEqual(Disease._ids_by_name, {'Caries': stale.pk})
+        response = self._post_image()
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        classification = ImageAnalysis.objects.get().imageclassification_set.get()
+        self.assertEqual(classification.disease.name, 'Caries')
+        self.assertEqual(DentalImage.objects.count(), 2)
+        print("test_disease_deleted_by_another_process_is_retried: PASSED")
+
+
 class DashboardStatsViewTests(APITestCase):
     def setUp(self):
         self.client = APIClient()
@@ -389,6 +595,7 @@ class ChangePasswordViewTests(APITestCase):
 
 class CheckUsernameViewTests(APITestCase):
     def setUp(self):
+        cache.clear()
         self.client = APIClient()
         self.user = User.objects.create_user(
             username='testuser', email='test@example.com', password='pass123'
@@ -412,6 +619,47 @@ class CheckUsernameViewTests(APITestCase):
         self.assertFalse(response.data['exists'])
         print("test_check_non_existing_username: PASSED")
 
+    def test_check_username_case_insensitive_and_post(self):
+        """Test checks ignore case and POST answers 200 for unknown usernames."""
+        print("Running test_check_username_case_insensitive_and_post...")
+        response = self.client.get(reverse('check-username') + '?username=TestUser')
+        self.assertEqual((response.data['exists'], response.data['available']), (True, False))
+        response = self.client.post(reverse('check-username'), {'username': 'nobody'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual((response.data['exists'], response.data['available']), (False, True))
+        print("test_check_username_case_insensitive_and_post: PASSED")
+
+    def test_filter_skips_database_for_free_usernames(self):
+        """Test the Bloom filter answers free usernames and tracks new registrations."""
+        print("Running test_filter_skips_database_for_free_usernames...")
+        usernames.warm()
+        with self.assertNumQueries(0):
+            self.assertFalse(usernames.exists('free-name'))
+        with self.assertNumQueries(1):
+            self.assertTrue(usernames.exists('TESTUSER'))
+        User.objects.create_user(username='NewPatient', email='new@example.com', password='pass123')
+        self.assertTrue(usernames.exists('newpatient'))
+
+        bloom = BloomFilter(1000, 0.01)
+        for index in range(1000):
+            bloom.add(f'user{index}')
+        self.assertTrue(all(f'user{index}' in bloom for index in range(1000)))
+        false_positives = sum(f'other{index}' in bloom for index in range(10000))
+        self.assertLess(false_positives, 300)
+        print("test_filter_skips_database_for_free_usernames: PASSED")
+
+    def test_username_checks_are_throttled(self):
+        """Test per-IP throttling of availability checks."""
+        print("Running test_username_checks_are_throttled...")
+        with patch.object(UsernameCheckThrottle, 'THROTTLE_RATES', {'username_check': '2/min'}):
+            for _ in range(2):
+                self.assertEqual(self.client.get(reverse('check-username') + '?username=a').status_code, 200)
+            response = self.client.get(reverse('check-username') + '?username=a')
+            self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+            response = self.client.get(reverse('check-username') + '?username=a', REMOTE_ADDR='10.0.0.2')
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+        print("test_username_checks_are_throttled: PASSED")
+
 class WorkScheduleViewSetTests(APITestCase):
     def setUp(self):
         self.client = APIClient()
@@ -453,4 +701,1695 @@ class WorkScheduleViewSetTests(APITestCase):
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         self.assertEqual(len(response.data), 1)
         self.assertEqual(response.data[0]['day'], 'Monday')
-        print("test_retrieve_work_schedule: PASSED")
\ No newline at end of file
+        print("test_retrieve_work_schedule: PASSED")
+
+class DetectionCountTests(APITestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.user = User.objects.create_user(
+            username='testuser', email='test@example.com', password='pass123'
+        )
+        self.client.force_authenticate(user=self.user)
+        image = DentalImage.objects.create(image='dental_images/test.jpg')
+        self.xray = ImageAnalysis.objects.create(
+            user=self.user, original_image=image, image_type='xray', total_conditions=4
+        )
+        DetectionCount.objects.bulk_create([
+            DetectionCount(analysis=self.xray, class_name='cavity', count=3),
+            DetectionCount(analysis=self.xray, class_name='implant', count=1),
+        ])
+        self.normal = ImageAnalysis.objects.create(
+            user=self.user, original_image=image, total_conditions=1
+        )
+        DetectionCount.objects.create(analysis=self.normal, class_name='cavity', count=1)
+
+    def test_serializer_keeps_legacy_count_fields(self):
+        """Test legacy *_count fields are computed from DetectionCount rows."""
+        print("Running test_serializer_keeps_legacy_count_fields...")
+        data = ImageAnalysisSerializer(self.xray).data
+        self.assertEqual(data['cavity_count'], 3)
+        self.assertEqual(data['implant_count'], 1)
+        self.assertEqual(data['caries_count'], 0)
+        self.assertEqual(data['detection_counts'], {'cavity': 3, 'implant': 1})
+        print("test_serializer_keeps_legacy_count_fields: PASSED")
+
+    def test_filter_analyses_by_min_count(self):
+        """Test ?min_<class>= filters analyses by detection count threshold."""
+        print("Running test_filter_analyses_by_min_count...")
+        self.assertEqual(
+            list(ImageAnalysis.objects.with_min_count('cavity', 2)), [self.xray]
+        )
+        response = self.client.get(reverse('user-analyses') + '?min_cavity=2')
+        print(f"Response status: {response.status_code}, Response data: {response.data}")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([a['id'] for a in response.data], [self.xray.id])
+        # A zero threshold keeps analyses with no row for the class
+        self.assertEqual(
+            set(ImageAnalysis.objects.with_min_count('implant', 0)), {self.xray, self.normal}
+        )
+        response = self.client.get(reverse('user-analyses') + '?min_implant=0')
+        self.assertEqual({a['id'] for a in response.data}, {self.xray.id, self.normal.id})
+        print("test_filter_analyses_by_min_count: PASSED")
+
+
+class DentistPatientTests(TestCase):
+    def setUp(self):
+        self.patient = User.objects.create_user(
+            username='patient1', email='patient@example.com', password='pass123'
+        ).patient
+        self.dentist = User.objects.create_user(
+            username='dentist1', email='dentist@dentalcare.com', password='pass123'
+        ).dentist
+
+    def _book(self, day):
+        return Appointment.objects.create(
+            patient=self.patient, dentist=self.dentist, date=day,
+            start_time='10:00:00', end_time='11:00:00'
+        )
+
+    def test_link_follows_appointment_writes(self):
+        """Test DentistPatient is kept current on appointment create/update/delete."""
+        print("Running test_link_follows_appointment_writes...")
+        first = self._book(date(2025, 5, 1))
+        second = self._book(date(2025, 6, 1))
+        link = DentistPatient.objects.get(dentist=self.dentist, patient=self.patient)
+        self.assertEqual((link.first_visit, link.last_visit, link.visit_count),
+                         (date(2025, 5, 1), date(2025, 6, 1), 2))
+
+        second.date = date(2025, 7, 1)
+        second.save()
+        link.refresh_from_db()
+        self.assertEqual(link.last_visit, date(2025, 7, 1))
+
+        second.delete()
+        first.delete()
+        self.assertFalse(DentistPatient.objects.exists())
+        print("test_link_follows_appointment_writes: PASSED")
+
+    def test_backfill_command(self):
+        """Test backfill_dentist_patients rebuilds links from appointments."""
+        print("Running test_backfill_command...")
+        self._book(date(2025, 5, 1))
+        self._book(date(2025, 5, 8))
+        DentistPatient.objects.all().delete()
+        call_command('backfill_dentist_patients', stdout=io.StringIO())
+        link = DentistPatient.objects.get()
+        self.assertEqual(link.visit_count, 2)
+        self.assertEqual(link.last_visit, date(2025, 5, 8))
+        print("test_backfill_command: PASSED")
+
+
+class AvailabilityTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.dentist = User.objects.create_user(
+            username='dentist1', email='dentist@dentalcare.com', password='pass123'
+        ).dentist
+        self.patient = User.objects.create_user(
+            username='patient1', email='patient@example.com', password='pass123'
+        ).patient
+        WorkSchedule.objects.create(dentist=self.dentist, day='Monday', start_hour='9', end_hour='12')
+        self.url = reverse('dentist-availability', kwargs={'pk': self.dentist.pk})
+
+    def test_subtract_intervals(self):
+        """Test booked intervals are cut out of the working window."""
+        print("Running test_subtract_intervals...")
+        self.assertEqual(
+            subtract_intervals([(540, 720)], [(540, 570), (600, 660), (650, 700)]),
+            [(570, 600), (700, 720)]
+        )
+        self.assertEqual(subtract_intervals([(540, 720)], []), [(540, 720)])
+        print("test_subtract_intervals: PASSED")
+
+    def test_availability_excludes_bookings_and_refreshes(self):
+        """Test open slots skip booked time and update after a new booking."""
+        print("Running test_availability_excludes_bookings_and_refreshes...")
+        Appointment.objects.create(
+            patient=self.patient, dentist=self.dentist, date='2025-05-05',
+            start_time='10:00:00', end_time='11:00:00'
+        )
+        params = '?from=2025-05-05&to=2025-05-06&duration=60'
+        response = self.client.get(self.url + params)
+        print(f"Response status: {response.status_code}, Response data: {response.data}")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        monday, tuesday = response.data['days']
+        self.assertEqual([s['start_time'] for s in monday['slots']], ['09:00', '11:00'])
+        self.assertEqual(tuesday['slots'], [])
+
+        Appointment.objects.create(
+            patient=self.patient, dentist=self.dentist, date='2025-05-05',
+            start_time='11:00:00', end_time='12:00:00'
+        )
+        response = self.client.get(self.url + params)
+        self.assertEqual([s['start_time'] for s in response.data['days'][0]['slots']], ['09:00'])
+        print("test_availability_excludes_bookings_and_refreshes: PASSED")
+
+    def test_unseen_bookings_show_up_after_cache_lifetime(self):
+        """Test a booking whose invalidation never reached this process is visible within AVAILABILITY_CACHE_SECONDS."""
+        print("Running test_unseen_bookings_show_up_after_cache_lifetime...")
+        params = '?from=2025-05-05&to=2025-05-05&duration=60'
+        self.assertEqual(len(self.client.get(self.url + params).data['days'][0]['slots']), 3)
+        # Booked through another worker: no invalidation here
+        Appointment.objects.bulk_create([Appointment(
+            patient=self.patient, dentist=self.dentist, date=date(2025, 5, 5),
+            start_time=time(9), end_time=time(10),
+        )])
+        self.assertEqual(len(self.client.get(self.url + params).data['days'][0]['slots']), 3)
+        later = clock.time() + settings.AVAILABILITY_CACHE_SECONDS + 1
+        with patch('django.core.cache.backends.locmem.time') as locmem_time:
+            locmem_time.time.return_value = later
+            slots = self.client.get(self.url + params).data['days'][0]['slots']
+        self.assertEqual([s['start_time'] for s in slots], ['10:00', '11:00'])
+        print("test_unseen_bookings_show_up_after_cache_lifetime: PASSED")
+
+    def test_availability_rejects_bad_range(self):
+        """Test an inverted date range is rejected."""
+        print("Running test_availability_rejects_bad_range...")
+        response = self.client.get(self.url + '?from=2025-05-06&to=2025-05-05')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        print("test_availability_rejects_bad_range: PASSED")
+
+
+class DoubleBookingTests(TransactionTestCase):
+    def setUp(self):
+        self.dentist_user = User.objects.create_user(
+            username='dentist1', email='dentist@dentalcare.com', password='pass123'
+        )
+        self.patients = [
+            User.objects.create_user(
+                username=f'patient{i}', email=f'patient{i}@example.com', password='pass123'
+            ) for i in range(10)
+        ]
+
+    def _book(self, user, start='10:00:00', end='11:00:00'):
+        client = APIClient()
+        client.force_authenticate(user=user)
+        try:
+            return client.post(reverse('appointment-list'), {
+                'dentist': self.dentist_user.dentist.pk,
+                'date': '2025-05-01', 'start_time': start, 'end_time': end,
+            }, format='json').status_code
+        finally:
+            connection.close()
+
+    def test_overlapping_booking_rejected(self):
+        """Test a booking overlapping an existing one gets 409."""
+        print("Running test_overlapping_booking_rejected...")
+        self.assertEqual(self._book(self.patients[0]), status.HTTP_201_CREATED)
+        self.assertEqual(self._book(self.patients[1], '10:30:00', '11:30:00'), status.HTTP_409_CONFLICT)
+        self.assertEqual(self._book(self.patients[1], '11:00:00', '12:00:00'), status.HTTP_201_CREATED)
+        print("test_overlapping_booking_rejected: PASSED")
+
+    def test_concurrent_booking_single_winner(self):
+        """Test hundreds of parallel requests for one slot produce exactly one booking."""
+        print("Running test_concurrent_booking_single_winner...")
+        requests_count = 200
+        started = clock.perf_counter()
+        with ThreadPoolExecutor(max_workers=16) as pool:
+            codes = list(pool.map(
+                lambda i: self._book(self.patients[i % len(self.patients)]), range(requests_count)
+            ))
+        elapsed = clock.perf_counter() - started
+        print(f"{requests_count} concurrent bookings in {elapsed:.2f}s "
+              f"({requests_count / elapsed:.0f} req/s), status counts: "
+              f"{ {code: codes.count(code) for code in set(codes)} }")
+        self.assertEqual(codes.count(status.HTTP_201_CREATED), 1)
+        self.assertEqual(codes.count(status.HTTP_409_CONFLICT), requests_count - 1)
+        self.assertEqual(Appointment.objects.count(), 1)
+        print("test_concurrent_booking_single_winner: PASSED")
+
+
+class BulkAppointmentTests(APITestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.dentist_user = User.objects.create_user(
+            username='dentist1', email='dentist@dentalcare.com', password='pass123'
+        )
+        self.patient_user = User.objects.create_user(
+            username='patient1', email='patient@example.com', password='pass123'
+        )
+        other_dentist = User.objects.create_user(
+            username='dentist2', email='dentist2@dentalcare.com', password='pass123'
+        )
+        self.appointments = [
+            Appointment.objects.create(
+                patient=self.patient_user.patient, dentist=self.dentist_user.dentist,
+                date='2025-05-01', start_time=f'{hour}:00:00', end_time=f'{hour + 1}:00:00'
+            ) for hour in (9, 10, 11)
+        ]
+        self.foreign = Appointment.objects.create(
+            patient=self.patient_user.patient, dentist=other_dentist.dentist,
+            date='2025-05-01', start_time='09:00:00', end_time='10:00:00'
+        )
+        self.client.force_authenticate(user=self.dentist_user)
+
+    def test_bulk_operations(self):
+        """Test approve, cancel and reschedule in one request with per-id results."""
+        print("Running test_bulk_operations...")
+        first, second, third = self.appointments
+        payload = {'operations': [
+            {'id': first.id, 'op': 'approve'},
+            {'id': second.id, 'op': 'cancel'},
+            {'id': third.id, 'op': 'reschedule', 'date': '2025-05-01',
+             'start_time': '09:30:00', 'end_time': '10:30:00'},
+            {'id': self.foreign.id, 'op': 'approve'},
+        ]}
+        response = self.client.post(reverse('appointment-bulk'), payload, format='json')
+        print(f"Response status: {response.status_code}, Response data: {response.data}")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        results = {r['id']: r['status'] for r in response.data['results']}
+        self.assertEqual(results, {
+            first.id: 'approved', second.id: 'cancelled',
+            third.id: 'conflict', self.foreign.id: 'not_found',
+        })
+        first.refresh_from_db()
+        self.assertTrue(first.approved)
+        self.assertFalse(Appointment.objects.filter(pk=second.pk).exists())
+        self.assertEqual(DentistPatient.objects.get(dentist=self.dentist_user.dentist).visit_count, 2)
+        print("test_bulk_operations: PASSED")
+
+    def test_bulk_reschedule_into_freed_slot(self):
+        """Test a reschedule can take a slot cancelled in the same request."""
+        print("Running test_bulk_reschedule_into_freed_slot...")
+        first, second, third = self.appointments
+        payload = {'operations': [
+            {'id': first.id, 'op': 'cancel'},
+            {'id': third.id, 'op': 'reschedule', 'date': '2025-05-01',
+             'start_time': '09:00:00', 'end_time': '10:00:00'},
+        ]}
+        response = self.client.post(reverse('appointment-bulk'), payload, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        third.refresh_from_db()
+        self.assertEqual(str(third.start_time), '09:00:00')
+        print("test_bulk_reschedule_into_freed_slot: PASSED")
+
+    def test_patient_cannot_bulk_approve(self):
+        """Test patients get 'forbidden' for approve operations."""
+        print("Running test_patient_cannot_bulk_approve...")
+        self.client.force_authenticate(user=self.patient_user)
+        payload = {'operations': [{'id': self.appointments[0].id, 'op': 'approve'}]}
+        response = self.client.post(reverse('appointment-bulk'), payload, format='json')
+        self.assertEqual(response.data['results'][0]['status'], 'forbidden')
+        print("test_patient_cannot_bulk_approve: PASSED")
+
+
+class AppointmentListTests(APITestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.dentist_user = User.objects.create_user(
+            username='dentist1', email='dentist@dentalcare.com', password='pass123'
+        )
+        self.patient_user = User.objects.create_user(
+            username='patient1', email='patient@example.com', password='pass123'
+        )
+        for day in range(1, 6):
+            Appointment.objects.create(
+                patient=self.patient_user.patient, dentist=self.dentist_user.dentist,
+                date=f'2025-05-0{day}', start_time='10:00:00', end_time='11:00:00',
+                approved=day % 2 == 0, treatment='Root Canal' if day == 5 else 'Pending'
+            )
+        self.client.force_authenticate(user=self.dentist_user)
+
+    def test_cursor_pagination(self):
+        """Test ?page_size= pages through appointments in date order."""
+        print("Running test_cursor_pagination...")
+        response = self.client.get(reverse('appointment-list') + '?page_size=2')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        dates = [a['date'] for a in response.data['results']]
+        response = self.client.get(response.data['next'])
+        dates += [a['date'] for a in response.data['results']]
+        self.assertEqual(dates, ['2025-05-01', '2025-05-02', '2025-05-03', '2025-05-04'])
+        # Without pagination parameters the plain list is kept
+        response = self.client.get(reverse('appointment-list'))
+        self.assertEqual(len(response.data), 5)
+        print("test_cursor_pagination: PASSED")
+
+    def test_list_filters(self):
+        """Test date range, approved and treatment filters."""
+        print("Running test_list_filters...")
+        url = reverse('appointment-list')
+        response = self.client.get(url + '?date_from=2025-05-02&date_to=2025-05-04')
+        self.assertEqual(len(response.data), 3)
+        response = self.client.get(url + '?approved=true')
+        self.assertEqual(len(response.data), 2)
+        response = self.client.get(url + '?treatment=Root Canal')
+        self.assertEqual([a['date'] for a in response.data], ['2025-05-05'])
+        response = self.client.get(url + '?date_from=May')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        print("test_list_filters: PASSED")
+
+
+class AppointmentQueryPlanTests(TestCase):
+    def setUp(self):
+        self.dentist = User.objects.create_user(
+            username='dentist1', email='dentist@dentalcare.com', password='pass123'
+        ).dentist
+        self.patient = User.objects.create_user(
+            username='patient1', email='patient@example.com', password='pass123'
+        ).patient
+
+    def _plans(self):
+        ordering = ('date', 'start_time', 'id')
+        return {
+            'appointment_dentist_slot_idx': Appointment.objects.filter(
+                dentist=self.dentist, date__gte='2025-05-01').order_by(*ordering).explain(),
+            'appointment_patient_slot_idx': Appointment.objects.filter(
+                patient=self.patient, date__gte='2025-05-01').order_by(*ordering).explain(),
+        }
+
+    @skipUnless(connection.vendor == 'sqlite', "SQLite query plan")
+    def test_sqlite_plans_use_slot_indexes(self):
+        """Test appointment list queries use the composite slot indexes on SQLite."""
+        print("Running test_sqlite_plans_use_slot_indexes...")
+        for index, plan in self._plans().items():
+            print(plan)
+            self.assertIn(index, plan)
+        print("test_sqlite_plans_use_slot_indexes: PASSED")
+
+    @skipUnless(connection.vendor == 'postgresql', "PostgreSQL query plan")
+    def test_postgresql_plans_use_slot_indexes(self):
+        """Test appointment list queries use the composite slot indexes on PostgreSQL."""
+        print("Running test_postgresql_plans_use_slot_indexes...")
+        with connection.cursor() as cursor:
+            # Tiny test tables would otherwise always be sequentially scanned
+            cursor.execute("SET enable_seqscan = off")
+        for index, plan in self._plans().items():
+            print(plan)
+            self.assertIn(index, plan)
+        print("test_postgresql_plans_use_slot_indexes: PASSED")
+
+
+
+class QueryPlanAuditTests(APITestCase):
+    """
+    EXPLAIN every SELECT the hot endpoints run against a clinic-sized dataset
+    and fail on a full scan of a growing table (api/query_plans.py).
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        dentists, patients = seed_dataset()
+        cls.dentist, cls.patient = dentists[0], patients[0]
+        with connection.cursor() as cursor:
+            # Planner statistics, as a production database would have
+            cursor.execute('ANALYZE')
+
+    def setUp(self):
+        cache.clear()
+
+    def _endpoints(self):
+        today = timezone.now().date()
+        month_ago = (today - timezone.timedelta(days=30)).isoformat()
+        cursor = changes_since(self.dentist)['cursor']
+        return [
+            ('dentist appointments', self.dentist, reverse('appointment-list') + f'?date_from={month_ago}'),
+            ('patient appointments', self.patient, reverse('appointment-list')),
+            ('dentist patients', self.dentist, reverse('patient-list')),
+            ('dashboard', self.dentist, reverse('dashboard-stats')),
+            ('patient analyses', self.patient, reverse('user-analyses')),
+            ('patient profile', self.patient, reverse('user-profile')),
+            ('dentist sync', self.dentist, reverse('sync') + f'?since={cursor}'),
+            ('patient sync', self.patient, reverse('sync')),
+            ('availability', self.patient, reverse('dentist-availability', kwargs={'pk': self.dentist.pk})),
+        ]
+
+    def _assert_no_full_scans(self, label, queries):
+        for sql, params in queries:
+            scans = full_scans(sql, params)
+            self.assertEqual(scans, [], f"{label}: full table scan in\n{sql}\n{explain(sql, params)}")
+
+    def test_hot_endpoints_use_indexes(self):
+        """Test the hot endpoints' queries never fully scan a growing table."""
+        print("Running test_hot_endpoints_use_indexes...")
+        for label, user, url in self._endpoints():
+            self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {AccessToken.for_user(user)}')
+            with capture_selects() as queries:
+                response = self.client.get(url)
+            self.assertEqual(response.status_code, status.HTTP_200_OK, (label, response.content[:200]))
+            self.assertTrue(queries, label)
+            self._assert_no_full_scans(label, queries)
+        print("test_hot_endpoints_use_indexes: PASSED")
+
+    def test_lookup_queries_use_indexes(self):
+        """Test the disease name and membership date lookups are index searches."""
+        print("Running test_lookup_queries_use_indexes...")
+        since = timezone.now().date() - timezone.timedelta(days=30)
+        querysets = {
+            'disease by name': Disease.objects.filter(name='Caries'),
+            'new patients': Patient.objects.filter(member_since__gte=since),
+        }
+        for label, queryset in querysets.items():
+            sql, params = queryset.query.sql_with_params()
+            self._assert_no_full_scans(label, [(sql, params)])
+        print("test_lookup_queries_use_indexes: PASSED")
+
+    def test_full_scan_is_reported(self):
+        """Test an unindexed filter is caught, so the audit cannot pass vacuously."""
+        print("Running test_full_scan_is_reported...")
+        sql, params = Appointment.objects.filter(detail='x').query.sql_with_params()
+        self.assertTrue(full_scans(sql, params))
+        # SQLite names the aliased subquery table U0 in its plan
+        subquery = Appointment.objects.filter(patient__in=Patient.objects.filter(allergies='x'))
+        sql, params = subquery.query.sql_with_params()
+        self.assertTrue(full_scans(sql, params))
+        print("test_full_scan_is_reported: PASSED")
+
+
+class QueryBudgetTests(APITestCase):
+    """
+    Call every endpoint against a clinic-sized dataset and hold it to the
+    QueryBudget declared next to its view (api/budgets.py). Caches are
+    cleared before each call, so the budgets cover a cold request.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        dentists, patients = seed_dataset()
+        cls.dentist, cls.patient = dentists[0], patients[0]
+        cls.admin = User.objects.create_superuser(
+            username='budget_admin', email='budget_admin@example.com', password='pass123'
+        )
+        WorkSchedule.objects.bulk_create([
+            WorkSchedule(dentist_id=cls.dentist.pk, day=day, start_hour='9', end_hour='17')
+            for day in ('Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday')
+        ])
+        Treatment.objects.bulk_create([
+            Treatment(dentist_id=dentist.pk, patient_id=patient.pk, date=timezone.now().date(), detail='Cleaning')
+            for dentist in dentists for patient in patients[:5]
+        ])
+
+    def _api_endpoints(self):
+        dentist, patient = self.dentist, self.patient
+        appointment = Appointment.objects.filter(dentist_id=dentist.pk).first()
+        linked_patient = DentistPatient.objects.filter(dentist_id=dentist.pk).first().patient_id
+        next_monday = timezone.now().date() + timezone.timedelta(days=7 - timezone.now().weekday() + 7)
+        return [
+            (patient, 'get', reverse('dentist-list'), None),
+            (patient, 'get', reverse('dentist-detail', kwargs={'pk': dentist.pk}), None),
+            (patient, 'get', reverse('dentist-availability', kwargs={'pk': dentist.pk}), None),
+            (patient, 'get', reverse('dentist-schedule-list', kwargs={'dentist_pk': dentist.pk}), None),
+            (dentist, 'get', reverse('patient-list'), None),
+            (dentist, 'get', reverse('patient-detail', kwargs={'pk': linked_patient}), None),
+            (dentist, 'get', reverse('patient-history', kwargs={'pk': linked_patient}), None),
+            (dentist, 'get', reverse('appointment-list'), None),
+            (patient, 'get', reverse('appointment-list'), None),
+            (dentist, 'get', reverse('appointment-detail', kwargs={'pk': appointment.pk}), None),
+            (patient, 'post', reverse('appointment-list'), {
+                'dentist': dentist.pk, 'date': next_monday.isoformat(),
+                'start_time': '09:00:00', 'end_time': '09:30:00',
+            }),
+            (dentist, 'patch', reverse('appointment-approve', kwargs={'pk': appointment.pk}), None),
+            (dentist, 'get', reverse('dashboard-stats'), None),
+            (dentist, 'get', reverse('user-profile'), None),
+            (patient, 'get', reverse('user-profile'), None),
+            (patient, 'get', reverse('user-analyses'), None),
+            (patient, 'get', reverse('sync'), None),
+            (None, 'get', reverse('check-username') + '?username=free_name', None),
+        ]
+
+    def _admin_endpoints(self):
+        return [reverse(f'admin:api_{model._meta.model_name}_changelist') for model in (
+            User, Dentist, Patient, DentalImage, Disease, ImageAnalysis, Appointment, DentistPatient,
+            Treatment, WorkSchedule,
+        )]
+
+    def _assert_within_budget(self, method, url, recorder):
+        match = resolve(url.split('?')[0])
+        budget = budget_for(match, method)
+        self.assertIsNotNone(budget, f"{method.upper()} {url}: no query_budget declared on the view")
+        print(f"{method.upper():<5} {url:<45} {recorder.count:>3} queries {recorder.ms:6.1f} ms  {budget}")
+        problems = budget.violations(recorder)
+        self.assertEqual(problems, [], f"{method.upper()} {url} over budget; most repeated queries:\n" + '\n'.join(
+            f"  {count}x {sql}" for count, sql in recorder.fingerprints()))
+
+    def test_api_endpoints_within_budget(self):
+        """Test each API endpoint stays within its declared query and time budget."""
+        print("Running test_api_endpoints_within_budget...")
+        for user, method, url, data in self._api_endpoints():
+            cache.clear()
+            if user is None:
+                self.client.credentials()
+            else:
+                self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {AccessToken.for_user(user)}')
+            with record_queries() as recorder:
+                response = getattr(self.client, method)(url, data, format='json')
+            self.assertLess(response.status_code, 400, (url, response.content[:200]))
+            self._assert_within_budget(method, url, recorder)
+        print("test_api_endpoints_within_budget: PASSED")
+
+    def test_admin_changelists_within_budget(self):
+        """Test each admin changelist stays within its declared budget (no per-row queries)."""
+        print("Running test_admin_changelists_within_budget...")
+        self.client.force_login(self.admin)
+        for url in self._admin_endpoints():
+            with record_queries() as recorder:
+                response = self.client.get(url)
+            self.assertEqual(response.status_code, status.HTTP_200_OK, url)
+            self._assert_within_budget('get', url, recorder)
+        print("test_admin_changelists_within_budget: PASSED")
+
+    def test_n_plus_one_is_caught(self):
+        """Test a changelist that loads related rows one by one goes over budget, fingerprinted."""
+        print("Running test_n_plus_one_is_caught...")
+        self.client.force_login(self.admin)
+        url = reverse('admin:api_dentistpatient_changelist')
+        # Drop patient__user, which each row's str(patient) needs
+        with patch.object(DentistPatientAdmin, 'list_select_related', ('dentist__user',)):
+            with self.assertLogs('api.budgets', 'WARNING'), record_queries() as recorder:
+                self.client.get(url)
+        self.assertTrue(budget_for(resolve(url), 'get').violations(recorder))
+        count, sql = recorder.fingerprints(limit=1)[0]
+        self.assertGreaterEqual(count, 50)
+        self.assertIn('FROM "api_user" WHERE "api_user"."id" = ?', sql)
+        print("test_n_plus_one_is_caught: PASSED")
+
+    def test_middleware_logs_over_budget_requests(self):
+        """Test the middleware logs an over-budget request with its query fingerprints, and nothing otherwise."""
+        print("Running test_middleware_logs_over_budget_requests...")
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {AccessToken.for_user(self.dentist)}')
+        url = reverse('dashboard-stats')
+        with self.assertNoLogs('api.budgets', 'WARNING'):
+            self.client.get(url)
+        cache.clear()
+        with patch.object(DashboardStatsView, 'query_budget', QueryBudget(queries=1)):
+            with self.assertLogs('api.budgets', 'WARNING') as logs:
+                self.client.get(url)
+        self.assertIn(f'GET {url} over budget', logs.output[0])
+        self.assertIn('(budget 1)', logs.output[0])
+        self.assertIn('1x SELECT', logs.output[0])
+        print("test_middleware_logs_over_budget_requests: PASSED")
+
+    def test_fingerprint_normalizes_values(self):
+        """Test fingerprints drop parameters and literals and collapse IN lists."""
+        print("Running test_fingerprint_normalizes_values...")
+        self.assertEqual(
+            fingerprint("SELECT *  FROM t WHERE a = %s AND b = 'x' AND c > 10\n AND d IN (%s, %s, %s)"),
+            "SELECT * FROM t WHERE a = ? AND b = ? AND c > ? AND d IN (...)",
+        )
+        print("test_fingerprint_normalizes_values: PASSED")
+
+class SparseFieldsTests(APITestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.dentist_user = User.objects.create_user(
+            username='dentist1', email='dentist@dentalcare.com', password='pass123'
+        )
+        self.patient_user = User.objects.create_user(
+            username='patient1', email='patient@example.com', password='pass123'
+        )
+        image = DentalImage.objects.create(image='dental_images/test.jpg')
+        analysis = ImageAnalysis.objects.create(user=self.patient_user, original_image=image)
+        for day in range(1, 4):
+            Appointment.objects.create(
+                patient=self.patient_user.patient, dentist=self.dentist_user.dentist,
+                date=f'2025-05-0{day}', start_time='10:00:00', end_time='11:00:00',
+                analyzed_image=analysis
+            )
+        self.client.force_authenticate(user=self.dentist_user)
+
+    def test_fields_restricts_output_and_queries(self):
+        """Test ?fields= returns only the named fields and skips nested prefetches."""
+        print("Running test_fields_restricts_output_and_queries...")
+        url = reverse('appointment-list')
+        with self.assertNumQueries(1):
+            response = self.client.get(url + '?fields=id,date')
+        self.assertEqual(set(response.data[0]), {'id', 'date'})
+        # Legacy shape is unchanged without the parameters
+        response = self.client.get(url)
+        self.assertIn('diseases', response.data[0]['analyzed_image'])
+        print("test_fields_restricts_output_and_queries: PASSED")
+
+    def test_expand_opts_in_to_nested(self):
+        """Test nested relations are only rendered when listed in ?expand=."""
+        print("Running test_expand_opts_in_to_nested...")
+        url = reverse('appointment-list')
+        response = self.client.get(url + '?fields=id,analyzed_image_id')
+        self.assertNotIn('analyzed_image', response.data[0])
+        response = self.client.get(url + '?expand=analyzed_image&fields=id,analyzed_image.id,analyzed_image.total_conditions')
+        self.assertEqual(set(response.data[0]['analyzed_image']), {'id', 'total_conditions'})
+        response = self.client.get(url + '?expand=analyzed_image.diseases&fields=analyzed_image')
+        self.assertIn('diseases', response.data[0]['analyzed_image'])
+        self.assertNotIn('original_image', response.data[0]['analyzed_image'])
+        print("test_expand_opts_in_to_nested: PASSED")
+
+
+class DentistPatientListTests(APITestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.dentist_user = User.objects.create_user(
+            username='dentist1', email='dentist@dentalcare.com', password='pass123'
+        )
+        other_dentist = User.objects.create_user(
+            username='dentist2', email='dentist2@dentalcare.com', password='pass123'
+        ).dentist
+        self.patients = [
+            User.objects.create_user(
+                username=f'patient{i}', email=f'patient{i}@example.com', password='pass123'
+            ).patient for i in range(3)
+        ]
+        # patient0 visited last, patient2 first; patient0 also sees another dentist
+        for i, patient in enumerate(self.patients):
+            for week in range(8):
+                Appointment.objects.create(
+                    patient=patient, dentist=self.dentist_user.dentist,
+                    date=date(2025, 1, 1) + timezone.timedelta(days=7 * week - i),
+                    start_time='10:00:00', end_time='11:00:00'
+                )
+        Appointment.objects.create(
+            patient=self.patients[0], dentist=other_dentist,
+            date='2025-06-01', start_time='10:00:00', end_time='11:00:00'
+        )
+        self.client.force_authenticate(user=self.dentist_user)
+
+    def test_patients_sorted_by_last_visit_with_capped_appointments(self):
+        """Test the dentist's patient list is sorted, paginated and nests only capped own appointments."""
+        print("Running test_patients_sorted_by_last_visit_with_capped_appointments...")
+        response = self.client.get(reverse('patient-list') + '?page_size=2')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        results = response.data['results']
+        self.assertEqual([p['id'] for p in results], [self.patients[0].pk, self.patients[1].pk])
+        self.assertIsNotNone(response.data['next'])
+        appointments = results[0]['appointments']
+        self.assertEqual(len(appointments), PatientViewSet.NESTED_APPOINTMENTS_LIMIT)
+        self.assertEqual({a['dentist'] for a in appointments}, {self.dentist_user.pk})
+        self.assertEqual(appointments[0]['date'], '2025-02-19')
+        print("test_patients_sorted_by_last_visit_with_capped_appointments: PASSED")
+
+    def test_patient_history(self):
+        """Test the history endpoint returns every appointment with this dentist."""
+        print("Running test_patient_history...")
+        url = reverse('patient-history', kwargs={'pk': self.patients[0].pk})
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data), 8)
+        response = self.client.get(url + '?page_size=3')
+        self.assertEqual(len(response.data['results']), 3)
+        print("test_patient_history: PASSED")
+
+
+class FastSerializationTests(TestCase):
+    def setUp(self):
+        dentist = User.objects.create_user(
+            username='dentist1', email='dentist@dentalcare.com', password='pass123',
+            first_name='Jane', last_name='Smith'
+        ).dentist
+        self.patient_user = User.objects.create_user(
+            username='patient1', email='patient@example.com', password='pass123'
+        )
+        image = DentalImage.objects.create(image='dental_images/test.jpg', image_url='/media/dental_images/test.jpg')
+        analysis = ImageAnalysis.objects.create(user=self.patient_user, original_image=image, total_conditions=3)
+        DetectionCount.objects.create(analysis=analysis, class_name='caries', count=2)
+        DetectionCount.objects.create(analysis=analysis, class_name='ulcer', count=1)
+        for name in ('Ulcer', 'Caries'):
+            analysis.diseases.add(Disease.objects.create(name=name), through_defaults={'confidence': 0.5})
+        Appointment.objects.create(
+            patient=self.patient_user.patient, dentist=dentist, date='2025-05-01',
+            start_time='10:00:00', end_time='11:30:00', analyzed_image=analysis, detail='Checkup'
+        )
+        Appointment.objects.create(
+            patient=self.patient_user.patient, dentist=dentist, date='2025-05-02',
+            start_time='10:00:00', end_time='11:00:00'
+        )
+        self.request = APIRequestFactory().get('/')
+        fragment_cache().clear()
+
+    def uncached(self, serializer):
+        # Marking the analysis serializers shaped skips the fragment cache
+        for target in (serializer.child, serializer.child.fields.get('analyzed_image')):
+            if target is not None:
+                target.shaped = True
+        return serializer
+
+    def test_appointment_rows_match_serializer(self):
+        """Test the fast appointment path renders byte-identical JSON."""
+        print("Running test_appointment_rows_match_serializer...")
+        appointments = Appointment.objects.order_by('id')
+        expected = self.uncached(
+            AppointmentSerializer(appointments, many=True, context={'request': self.request})
+        ).data
+        self.assertEqual(
+            JSONRenderer().render(appointment_rows(appointments, self.request)),
+            JSONRenderer().render(expected)
+        )
+        print("test_appointment_rows_match_serializer: PASSED")
+
+    def test_analysis_rows_match_serializer(self):
+        """Test the fast analysis path renders byte-identical JSON."""
+        print("Running test_analysis_rows_match_serializer...")
+        analyses = ImageAnalysis.objects.all()
+        expected = self.uncached(ImageAnalysisSerializer(analyses, many=True)).data
+        with self.assertNumQueries(4):
+            rows = analysis_rows(analyses)
+        self.assertEqual(JSONRenderer().render(rows), JSONRenderer().render(expected))
+        print("test_analysis_rows_match_serializer: PASSED")
+
+    def test_analysis_fragments_are_cached(self):
+        """Test analyses are built once, then served from the fragment cache in bulk."""
+        print("Running test_analysis_fragments_are_cached...")
+        analyses = ImageAnalysis.objects.all()
+        cold = analysis_rows(analyses, self.request)
+        with self.assertNumQueries(1):
+            warm = analysis_rows(analyses, self.request)
+        self.assertEqual(warm, cold)
+        self.assertTrue(warm[0]['original_image']['image'].startswith('http://testserver/'))
+
+        # Nested serializers load every fragment of a list with a single get_many
+        appointments = list(Appointment.objects.select_related('analyzed_image', 'patient__user', 'dentist__user'))
+        with patch.object(type(fragment_cache()), 'get_many', wraps=fragment_cache().get_many) as get_many, \
+                self.assertNumQueries(0):
+            data = AppointmentSerializer(appointments, many=True, context={'request': self.request}).data
+        self.assertEqual(get_many.call_count, 1)
+        self.assertEqual(data[0]['analyzed_image'], cold[0])
+        print("test_analysis_fragments_are_cached: PASSED")
+
+
+class UserAnalysisListTests(APITestCase):
+    def setUp(self):
+        fragment_cache().clear()
+        self.user = User.objects.create_user(
+            username='patient1', email='patient@example.com', password='pass123'
+        )
+        image = DentalImage.objects.create(image='dental_images/test.jpg', image_url='/media/dental_images/test.jpg')
+        for index in range(5):
+            analysis = ImageAnalysis.objects.create(
+                user=self.user, original_image=image, total_conditions=index, image_type='xray'
+            )
+            DetectionCount.objects.create(analysis=analysis, class_name='cavity', count=index + 1)
+            analysis.diseases.add(
+                Disease.objects.get_or_create(name='Cavity')[0], through_defaults={'confidence': 0.5}
+            )
+        self.client.force_authenticate(user=self.user)
+        self.url = reverse('user-analyses')
+
+    def test_paginated_list_query_count(self):
+        """Test keyset pages cost a fixed number of queries regardless of page size."""
+        print("Running test_paginated_list_query_count...")
+        # page query, id/created_at, then analyses, counts and diseases for the cold fragments
+        with self.assertNumQueries(5):
+            response = self.client.get(self.url + '?page_size=3')
+        first = [row['id'] for row in response.data['results']]
+        self.assertEqual(len(first), 3)
+        self.assertEqual(response.data['results'][0]['cavity_count'], 5)
+        with self.assertNumQueries(5):
+            response = self.client.get(response.data['next'])
+        ids = first + [row['id'] for row in response.data['results']]
+        self.assertEqual(ids, list(ImageAnalysis.objects.order_by('-created_at', '-id').values_list('id', flat=True)))
+        self.assertIsNone(response.data['next'])
+        # Shaped pages still prefetch instead of querying per row
+        with self.assertNumQueries(3):
+            response = self.client.get(self.url + '?page_size=5&expand=diseases')
+        self.assertEqual(len(response.data['results']), 5)
+        print("test_paginated_list_query_count: PASSED")
+
+    def test_summary_mode(self):
+        """Test ?summary=1 returns only the lightweight fields in one query."""
+        print("Running test_summary_mode...")
+        with self.assertNumQueries(1):
+            response = self.client.get(self.url + '?summary=1')
+        self.assertEqual(len(response.data), 5)
+        self.assertEqual(
+            set(response.data[0]),
+            {'id', 'created_at', 'image_type', 'total_conditions', 'image_url'}
+        )
+        self.assertTrue(response.data[0]['image_url'].startswith('http://testserver/'))
+        with self.assertNumQueries(2):
+            response = self.client.get(self.url + '?summary=1&page_size=2')
+        self.assertEqual(len(response.data['results']), 2)
+        print("test_summary_mode: PASSED")
+
+
+class RenderingTests(APITestCase):
+    def test_orjson_renderer_matches_drf(self):
+        """Test ORJSONRenderer output is identical to DRF's JSONRenderer."""
+        print("Running test_orjson_renderer_matches_drf...")
+        data = {
+            'date': date(2025, 5, 1),
+            'time': time(10, 30, 15, 123456),
+            'created': timezone.make_aware(timezone.datetime(2025, 5, 1, 10, 30)),
+            'price': Decimal('12.50'),
+            'text': 'Zahnärztin \u2028 line',
+            1: [None, True, 1.5],
+        }
+        self.assertEqual(ORJSONRenderer().render(data), JSONRenderer().render(data))
+        print("test_orjson_renderer_matches_drf: PASSED")
+
+    def test_large_responses_are_compressed(self):
+        """Test responses above the size threshold are gzip/brotli encoded."""
+        print("Running test_large_responses_are_compressed...")
+        dentist = User.objects.create_user(
+            username='dentist1', email='dentist@dentalcare.com', password='pass123'
+        )
+        patient = User.objects.create_user(
+            username='patient1', email='patient@example.com', password='pass123'
+        ).patient
+        for day in range(1, 29):
+            Appointment.objects.create(
+                patient=patient, dentist=dentist.dentist, date=date(2025, 2, day),
+                start_time='10:00:00', end_time='11:00:00', detail='Regular checkup'
+            )
+        self.client.force_authenticate(user=dentist)
+        response = self.client.get(reverse('appointment-list'), HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(len(json.loads(gzip.decompress(response.content))), 28)
+        response = self.client.get(reverse('appointment-list'), HTTP_ACCEPT_ENCODING='gzip, br')
+        self.assertEqual(response['Content-Encoding'], 'br')
+        # Small bodies are left alone
+        response = self.client.get(reverse('check-username') + '?username=x', HTTP_ACCEPT_ENCODING='gzip')
+        self.assertFalse(response.has_header('Content-Encoding'))
+        print("test_large_responses_are_compressed: PASSED")
+
+    def test_compression_honours_q_values_and_skips_token_responses(self):
+        """Test q=0 refuses an encoding and token endpoints are never compressed."""
+        print("Running test_compression_honours_q_values_and_skips_token_responses...")
+        self.assertEqual(accepted_encodings('gzip;q=0, br'), {'br': 1.0})
+        self.assertEqual(accepted_encodings('br;q=0.5, gzip;q=0.8, identity'), {'br': 0.5, 'gzip': 0.8, 'identity': 1.0})
+        self.assertEqual(accepted_encodings('*;q=0.1, br;q=0'), {'gzip': 0.1})
+        self.assertEqual(accepted_encodings('brotli, xgzip'), {'brotli': 1.0, 'xgzip': 1.0})
+
+        body = json.dumps({'access': 'x' * 4000}).encode()
+        middleware = CompressionMiddleware(lambda request: HttpResponse(body, content_type='application/json'))
+        factory = RequestFactory()
+        for header, expected in (('br;q=0, gzip', 'gzip'), ('gzip;q=0, br;q=0', None),
+                                 ('gzip;q=1, br;q=0.5', 'gzip'), ('gzip, br', 'br')):
+            response = middleware(factory.get('/api/appointments/', HTTP_ACCEPT_ENCODING=header))
+            self.assertEqual(response.get('Content-Encoding'), expected, header)
+        for path in ('/api/token/', '/api/token/refresh/', '/api/events/appointments/ticket/'):
+            response = middleware(factory.post(path, HTTP_ACCEPT_ENCODING='gzip, br'))
+            self.assertFalse(response.has_header('Content-Encoding'))
+            self.assertEqual(response.content, body)
+        print("test_compression_honours_q_values_and_skips_token_responses: PASSED")
+
+
+class DentistDirectoryCacheTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.dentist = User.objects.create_user(
+            username='dentist1', email='dentist@dentalcare.com', password='pass123'
+        ).dentist
+        self.dentist.specialization = 'Orthodontics'
+        self.dentist.save()
+        other = User.objects.create_user(
+            username='dentist2', email='dentist2@dentalcare.com', password='pass123'
+        ).dentist
+        other.specialization = 'Endodontics'
+        other.save()
+        self.url = reverse('dentist-list')
+
+    def test_directory_revalidates_with_304(self):
+        """Test the directory sends validators and answers revalidation with 304."""
+        print("Running test_directory_revalidates_with_304...")
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response['Cache-Control'], 'public, no-cache')
+        etag, last_modified = response['ETag'], response['Last-Modified']
+
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        response = self.client.get(self.url, HTTP_IF_MODIFIED_SINCE=last_modified)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        # Second full fetch is served from the body cache without touching the database
+        with self.assertNumQueries(0):
+            cached = self.client.get(self.url)
+        self.assertEqual(cached.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(json.loads(cached.content)), 2)
+        print("test_directory_revalidates_with_304: PASSED")
+
+    def test_directory_invalidated_on_change(self):
+        """Test Dentist, User and WorkSchedule changes produce a new ETag."""
+        print("Running test_directory_invalidated_on_change...")
+        etag = self.client.get(self.url)['ETag']
+
+        self.dentist.qualification = 'DDS'
+        self.dentist.save()
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIn('DDS', [d['qualification'] for d in response.data])
+        etag = response['ETag']
+
+        self.dentist.user.first_name = 'Grace'
+        self.dentist.user.save()
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        etag = response['ETag']
+
+        WorkSchedule.objects.create(dentist=self.dentist, day='Monday', start_hour='9', end_hour='12')
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        print("test_directory_invalidated_on_change: PASSED")
+
+    def test_directory_filter_and_pagination(self):
+        """Test ?specialization= filtering and opt-in pagination of the directory."""
+        print("Running test_directory_filter_and_pagination...")
+        response = self.client.get(self.url + '?specialization=orthodontics')
+        self.assertEqual([d['user']['id'] for d in response.data], [self.dentist.pk])
+
+        response = self.client.get(self.url + '?page_size=1')
+        self.assertEqual(len(response.data['results']), 1)
+        self.assertIsNotNone(response.data['next'])
+        # A different query string is a different cache entry
+        self.assertNotEqual(response['ETag'], self.client.get(self.url)['ETag'])
+        print("test_directory_filter_and_pagination: PASSED")
+
+    def test_directory_shares_only_anonymous_json_bodies(self):
+        """Test browsable API pages and authenticated responses are never served from the body cache."""
+        print("Running test_directory_shares_only_anonymous_json_bodies...")
+        viewer = User.objects.create_user(username='patient1', email='patient@example.com', password='pass123')
+        self.client.force_login(viewer)
+        page = self.client.get(self.url, HTTP_ACCEPT='text/html')
+        self.assertEqual(page.status_code, status.HTTP_200_OK)
+        self.assertIn(b'patient1', page.content)
+        self.assertEqual(page['Cache-Control'], 'private, no-cache')
+        self.client.logout()
+
+        anonymous = self.client.get(self.url, HTTP_ACCEPT='text/html')
+        self.assertNotIn(b'patient1', anonymous.content)
+        self.client.get(self.url)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get(self.url).status_code, status.HTTP_200_OK)
+        self.client.force_authenticate(user=viewer)
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(self.url)
+        self.assertTrue(queries.captured_queries)
+        print("test_directory_shares_only_anonymous_json_bodies: PASSED")
+
+
+class LoginTests(APITestCase):
+    def setUp(self):
+        self.patient = User.objects.create_user(
+            username='patient1', email='patient@example.com', password='pass123'
+        )
+        self.dentist = User.objects.create_user(
+            username='dentist1', email='dentist@dentalcare.com', password='pass123'
+        )
+
+    def test_login_returns_profile_and_role_claims(self):
+        """Test /api/token/ returns the token pair with the profile and role claims."""
+        print("Running test_login_returns_profile_and_role_claims...")
+        response = self.client.post('/api/token/', {'username': 'patient1', 'password': 'pass123'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIn('refresh', response.data)
+        self.assertEqual(response.data['role'], 'patient')
+        self.assertEqual(response.data['patient_id'], self.patient.pk)
+        self.assertIsNone(response.data['dentist_id'])
+        self.assertEqual(response.data['user']['username'], 'patient1')
+        self.assertNotIn('password', response.data['user'])
+        token = AccessToken(response.data['access'])
+        self.assertEqual((token['role'], token['profile_id']), ('patient', self.patient.pk))
+
+        response = self.client.post(reverse('token_obtain_pair'), {'username': 'dentist1', 'password': 'pass123'})
+        self.assertEqual(response.data['dentist_id'], self.dentist.pk)
+        self.assertEqual(AccessToken(response.data['access'])['role'], 'dentist')
+
+        response = self.client.post('/api/token/', {'username': 'dentist1', 'password': 'wrong'})
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+        print("test_login_returns_profile_and_role_claims: PASSED")
+
+
+class CachedAuthenticationTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(
+            username='patient1', email='patient@example.com', password='pass123'
+        )
+        access = self.client.post('/api/token/', {'username': 'patient1', 'password': 'pass123'}).data['access']
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {access}')
+        self.url = reverse('user-profile') + '?fields=id,username,first_name'
+
+    def test_user_resolved_from_cache(self):
+        """Test JWT requests reuse the cached user until the user changes."""
+        print("Running test_user_resolved_from_cache...")
+        with self.assertNumQueries(1):
+            self.client.get(self.url)
+        with self.assertNumQueries(0):
+            response = self.client.get(self.url)
+        self.assertEqual(response.data['username'], 'patient1')
+
+        # Profile is cached with the user
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get(reverse('user-profile') + '?fields=id').wsgi_request.user.patient.pk,
+                             self.user.pk)
+
+        User.objects.get(pk=self.user.pk).save()
+        with self.assertNumQueries(1):
+            self.client.get(self.url)
+        print("test_user_resolved_from_cache: PASSED")
+
+    def test_password_change_and_delete_drop_cached_user(self):
+        """Test password changes and account deletion never serve a stale cached user."""
+        print("Running test_password_change_and_delete_drop_cached_user...")
+        self.client.get(self.url)
+        response = self.client.post(reverse('change-password'), {
+            'current_password': 'pass123', 'new_password': 'NewPass!2025'
+        })
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        with self.assertNumQueries(1):
+            user = self.client.get(self.url).wsgi_request.user
+        self.assertTrue(user.check_password('NewPass!2025'))
+
+        self.client.delete(reverse('user-profile'))
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+        print("test_password_change_and_delete_drop_cached_user: PASSED")
+
+    def test_cached_entry_is_trimmed(self):
+        """Test the cache holds no password hash and the profile still renders in full."""
+        print("Running test_cached_entry_is_trimmed...")
+        self.user.patient.allergies = 'Penicillin'
+        self.user.patient.save()
+        self.client.get(self.url)
+        entry = cache.get(auth_user_key(self.user.pk, auth_user_version(self.user.pk)))
+        self.assertNotIn('password', entry['values'])
+        self.assertEqual(entry['profiles'], {'patient': self.user.pk, 'dentist': None})
+        self.assertNotIn(self.user.password, str(entry))
+
+        response = self.client.get(reverse('user-profile'))
+        self.assertEqual(response.data['patient']['allergies'], 'Penicillin')
+        print("test_cached_entry_is_trimmed: PASSED")
+
+    def test_other_process_changes_seen_after_timeout(self):
+        """Test the documented per-process scope: an unbumped change is seen once the entry expires."""
+        print("Running test_other_process_changes_seen_after_timeout...")
+        self.client.get(self.url)
+        # Deactivated by another worker: its stamp bump never reaches this process's LocMem cache
+        User.objects.filter(pk=self.user.pk).update(is_active=False)
+        self.assertEqual(self.client.get(self.url).status_code, status.HTTP_200_OK)
+        # AUTH_USER_TIMEOUT later
+        cache.delete(auth_user_key(self.user.pk, auth_user_version(self.user.pk)))
+        self.assertEqual(self.client.get(self.url).status_code, status.HTTP_401_UNAUTHORIZED)
+        print("test_other_process_changes_seen_after_timeout: PASSED")
+
+
+class BatchTests(TransactionTestCase):
+    def setUp(self):
+        cache.clear()
+        self.dentist = User.objects.create_user(
+            username='dentist1', email='dentist@dentalcare.com', password='pass123'
+        )
+        self.patient = User.objects.create_user(
+            username='patient1', email='patient@example.com', password='pass123'
+        )
+        access = self.client.post('/api/token/', {'username': 'patient1', 'password': 'pass123'}).data['access']
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {access}')
+
+    def batch(self, *requests):
+        return self.client.post(reverse('batch'), {'requests': list(requests)}, format='json')
+
+    def test_batch_dispatches_sub_requests(self):
+        """Test sub-requests run through their views with one authentication and ordered writes."""
+        print("Running test_batch_dispatches_sub_requests...")
+        with patch.object(CachedJWTAuthentication, 'authenticate', autospec=True,
+                          side_effect=CachedJWTAuthentication.authenticate) as authenticate:
+            response = self.batch(
+                {'id': 'me', 'path': '/api/user/profile/?fields=id,username'},
+                {'id': 'dentists', 'path': '/api/dentists/'},
+                {'id': 'book', 'method': 'post', 'path': '/api/appointments/', 'body': {
+                    'dentist': self.dentist.pk, 'date': '2025-05-01',
+                    'start_time': '10:00:00', 'end_time': '11:00:00',
+                }},
+                {'id': 'mine', 'path': '/api/appointments/'},
+                {'id': 'stats', 'path': '/api/dashboard/stats/'},
+                {'id': 'missing', 'path': '/api/nowhere/'},
+                {'id': 'nested', 'method': 'POST', 'path': '/api/batch/', 'body': {'requests': []}},
+            )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(authenticate.call_count, 1)
+        results = {item['id']: item for item in response.data['responses']}
+        self.assertEqual(list(results), ['me', 'dentists', 'book', 'mine', 'stats', 'missing', 'nested'])
+        self.assertEqual(results['me']['body'], {'id': self.patient.pk, 'username': 'patient1'})
+        self.assertEqual([d['user']['id'] for d in results['dentists']['body']], [self.dentist.pk])
+        self.assertEqual(results['book']['status'], status.HTTP_201_CREATED)
+        # The GET after the write sees it
+        self.assertEqual([a['id'] for a in results['mine']['body']], [results['book']['body']['data']['id']])
+        # Per-item status: the dashboard is for dentists only
+        self.assertEqual(results['stats']['status'], status.HTTP_403_FORBIDDEN)
+        self.assertEqual(results['missing']['status'], status.HTTP_404_NOT_FOUND)
+        self.assertEqual(results['nested']['status'], status.HTTP_400_BAD_REQUEST)
+        print("test_batch_dispatches_sub_requests: PASSED")
+
+    def test_batch_requires_authentication_and_limits_size(self):
+        """Test anonymous and oversized batches are rejected."""
+        print("Running test_batch_requires_authentication_and_limits_size...")
+        response = self.batch(*[{'path': '/api/dentists/'}] * (BATCH_MAX_REQUESTS + 1))
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = APIClient().post(reverse('batch'), {'requests': [{'path': '/api/dentists/'}]}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+        print("test_batch_requires_authentication_and_limits_size: PASSED")
+
+    def test_batch_sub_request_errors_are_logged_not_returned(self):
+        """Test an exception in a sub-request is logged and answered with a generic 500."""
+        print("Running test_batch_sub_request_errors_are_logged_not_returned...")
+        with patch('api.views.DashboardStatsView.get', side_effect=RuntimeError('db at 10.0.0.5 refused')), \
+                self.assertLogs('api.batch', level='ERROR') as logs:
+            response = self.batch({'id': 'stats', 'path': '/api/dashboard/stats/'})
+        result = response.data['responses'][0]
+        self.assertEqual(result['status'], status.HTTP_500_INTERNAL_SERVER_ERROR)
+        self.assertEqual(result['body'], {'detail': 'Internal server error.'})
+        self.assertIn('10.0.0.5', '\n'.join(logs.output))
+        print("test_batch_sub_request_errors_are_logged_not_returned: PASSED")
+
+    async def test_batch_under_asgi_builds_absolute_urls(self):
+        """Test sub-requests of a batch served over ASGI keep the request's scheme and host."""
+        print("Running test_batch_under_asgi_builds_absolute_urls...")
+        image = await DentalImage.objects.acreate(image='dental_images/test.jpg')
+        await ImageAnalysis.objects.acreate(user=self.patient, original_image=image)
+        response = await self.async_client.post(
+            reverse('batch'), {'requests': [{'path': '/api/user/analyses/'}]}, content_type='application/json',
+            headers={'Authorization': self.client._credentials['HTTP_AUTHORIZATION']},
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        result = response.json()['responses'][0]
+        self.assertEqual(result['status'], status.HTTP_200_OK)
+        self.assertEqual(result['body'][0]['original_image']['image'], 'http://testserver/media/dental_images/test.jpg')
+        print("test_batch_under_asgi_builds_absolute_urls: PASSED")
+
+
+class DeltaSyncTests(APITestCase):
+    def setUp(self):
+        self.dentist = User.objects.create_user(
+            username='dentist1', email='dentist@dentalcare.com', password='pass123'
+        ).dentist
+        self.patient_user = User.objects.create_user(
+            username='patient1', email='patient@example.com', password='pass123'
+        )
+        self.appointments = [
+            Appointment.objects.create(
+                patient=self.patient_user.patient, dentist=self.dentist, date=date(2025, 5, day),
+                start_time='10:00:00', end_time='11:00:00'
+            ) for day in (1, 2, 3)
+        ]
+        image = DentalImage.objects.create(image='dental_images/test.jpg')
+        self.analysis = ImageAnalysis.objects.create(user=self.patient_user, original_image=image)
+        self.client.force_authenticate(user=self.patient_user)
+
+    def sync(self, cursor=None):
+        url = reverse('sync') + (f'?since={cursor}' if cursor else '')
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response.data
+
+    @patch('api.sync.SYNC_SETTLE_SECONDS', 0)
+    def test_sync_returns_only_changes_and_tombstones(self):
+        """Test ?since= returns changed rows and deleted ids, then nothing."""
+        print("Running test_sync_returns_only_changes_and_tombstones...")
+        initial = self.sync()
+        self.assertEqual([a['id'] for a in initial['appointments']], [a.pk for a in self.appointments])
+        self.assertEqual([a['id'] for a in initial['analyses']], [self.analysis.pk])
+        self.assertFalse(initial['has_more'])
+
+        first, second, third = self.appointments
+        first.detail = 'Bring x-rays'
+        first.save()
+        apply_bulk_operations(self.dentist.user, [{'id': second.pk, 'op': 'approve'}])
+        deleted_appointment, deleted_analysis = third.pk, self.analysis.pk
+        third.delete()
+        new = Appointment.objects.create(
+            patient=self.patient_user.patient, dentist=self.dentist, date=date(2025, 5, 9),
+            start_time='10:00:00', end_time='11:00:00'
+        )
+        self.analysis.delete()
+
+        # One indexed range query per stream, then the changed appointment rows
+        with self.assertNumQueries(4):
+            changes = self.sync(initial['cursor'])
+        self.assertEqual([a['id'] for a in changes['appointments']], [first.pk, second.pk, new.pk])
+        self.assertTrue(changes['appointments'][1]['approved'])
+        self.assertEqual(changes['analyses'], [])
+        self.assertEqual(changes['deleted'], {'appointments': [deleted_appointment], 'analyses': [deleted_analysis]})
+
+        again = self.sync(changes['cursor'])
+        self.assertEqual((again['appointments'], again['analyses']), ([], []))
+        self.assertEqual(again['deleted'], {'appointments': [], 'analyses': []})
+        print("test_sync_returns_only_changes_and_tombstones: PASSED")
+
+    def test_sync_pages_and_rejects_bad_cursors(self):
+        """Test has_more paging and cursor validation; the other party gets tombstones too."""
+        print("Running test_sync_pages_and_rejects_bad_cursors...")
+        seen, cursor = [], None
+        while True:
+            page = changes_since(self.patient_user, cursor, limit=2)
+            seen += [a['id'] for a in page['appointments']]
+            cursor = page['cursor']
+            if not page['has_more']:
+                break
+        self.assertEqual(seen, [a.pk for a in self.appointments])
+
+        response = self.client.get(reverse('sync') + '?since=garbage')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+        cursor = changes_since(self.dentist.user)['cursor']
+        self.patient_user.delete()
+        self.assertEqual(
+            changes_since(self.dentist.user, cursor)['deleted']['appointments'],
+            [a.pk for a in self.appointments]
+        )
+        print("test_sync_pages_and_rejects_bad_cursors: PASSED")
+
+    def test_sync_rereads_rows_committed_behind_the_cursor(self):
+        """Test a row stamped before the cursor but committed after it is still delivered."""
+        print("Running test_sync_rereads_rows_committed_behind_the_cursor...")
+        cursor = self.sync()['cursor']
+        first = self.appointments[0]
+        # Stamped a moment ago by a transaction that only commits now
+        Appointment.objects.filter(pk=first.pk).update(
+            detail='Late commit', updated_at=timezone.now() - timezone.timedelta(seconds=5)
+        )
+        changes = self.sync(cursor)
+        self.assertIn(first.pk, [a['id'] for a in changes['appointments']])
+
+        # A full window of rows still pages forward instead of repeating
+        seen = []
+        with patch('api.sync.SYNC_SETTLE_SECONDS', 3600):
+            cursor = None
+            for _ in range(5):
+                page = changes_since(self.patient_user, cursor, limit=2)
+                seen += [a['id'] for a in page['appointments']]
+                cursor = page['cursor']
+                if not page['has_more']:
+                    break
+        self.assertFalse(page['has_more'])
+        self.assertEqual(sorted(set(seen)), [a.pk for a in self.appointments])
+        print("test_sync_rereads_rows_committed_behind_the_cursor: PASSED")
+
+    def test_image_and_admin_deletes_leave_tombstones(self):
+        """Test deleting an image, or analyses/appointments from the admin, writes tombstones."""
+        print("Running test_image_and_admin_deletes_leave_tombstones...")
+        cursor = changes_since(self.patient_user)['cursor']
+        self.analysis.original_image.delete()
+        admin_user = User.objects.create_superuser(username='admin', email='admin@example.com', password='pass123')
+        self.client.force_login(admin_user)
+        response = self.client.post(reverse('admin:api_appointment_changelist'), {
+            'action': 'delete_selected', 'post': 'yes',
+            '_selected_action': [a.pk for a in self.appointments[:2]],
+        })
+        self.assertEqual(response.status_code, 302)
+        deleted = changes_since(self.patient_user, cursor)['deleted']
+        self.assertEqual(sorted(deleted['appointments']), [a.pk for a in self.appointments[:2]])
+        self.assertEqual(deleted['analyses'], [self.analysis.pk])
+        print("test_image_and_admin_deletes_leave_tombstones: PASSED")
+
+    def test_reassigned_appointment_leaves_tombstone_for_old_dentist(self):
+        """Test moving an appointment to another dentist tells the old one to drop it."""
+        print("Running test_reassigned_appointment_leaves_tombstone_for_old_dentist...")
+        other = User.objects.create_user(
+            username='dentist2', email='dentist2@dentalcare.com', password='pass123'
+        ).dentist
+        old_cursor = changes_since(self.dentist.user)['cursor']
+        new_cursor = changes_since(other.user)['cursor']
+        moved = self.appointments[0]
+        moved.dentist = other
+        moved.save()
+
+        old_changes = changes_since(self.dentist.user, old_cursor)
+        self.assertEqual(old_changes['deleted']['appointments'], [moved.pk])
+        self.assertNotIn(moved.pk, [a['id'] for a in old_changes['appointments']])
+        new_changes = changes_since(other.user, new_cursor)
+        self.assertEqual([a['id'] for a in new_changes['appointments']], [moved.pk])
+        self.assertEqual(new_changes['deleted']['appointments'], [])
+        # The patient still sees it: no tombstone
+        self.assertFalse(Tombstone.objects.filter(user=self.patient_user).exists())
+
+        # Moved back: the old dentist's tombstone goes, the new one gets its own
+        moved.dentist = self.dentist
+        moved.save()
+        self.assertEqual(
+            list(Tombstone.objects.filter(object_id=moved.pk).values_list('user_id', flat=True)), [other.pk]
+        )
+        print("test_reassigned_appointment_leaves_tombstone_for_old_dentist: PASSED")
+
+
+class AppointmentEventTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.dentist = User.objects.create_user(
+            username='dentist1', email='dentist@dentalcare.com', password='pass123'
+        )
+        self.patient = User.objects.create_user(
+            username='patient1', email='patient@example.com', password='pass123'
+        )
+        self.url = reverse('appointment-events')
+
+    def ticket(self, user, token=None):
+        token = token or AccessToken.for_user(user)
+        response = APIClient().post(
+            reverse('appointment-events-ticket'), HTTP_AUTHORIZATION=f'Bearer {token}'
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response.data['ticket']
+
+    def test_writes_publish_events_on_commit(self):
+        """Test bookings, approvals and cancellations reach the patient and dentist."""
+        print("Running test_writes_publish_events_on_commit...")
+        client = APIClient()
+        with patch.object(get_broker(), 'publish') as publish:
+            client.force_authenticate(user=self.patient)
+            with self.captureOnCommitCallbacks(execute=True):
+                response = client.post(reverse('appointment-list'), {
+                    'dentist': self.dentist.pk, 'date': '2025-05-01',
+                    'start_time': '10:00:00', 'end_time': '11:00:00',
+                }, format='json')
+            pk = response.data['data']['id']
+            client.force_authenticate(user=self.dentist)
+            with self.captureOnCommitCallbacks(execute=True):
+                client.patch(reverse('appointment-approve', kwargs={'pk': pk}))
+            with self.captureOnCommitCallbacks(execute=True):
+                client.post(reverse('appointment-bulk'), {'operations': [{'id': pk, 'op': 'cancel'}]}, format='json')
+        events = [(recipients, event['type'], event['id']) for (recipients, event), _ in publish.call_args_list]
+        everyone = {self.patient.pk, self.dentist.pk}
+        self.assertEqual(events, [
+            (everyone, 'appointment.created', pk),
+            (everyone, 'appointment.approved', pk),
+            (everyone, 'appointment.deleted', pk),
+        ])
+        self.assertEqual(publish.call_args_list[1][0][1]['start_time'], '10:00:00')
+        print("test_writes_publish_events_on_commit: PASSED")
+
+    async def test_stream_delivers_events(self):
+        """Test the SSE stream authenticates, delivers events and unsubscribes on disconnect."""
+        print("Running test_stream_delivers_events...")
+        broker = get_broker()
+        response = await self.async_client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+        ticket = await sync_to_async(self.ticket)(self.patient)
+        response = await self.async_client.get(self.url + f'?ticket={ticket}')
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        stream = aiter(response.streaming_content)
+        self.assertEqual(await anext(stream), b'retry: 5000\n\n')
+        self.assertEqual(broker.subscriber_count(), 1)
+
+        broker.publish([self.dentist.pk], {'type': 'appointment.created', 'id': 1})
+        broker.publish([self.patient.pk], {'type': 'appointment.approved', 'id': 7})
+        chunk = await asyncio.wait_for(anext(stream), 2)
+        self.assertEqual(chunk, b'event: appointment.approved\ndata: {"type": "appointment.approved", "id": 7}\n\n')
+        # A client disconnect cancels the pending read, as the ASGI handler does
+        pending = asyncio.ensure_future(anext(stream))
+        await asyncio.sleep(0)
+        pending.cancel()
+        with self.assertRaises(asyncio.CancelledError):
+            await pending
+        self.assertEqual(broker.subscriber_count(), 0)
+        print("test_stream_delivers_events: PASSED")
+
+    async def test_stream_tickets_are_single_use_and_tokens_stay_out_of_urls(self):
+        """Test a ticket opens one stream, a JWT in the query string is refused, and tickets need a login."""
+        print("Running test_stream_tickets_are_single_use_and_tokens_stay_out_of_urls...")
+        token = await sync_to_async(lambda: str(AccessToken.for_user(self.patient)))()
+        response = await self.async_client.get(self.url + f'?token={token}')
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+        response = await self.async_client.post(reverse('appointment-events-ticket'))
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+        ticket = await sync_to_async(self.ticket)(self.patient)
+        response = await self.async_client.get(self.url + f'?ticket={ticket}')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        await response.streaming_content.aclose()
+        response = await self.async_client.get(self.url + f'?ticket={ticket}')
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+        response = await self.async_client.get(self.url + f'?ticket={ticket[:-2]}xx')
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+        print("test_stream_tickets_are_single_use_and_tokens_stay_out_of_urls: PASSED")
+
+    async def test_stream_closes_when_the_token_expires(self):
+        """Test the stream ends at the access token's exp instead of outliving it."""
+        print("Running test_stream_closes_when_the_token_expires...")
+        token = await sync_to_async(AccessToken.for_user)(self.patient)
+        token.set_exp(lifetime=timezone.timedelta(seconds=1))
+        ticket = await sync_to_async(self.ticket)(self.patient, token)
+        response = await self.async_client.get(self.url + f'?ticket={ticket}')
+        chunks = [chunk async for chunk in response.streaming_content]
+        self.assertEqual(chunks[0], b'retry: 5000\n\n')
+        self.assertEqual(chunks[-1], b'event: stream.expired\ndata: {}\n\n')
+        self.assertEqual(get_broker().subscriber_count(), 0)
+        print("test_stream_closes_when_the_token_expires: PASSED")
+
+    async def test_many_idle_subscribers(self):
+        """Test thousands of idle subscriptions are cheap and fan-out is per user."""
+        print("Running test_many_idle_subscribers...")
+        broker = InProcessBroker()
+        subscriptions = [broker.subscribe(index % 1000) for index in range(5000)]
+        self.assertEqual(broker.subscriber_count(), 5000)
+        started = clock.perf_counter()
+        broker.publish([42], {'type': 'appointment.updated', 'id': 1})
+        await asyncio.sleep(0)
+        print(f"Published to 5 of 5000 subscribers in {(clock.perf_counter() - started) * 1000:.2f}ms")
+        self.assertEqual(sum(s.queue.qsize() for s in subscriptions), 5)
+        for subscription in subscriptions:
+            broker.unsubscribe(subscription)
+        self.assertEqual(broker.subscriber_count(), 0)
+        print("test_many_idle_subscribers: PASSED")
+
+    @skipUnless(importlib.util.find_spec('redis'), "needs the redis package")
+    def test_redis_broker_drops_events_when_redis_is_down(self):
+        """Test a Redis outage during publish is logged instead of failing the committed write."""
+        print("Running test_redis_broker_drops_events_when_redis_is_down...")
+        with self.settings(EVENT_BROKER_URL='redis://127.0.0.1:1/0'), self.assertLogs('api.events', 'ERROR'):
+            RedisBroker().publish([self.patient.pk], {'type': 'appointment.created', 'id': 1})
+        print("test_redis_broker_drops_events_when_redis_is_down: PASSED")
+
+    @skipUnless(os.getenv('EVENT_BROKER_URL'), "needs a Redis at EVENT_BROKER_URL")
+    async def test_redis_broker_reaches_other_workers(self):
+        """Test an event published by one worker's broker reaches a stream held by another's."""
+        print("Running test_redis_broker_reaches_other_workers...")
+        publisher, listener = RedisBroker(), RedisBroker()
+        subscription = listener.subscribe(self.patient.pk)
+        # Let the listener thread's subscription settle
+        await asyncio.sleep(0.5)
+        await sync_to_async(publisher.publish)([self.patient.pk], {'type': 'appointment.created', 'id': 3})
+        self.assertEqual(await asyncio.wait_for(subscription.get(), 5), {'type': 'appointment.created', 'id': 3})
+        listener.unsubscribe(subscription)
+        print("test_redis_broker_reaches_other_workers: PASSED")
+
+
+class AsyncViewTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        usernames.reset()
+        self.dentist = User.objects.create_user(
+            username='dentist1', email='dentist@dentalcare.com', password='pass123',
+            first_name='Dana', last_name='Smith'
+        )
+        self.patient = User.objects.create_user(
+            username='patient1', email='patient@example.com', password='pass123',
+            first_name='Pat', last_name='Jones'
+        )
+        image = DentalImage.objects.create(image='dental_images/a.jpg', image_url='/media/dental_images/a.jpg')
+        analysis = ImageAnalysis.objects.create(user=self.patient, original_image=image, total_conditions=1)
+        DetectionCount.objects.create(analysis=analysis, class_name='caries', count=1)
+        self.appointment = Appointment.objects.create(
+            patient=self.patient.patient, dentist=self.dentist.dentist, analyzed_image=analysis,
+            date='2025-05-01', start_time='10:00', end_time='11:00'
+        )
+        WorkSchedule.objects.create(dentist=self.dentist.dentist, day='Monday', start_hour='9', end_hour='17')
+
+    def headers(self, user):
+        return {'Authorization': f'Bearer {AccessToken.for_user(user)}'}
+
+    def test_async_profile_matches_serializer(self):
+        """Test the async profile view renders exactly what UserSerializer does."""
+        print("Running test_async_profile_matches_serializer...")
+        client = APIClient()
+        for user in (self.patient, self.dentist):
+            response = client.get(reverse('user-profile'), headers=self.headers(user))
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            expected = UserSerializer(User.objects.get(pk=user.pk), context={'request': response.wsgi_request}).data
+            self.assertEqual(response.content, ORJSONRenderer().render(expected))
+        self.assertEqual(response.json()['patient'], None)
+        print("test_async_profile_matches_serializer: PASSED")
+
+    async def test_read_endpoints_under_event_loop(self):
+        """Test the async read endpoints serve from a running event loop."""
+        print("Running test_read_endpoints_under_event_loop...")
+        patient_headers = await sync_to_async(self.headers)(self.patient)
+        dentist_headers = await sync_to_async(self.headers)(self.dentist)
+
+        response = await self.async_client.get(reverse('user-profile'), headers=patient_headers)
+        self.assertEqual(response.json()['patient']['appointments'][0]['id'], self.appointment.pk)
+        response = await self.async_client.get(reverse('appointment-list'), headers=dentist_headers)
+        self.assertEqual([row['id'] for row in response.json()], [self.appointment.pk])
+        self.assertEqual(response.json()[0]['analyzed_image']['caries_count'], 1)
+        response = await self.async_client.get(
+            reverse('appointment-list') + '?page_size=1', headers=dentist_headers
+        )
+        self.assertEqual(len(response.json()['results']), 1)
+        response = await self.async_client.get(
+            reverse('dentist-schedule-list', kwargs={'dentist_pk': self.dentist.pk}), headers=patient_headers
+        )
+        self.assertEqual([row['day'] for row in response.json()], ['Monday'])
+        response = await self.async_client.get(reverse('check-username') + '?username=PATIENT1')
+        self.assertEqual(response.json(), {'exists': True, 'available': False})
+        response = await self.async_client.get(reverse('appointment-list'))
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+        print("test_read_endpoints_under_event_loop: PASSED")
+
+    def test_async_username_check_skips_database(self):
+        """Test free usernames are answered from the filter without a query."""
+        print("Running test_async_username_check_skips_database...")
+        usernames.warm()
+        with self.assertNumQueries(0):
+            self.assertFalse(async_to_sync(usernames.aexists)('nobody_has_this'))
+        self.assertTrue(async_to_sync(usernames.aexists)('Dentist1'))
+        print("test_async_username_check_skips_database: PASSED")
+
+    async def test_compression_middleware_is_async(self):
+        """Test the compression middleware runs natively in an async stack."""
+        print("Running test_compression_middleware_is_async...")
+        async def get_response(request):
+            return HttpResponse(b'x' * 5000)
+        middleware = CompressionMiddleware(get_response)
+        self.assertTrue(iscoroutinefunction(middleware))
+        response = await middleware(RequestFactory().get('/', HTTP_ACCEPT_ENCODING='gzip'))
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(gzip.decompress(response.content), b'x' * 5000)
+        print("test_compression_middleware_is_async: PASSED")
+
+    def test_inference_runs_on_bounded_pool(self):
+        """Test model inference is handed to the inference thread pool."""
+        print("Running test_inference_runs_on_bounded_pool...")
+        thread_name = run_inference(lambda path: threading.current_thread().name, 'image.jpg')
+        self.assertTrue(thread_name.startswith('inference'))
+        print("test_inference_runs_on_bounded_pool: PASSED")
+
+
+class DatabaseSettingsTests(TestCase):
+    def test_sqlite_is_default_and_tuned(self):
+        """Test SQLite is used without DB_NAME, with the concurrency pragmas applied."""
+        print("Running test_sqlite_is_default_and_tuned...")
+        database = database_settings({}, Path('/srv/app'))['default']
+        self.assertEqual(database['ENGINE'], 'django.db.backends.sqlite3')
+        self.assertEqual(database['NAME'], Path('/srv/app') / 'db.sqlite3')
+        self.assertEqual(database['OPTIONS']['transaction_mode'], 'IMMEDIATE')
+        if connection.vendor == 'sqlite':
+            with connection.cursor() as cursor:
+                cursor.execute('PRAGMA synchronous')
+                self.assertEqual(cursor.fetchone()[0], 1)  # NORMAL
+                cursor.execute('PRAGMA busy_timeout')
+                self.assertEqual(cursor.fetchone()[0], connection.settings_dict['OPTIONS']['timeout'] * 1000)
+        print("test_sqlite_is_default_and_tuned: PASSED")
+
+    def test_postgresql_from_environment(self):
+        """Test DB_* variables select PostgreSQL with pooling or persistent connections."""
+        print("Running test_postgresql_from_environment...")
+        env = {'DB_NAME': 'dental', 'DB_USER': 'app', 'DB_PWD': 'secret', 'DB_HOST': 'db', 'DB_PORT': '5432'}
+        with patch('crud.databases._pool_available', return_value=True):
+            database = database_settings(env, Path('.'))['default']
+        self.assertEqual(database['ENGINE'], 'django.db.backends.postgresql')
+        self.assertEqual((database['NAME'], database['USER'], database['HOST']), ('dental', 'app', 'db'))
+        self.assertTrue(database['CONN_HEALTH_CHECKS'])
+        self.assertEqual(database['OPTIONS']['pool']['max_size'], 10)
+        self.assertNotIn('CONN_MAX_AGE', database)
+
+        with patch('crud.databases._pool_available', return_value=False):
+            database = database_settings({**env, 'DB_CONN_MAX_AGE': '300'}, Path('.'))['default']
+        self.assertNotIn('pool', database['OPTIONS'])
+        self.assertEqual(database['CONN_MAX_AGE'], 300)
+        print("test_postgresql_from_environment: PASSED")
+
+
+@patch('api.replicas.replica_configured', return_value=True)
+class ReplicaRoutingTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        replica_health.reset()
+        self.router = ReadReplicaRouter()
+        self.factory = RequestFactory()
+
+    def route(self, request, status_code=200):
+        """Run the middleware and return (alias the view read from, response)."""
+        seen = []
+
+        def view(request):
+            seen.append(self.router.db_for_read(Appointment))
+            with primary():
+                seen.append(self.router.db_for_read(Appointment))
+            return HttpResponse(status=status_code)
+
+        response = ReplicaRoutingMiddleware(view)(request)
+        self.assertEqual(seen[1], 'default')
+        return seen[0], response
+
+    def test_safe_requests_read_from_replica(self, _):
+        """Test GETs read from the replica while writes and cache fills use the primary."""
+        print("Running test_safe_requests_read_from_replica...")
+        with patch('api.replicas.replica_lag', return_value=0.0):
+            self.assertEqual(self.route(self.factory.get('/api/appointments/'))[0], 'replica')
+            self.assertEqual(self.route(self.factory.post('/api/appointments/'))[0], 'default')
+        self.assertEqual(self.router.db_for_read(Appointment), 'default')
+        self.assertEqual(self.router.db_for_write(Appointment), 'default')
+        self.assertIsNone(self.router.db_for_read(Group))
+        print("test_safe_requests_read_from_replica: PASSED")
+
+    def test_writes_pin_the_client_to_the_primary(self, _):
+        """Test read-your-writes via the pin cookie and the echoed X-DB-Pin header."""
+        print("Running test_writes_pin_the_client_to_the_primary...")
+        with patch('api.replicas.replica_lag', return_value=0.0):
+            _, response = self.route(self.factory.post('/api/appointments/'), status_code=201)
+            self.assertEqual(response.cookies[REPLICA_PIN_COOKIE]['max-age'], settings.REPLICA_STICKY_SECONDS)
+            # The header needs no server-side state, so any worker honours it
+            self.assertEqual(response['X-DB-Pin-Max-Age'], str(settings.REPLICA_STICKY_SECONDS))
+            pin = {'HTTP_X_DB_PIN': response['X-DB-Pin']}
+            cache.clear()
+            self.assertEqual(self.route(self.factory.get('/api/appointments/', **pin))[0], 'default')
+            self.assertEqual(self.route(self.factory.get('/api/appointments/'))[0], 'replica')
+            self.assertEqual(
+                self.route(self.factory.get('/api/appointments/', HTTP_X_DB_PIN='forged'))[0], 'replica'
+            )
+            # Expired
+            with self.settings(REPLICA_STICKY_SECONDS=0):
+                self.assertEqual(self.route(self.factory.get('/api/appointments/', **pin))[0], 'replica')
+            request = self.factory.get('/api/appointments/')
+            request.COOKIES[REPLICA_PIN_COOKIE] = '1'
+            self.assertEqual(self.route(request)[0], 'default')
+            # Failed writes change nothing, so they do not pin
+            _, response = self.route(self.factory.post('/api/appointments/'), status_code=400)
+            self.assertNotIn(REPLICA_PIN_COOKIE, response.cookies)
+            self.assertFalse(response.has_header('X-DB-Pin'))
+        print("test_writes_pin_the_client_to_the_primary: PASSED")
+
+    def test_lagging_or_unreachable_replica_falls_back(self, _):
+        """Test the primary serves reads while the replica lags or is down."""
+        print("Running test_lagging_or_unreachable_replica_falls_back...")
+        with patch('api.replicas.replica_lag', return_value=settings.REPLICA_MAX_LAG + 1) as lag:
+            self.assertEqual(self.route(self.factory.get('/api/appointments/'))[0], 'default')
+            self.route(self.factory.get('/api/appointments/'))
+            self.assertEqual(lag.call_count, 1)  # sampled once per interval
+        replica_health.reset()
+        with patch('api.replicas.replica_lag', side_effect=OperationalError("connection refused")):
+            self.assertEqual(self.route(self.factory.get('/api/appointments/'))[0], 'default')
+        replica_health.reset()
+        with patch('api.replicas.replica_lag', return_value=0.0):
+            self.assertEqual(self.route(self.factory.get('/api/appointments/'))[0], 'replica')
+        print("test_lagging_or_unreachable_replica_falls_back: PASSED")
+
+    async def test_async_stack_routes_reads(self, _):
+        """Test the middleware routes async views the same way."""
+        print("Running test_async_stack_routes_reads...")
+        seen = []
+
+        async def view(request):
+            seen.append(await sync_to_async(self.router.db_for_read)(Appointment))
+            return HttpResponse()
+
+        middleware = ReplicaRoutingMiddleware(view)
+        self.assertTrue(iscoroutinefunction(middleware))
+        with patch('api.replicas.replica_lag', return_value=0.0):
+            await middleware(self.factory.get('/api/user/profile/'))
+        self.assertEqual(seen, ['replica'])
+        print("test_async_stack_routes_reads: PASSED")
+
+    def test_replica_alias_from_environment(self, _):
+        """Test SQLITE_REPLICA_PATH / DB_REPLICA_HOST add a 'replica' alias mirrored in tests."""
+        print("Running test_replica_alias_from_environment...")
+        self.assertNotIn('replica', database_settings({}, Path('.')))
+        replica = database_settings({'SQLITE_REPLICA_PATH': '/tmp/replica.sqlite3'}, Path('.'))['replica']
+        self.assertEqual(replica['NAME'], '/tmp/replica.sqlite3')
+        self.assertEqual(replica['TEST'], {'MIRROR': 'default'})
+        databases = database_settings(
+            {'DB_NAME': 'dental', 'DB_USER': 'app', 'DB_HOST': 'primary', 'DB_REPLICA_HOST': 'standby'}, Path('.')
+        )
+        self.assertEqual((databases['default']['HOST'], databases['replica']['HOST']), ('primary', 'standby'))
+        self.assertEqual(databases['replica']['USER'], 'app')
+        print("test_replica_alias_from_environment: PASSED")
@@ -0,0 +1,10 @@
+# api/throttling.py
+from rest_framework.throttling import SimpleRateThrottle
+
+
+class UsernameCheckThrottle(SimpleRateThrottle):
+    """Per-IP limit on username availability checks, signed in or not."""
+    scope = 'username_check'
+
+    def get_cache_key(self, request, view):
+        return self.cache_format % {'scope': self.scope, 'ident': self.get_ident(request)}
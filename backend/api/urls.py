@@ -3,13 +3,13 @@
 # api/urls.py
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
-from rest_framework_simplejwt.views import TokenObtainPairView, TokenRefreshView
+from rest_framework_simplejwt.views import TokenRefreshView
 from .views import DashboardStatsView
 from .views import (
     # UserViewSet,
     DentistViewSet, PatientViewSet, AppointmentViewSet,
     WorkScheduleViewSet,
-    UserProfileView, AnalyzeImageView,
+    UserProfileView, AnalyzeImageView, LoginView, BatchView, SyncView, EventTicketView, appointment_events,
    
     RegisterPatientView, RegisterDentistView, UserAnalysisListView,ChangePasswordView, CheckUsernameView
 )
@@ -29,7 +29,7 @@ dentist_schedule = router.register(r'dentists/(?P<dentist_pk>\d+)/schedule',
 
 urlpatterns = [
     path('', include(router.urls)),
-    path('token/', TokenObtainPairView.as_view(), name='token_obtain_pair'),
+    path('token/', LoginView.as_view(), name='token_obtain_pair'),
     path('token/refresh/', TokenRefreshView.as_view(), name='token_refresh'),
     
     # User registration endpoints
@@ -48,5 +48,9 @@ urlpatterns = [
     path('user/analyses/', UserAnalysisListView.as_view(), name='user-analyses'),
     path('user/change-password/', ChangePasswordView.as_view(), name='change-password'),
     path('user/check-username/', CheckUsernameView.as_view(), name='check-username'),
+    path('batch/', BatchView.as_view(), name='batch'),
+    path('sync/', SyncView.as_view(), name='sync'),
+    path('events/appointments/', appointment_events, name='appointment-events'),
+    path('events/appointments/ticket/', EventTicketView.as_view(), name='appointment-events-ticket'),
     
 ]+ static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
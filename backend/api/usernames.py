@@ -0,0 +1,118 @@
+# api/usernames.py
+"""
+Username availability for signup keystroke checks.
+
+A per-process Bloom filter of lowercased usernames answers "definitely
+free" without touching the database; only "maybe taken" answers fall back
+to the indexed lower(username) lookup. The filter is warmed lazily from
+the user table, updated from User.save(), and picks up users registered
+by other processes every USERNAME_SYNC_INTERVAL seconds. Deleted or
+renamed users only cause extra fallbacks, never wrong "taken" answers.
+"""
+import hashlib
+import math
+import threading
+import time
+
+from asgiref.sync import sync_to_async
+from django.apps import apps
+from django.db.models.functions import Lower
+
+USERNAME_FILTER_CAPACITY = 100_000
+USERNAME_FILTER_ERROR_RATE = 0.01
+USERNAME_SYNC_INTERVAL = 30
+
+
+class BloomFilter:
+    def __init__(self, capacity, error_rate):
+        self.capacity = capacity
+        self.size = max(8, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def _positions(self, value):
+        digest = hashlib.blake2b(value.encode(), digest_size=16).digest()
+        first, second = int.from_bytes(digest[:8], 'little'), int.from_bytes(digest[8:], 'little') | 1
+        return ((first + i * second) % self.size for i in range(self.hashes))
+
+    def add(self, value):
+        for position in self._positions(value):
+            self.bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, value):
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self._positions(value))
+
+
+class UsernameIndex:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._filter = None
+        self._last_id = 0
+        self._synced_at = 0.0
+
+    def _user_model(self):
+        return apps.get_model('api', 'User')
+
+    def _load(self, since_id):
+        rows = self._user_model().objects.filter(pk__gt=since_id).order_by('pk').values_list('pk', 'username')
+        for pk, username in rows.iterator():
+            self._filter.add(username.lower())
+            self._last_id = pk
+
+    def warm(self):
+        with self._lock:
+            capacity = USERNAME_FILTER_CAPACITY
+            total = self._user_model().objects.count()
+            while capacity < total * 2:
+                capacity *= 2
+            self._filter = BloomFilter(capacity, USERNAME_FILTER_ERROR_RATE)
+            self._last_id = 0
+            self._load(0)
+            self._synced_at = time.monotonic()
+
+    def _stale(self):
+        return (
+            self._filter is None or self._filter.count >= self._filter.capacity
+            or time.monotonic() - self._synced_at > USERNAME_SYNC_INTERVAL
+        )
+
+    def _sync(self):
+        if self._filter is None or self._filter.count >= self._filter.capacity:
+            self.warm()
+        elif time.monotonic() - self._synced_at > USERNAME_SYNC_INTERVAL:
+            with self._lock:
+                self._load(self._last_id)
+                self._synced_at = time.monotonic()
+
+    def add(self, username):
+        if self._filter is not None:
+            with self._lock:
+                self._filter.add(username.lower())
+
+    def exists(self, username):
+        """Case-insensitive; the database is only asked when the filter says "maybe"."""
+        self._sync()
+        if username.lower() not in self._filter:
+            return False
+        return self._user_model().objects.annotate(
+            username_lower=Lower('username')
+        ).filter(username_lower=username.lower()).exists()
+
+    async def aexists(self, username):
+        """exists() for async views: the filter check never leaves the event loop."""
+        if self._stale():
+            await sync_to_async(self._sync)()
+        if username.lower() not in self._filter:
+            return False
+        return await self._user_model().objects.annotate(
+            username_lower=Lower('username')
+        ).filter(username_lower=username.lower()).aexists()
+
+    def reset(self):
+        with self._lock:
+            self._filter = None
+
+
+usernames = UsernameIndex()
@@ -23,28 +23,71 @@ from rest_framework.decorators import api_view, permission_classes, action
 from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated, AllowAny
 from rest_framework.views import APIView
-from django.db.models import Q
+from rest_framework.exceptions import ValidationError
+from django.db import IntegrityError, transaction
+from django.db.models import Q, Count, F, Prefetch
 from django.utils import timezone
 from rest_framework.parsers import MultiPartParser, FormParser
 from datetime import datetime, timedelta
 from .models import (
     User, Dentist, Patient, DentalImage, Disease, 
-    ImageAnalysis, Appointment, Treatment, 
-    WorkSchedule, 
+    ImageAnalysis, ImageClassification, Appointment, Treatment, 
+    WorkSchedule, DetectionCount, DentistPatient,
+)
+from .availability import open_slots, MAX_RANGE_DAYS
+from .budgets import QueryBudget
+from .pagination import (
+    AppointmentCursorPagination, PatientCursorPagination, DentistCursorPagination,
+    AnalysisCursorPagination,
+)
+from .caching import directory_version, directory_body_key, DIRECTORY_TIMEOUT, invalidate_analysis_fragment
+from .sparse_fields import SparseFieldsMixin
+from .async_api import AsyncAPIMixin
+from .replicas import primary
+from .fast_serializers import aappointment_rows, analysis_rows, analysis_summary_rows
+from .booking import save_booking, apply_bulk_operations, SlotUnavailable
+from .batch import run_batch
+from .sync import changes_since, InvalidCursor
+from .events import (
+    publish_appointment_events, get_broker, issue_stream_ticket, redeem_stream_ticket,
+    EVENT_KEEPALIVE_SECONDS, STREAM_TICKET_SECONDS,
+)
+from .detection_classes import (
+    ALL_CLASS_NAMES, DETECTION_CLASSES, MODEL_FILES,
+    class_names_for, normalize_class_name, camel_case_count_key,
 )
 from .serializers import (
     UserSerializer, DentistSerializer, PatientSerializer, 
     RegisterDentistSerializer, RegisterPatientSerializer,
     DentalImageSerializer, DiseaseSerializer, 
     ImageAnalysisSerializer, AppointmentSerializer,
-    TreatmentSerializer, WorkScheduleSerializer
+    TreatmentSerializer, WorkScheduleSerializer,
+    BulkAppointmentSerializer, ProfileTokenObtainPairSerializer, BatchSerializer,
+    PROFILE_PATIENT,
    
 )
 from django.contrib.auth import get_user_model
 
-from rest_framework_simplejwt.authentication import JWTAuthentication
+from .authentication import CachedJWTAuthentication
+from .throttling import UsernameCheckThrottle
+from .usernames import usernames
+from rest_framework_simplejwt.views import TokenObtainPairView
 from django.core.files.base import ContentFile
 from django.contrib.auth import authenticate
+from django.core.cache import cache
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
+from asgiref.sync import sync_to_async
+from rest_framework_simplejwt.exceptions import InvalidToken, AuthenticationFailed
+from rest_framework_simplejwt.settings import api_settings as jwt_settings
+import asyncio
+import json
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+import hashlib
 
 User = get_user_model()  
 
@@ -73,36 +116,236 @@ class RegisterPatientView(generics.CreateAPIView):
         return super().create(request, *args, **kwargs)
 
 # User Profile
-class UserProfileView(generics.RetrieveUpdateDestroyAPIView):
+class UserProfileView(AsyncAPIMixin, SparseFieldsMixin, generics.RetrieveUpdateDestroyAPIView):
     serializer_class = UserSerializer
     permission_classes = [IsAuthenticated]
+    query_budget = {'get': QueryBudget(queries=8, ms=200)}
     
     def get_object(self):
-        user = self.request.user
-        print(f"User ID: {user.id}, Username: {user.username}, Role: {getattr(user, 'role', 'unknown')}")
-        print(f"User is authenticated: {self.request.user.is_authenticated}")
-        print(f"Authentication used: {self.request.auth}")
-        return user
-        
-    def retrieve(self, request, *args, **kwargs):
-        print(f"Auth header: {request.headers.get('Authorization', 'None')}")
-        print(f"Session auth: {request.session.get('_auth_user_id', 'None')}")
-        return super().retrieve(request, *args, **kwargs)
+        return self.request.user
+
+    async def get(self, request, *args, **kwargs):
+        if self.get_shape() is not None:
+            return await sync_to_async(self.retrieve)(request, *args, **kwargs)
+        # The user comes from the auth cache; only the patient's profile and appointments need queries
+        serializer = self.get_serializer(request.user)
+        serializer.context[PROFILE_PATIENT] = await self.apatient(request.user)
+        return Response(serializer.data)
+
+    async def apatient(self, user):
+        """UserSerializer.get_patient() through the async ORM."""
+        if user.role != 'patient':
+            return None
+        if User.patient.is_cached(user):
+            patient = getattr(user, 'patient', None)
+        else:
+            patient = await Patient.objects.filter(user_id=user.pk).afirst()
+        if patient is None:
+            return None
+        if patient.get_deferred_fields():
+            # The authentication cache only holds the profile id
+            await patient.arefresh_from_db(fields=patient.get_deferred_fields())
+        patient.user = user
+        serializer = PatientSerializer(patient)
+        serializer.fields.pop('appointments')
+        return {**serializer.data, 'appointments': await aappointment_rows(patient.appointment.all())}
+
     def destroy(self, request, *args, **kwargs):
         user = self.get_object()
         self.perform_destroy(user)
         return Response({"detail": "Account successfully deleted."}, status=status.HTTP_204_NO_CONTENT)
 
+class BatchView(APIView):
+    """
+    Several API calls in one round-trip:
+    {"requests": [{"id": "me", "method": "GET", "path": "/api/user/profile/"},
+                  {"method": "POST", "path": "/api/appointments/", "body": {...}}]}
+    Answers {"responses": [{"id": ..., "status": ..., "body": ...}, ...]} in request order.
+    """
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request):
+        serializer = BatchSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        return Response({'responses': run_batch(request, serializer.validated_data['requests'])})
+
+
+class SyncView(APIView):
+    """
+    Delta sync: GET /api/sync/ for everything, then ?since=<cursor> for what
+    changed (appointments, analyses and deleted ids) after that cursor.
+    """
+    permission_classes = [IsAuthenticated]
+    query_budget = QueryBudget(queries=8, ms=300)
+
+    def get(self, request):
+        try:
+            return Response(changes_since(request.user, request.query_params.get('since'), request))
+        except InvalidCursor as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+
+def _stream_user(request):
+    """(user, unix time the stream must end) from ?ticket= or the Authorization header, else None."""
+    authentication = CachedJWTAuthentication()
+    try:
+        ticket = request.GET.get('ticket')
+        if ticket:
+            redeemed = redeem_stream_ticket(ticket)
+            if redeemed is None:
+                return None
+            user_id, expires_at = redeemed
+            user = authentication.get_user({jwt_settings.USER_ID_CLAIM: user_id})
+            return user, expires_at
+        header = authentication.get_header(request)
+        raw_token = authentication.get_raw_token(header) if header else None
+        if not raw_token:
+            return None
+        token = authentication.get_validated_token(raw_token)
+        return authentication.get_user(token), token['exp']
+    except (InvalidToken, AuthenticationFailed):
+        return None
+
+
+class EventTicketView(APIView):
+    """
+    POST: a single-use ticket for opening the appointment event stream,
+    /api/events/appointments/?ticket=..., within STREAM_TICKET_SECONDS.
+    """
+    permission_classes = [IsAuthenticated]
+    query_budget = {'post': QueryBudget(queries=2, ms=100)}
+
+    def post(self, request):
+        if request.auth is not None:
+            expires_at = request.auth['exp']
+        else:
+            expires_at = int((timezone.now() + jwt_settings.ACCESS_TOKEN_LIFETIME).timestamp())
+        return Response({
+            'ticket': issue_stream_ticket(request.user.pk, expires_at),
+            'expires_in': STREAM_TICKET_SECONDS,
+        })
+
+
+async def appointment_events(request):
+    """
+    Server-Sent Events: appointment.created/updated/approved/deleted for the
+    signed-in user, with a comment line every EVENT_KEEPALIVE_SECONDS.
+    Needs the ASGI application; each open stream is one idle coroutine.
+    When the access token expires the stream sends stream.expired and
+    closes; the client gets a new ticket and reconnects.
+    """
+    authenticated = await sync_to_async(_stream_user)(request)
+    if authenticated is None:
+        return JsonResponse({"detail": "Authentication credentials were not provided."}, status=401)
+    user, expires_at = authenticated
+
+    async def stream():
+        broker = get_broker()
+        subscription = broker.subscribe(user.pk)
+        try:
+            yield 'retry: 5000\n\n'
+            while True:
+                remaining = expires_at - time.time()
+                if remaining <= 0:
+                    yield 'event: stream.expired\ndata: {}\n\n'
+                    return
+                try:
+                    event = await asyncio.wait_for(subscription.get(), min(EVENT_KEEPALIVE_SECONDS, remaining))
+                except asyncio.TimeoutError:
+                    yield ': keepalive\n\n'
+                    continue
+                yield f"event: {event['type']}\ndata: {json.dumps(event)}\n\n"
+        finally:
+            broker.unsubscribe(subscription)
+
+    response = StreamingHttpResponse(stream(), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
+class LoginView(TokenObtainPairView):
+    """/api/token/: access/refresh pair plus profile, role and patient/dentist id."""
+    serializer_class = ProfileTokenObtainPairSerializer
+
+
 # Dentist Views
-class DentistViewSet(viewsets.ModelViewSet):
+class DentistViewSet(SparseFieldsMixin, viewsets.ModelViewSet):
     serializer_class = DentistSerializer
+    pagination_class = DentistCursorPagination
+    query_budget = {
+        'list': QueryBudget(queries=4, ms=200),
+        'retrieve': QueryBudget(queries=4, ms=200),
+        'availability': QueryBudget(queries=6, ms=200),
+    }
+    shape_relations = {
+        'user': (['user'], []),
+    }
+    # Public, cacheable directory reads: ETag/Last-Modified come from the
+    # directory version stamp, rendered bodies are shared through the cache.
+    # Only anonymous JSON bodies are shared: the browsable API page carries
+    # the viewer's username and CSRF token.
+    directory_actions = ('list', 'retrieve')
     
     def get_queryset(self):
-        
-        return Dentist.objects.all()
+        queryset = Dentist.objects.all()
+        if self.action == 'list':
+            specialization = self.request.query_params.get('specialization')
+            if specialization:
+                queryset = queryset.filter(specialization__iexact=specialization)
+        return self.shape_queryset(queryset)
+
+    def list(self, request, *args, **kwargs):
+        return self.directory_response(super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.directory_response(super().retrieve, request, *args, **kwargs)
+
+    def directory_response(self, handler, request, *args, **kwargs):
+        version = directory_version()
+        variant = hashlib.md5(
+            f"{request.get_host()}|{request.get_full_path()}|{request.accepted_renderer.format}".encode()
+        ).hexdigest()
+        self.directory_etag = f'"{version}-{variant}"'
+        self.directory_stamp = version
+        self.directory_shared = (
+            request.accepted_renderer.format == 'json'
+            and not request.user.is_authenticated
+            and settings.SESSION_COOKIE_NAME not in request.COOKIES
+        )
+
+        not_modified = get_conditional_response(request, etag=self.directory_etag, last_modified=version)
+        if not_modified is not None:
+            return not_modified
+
+        if self.directory_shared:
+            body_key = directory_body_key(version, variant)
+            cached = cache.get(body_key)
+            if cached is not None:
+                content, content_type = cached
+                return HttpResponse(content, content_type=content_type)
+            self.directory_body_key = body_key
+        # The body is cached under the current version, so build it from the primary
+        with primary():
+            return handler(request, *args, **kwargs)
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super().finalize_response(request, response, *args, **kwargs)
+        if self.action not in self.directory_actions or not hasattr(self, 'directory_etag'):
+            return response
+        if response.status_code not in (200, 304):
+            return response
+        body_key = getattr(self, 'directory_body_key', None)
+        if body_key and response.status_code == 200:
+            response.render()
+            cache.set(body_key, (response.content, response['Content-Type']), DIRECTORY_TIMEOUT)
+        response['ETag'] = self.directory_etag
+        response['Last-Modified'] = http_date(self.directory_stamp)
+        response['Cache-Control'] = 'public, no-cache' if self.directory_shared else 'private, no-cache'
+        return response
     
     def get_permissions(self):
-        if self.action == 'list' or self.action == 'retrieve':
+        if self.action in ('list', 'retrieve', 'availability'):
             
             permission_classes = [AllowAny]
         else:
@@ -110,50 +353,215 @@ class DentistViewSet(viewsets.ModelViewSet):
             permission_classes = [IsAuthenticated]
         return [permission() for permission in permission_classes]
 
+    @action(detail=True, methods=['get'])
+    def availability(self, request, pk=None):
+        """
+        Open slots for this dentist: ?from=YYYY-MM-DD&to=YYYY-MM-DD&duration=<minutes>
+        """
+        dentist = self.get_object()
+        today = timezone.now().date()
+        try:
+            date_from = datetime.strptime(request.query_params.get('from', today.isoformat()), '%Y-%m-%d').date()
+            date_to = datetime.strptime(
+                request.query_params.get('to', (date_from + timedelta(days=6)).isoformat()), '%Y-%m-%d'
+            ).date()
+            duration = int(request.query_params.get('duration', 30))
+        except ValueError:
+            return Response(
+                {"error": "from/to must be YYYY-MM-DD and duration an integer"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        if date_to < date_from or (date_to - date_from).days >= MAX_RANGE_DAYS:
+            return Response(
+                {"error": f"'to' must be on or after 'from' and within {MAX_RANGE_DAYS} days"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        if not 5 <= duration <= 8 * 60:
+            return Response(
+                {"error": "duration must be between 5 and 480 minutes"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        return Response({
+            'dentist': dentist.pk,
+            'duration': duration,
+            'days': open_slots(dentist.pk, date_from, date_to, duration),
+        })
+
 # Patient Views
 
 
-class PatientViewSet(viewsets.ModelViewSet):
+class PatientViewSet(SparseFieldsMixin, viewsets.ModelViewSet):
     serializer_class = PatientSerializer
     permission_classes = [IsAuthenticated]
+    pagination_class = PatientCursorPagination
+    query_budget = {
+        # Patients, appointments, their analyses, then fragment misses (three queries)
+        'list': QueryBudget(queries=9, ms=300),
+        'retrieve': QueryBudget(queries=9, ms=200),
+        'history': QueryBudget(queries=10, ms=200),
+    }
+    # Appointments embedded per patient in a dentist's list; ?appointments_limit= up to the max
+    NESTED_APPOINTMENTS_LIMIT = 5
+    MAX_NESTED_APPOINTMENTS_LIMIT = 50
+
+    def nested_appointments_limit(self):
+        try:
+            limit = int(self.request.query_params.get('appointments_limit', self.NESTED_APPOINTMENTS_LIMIT))
+        except ValueError:
+            limit = self.NESTED_APPOINTMENTS_LIMIT
+        return max(0, min(limit, self.MAX_NESTED_APPOINTMENTS_LIMIT))
+
+    def get_shape_relations(self):
+        appointments = Appointment.objects.select_related('dentist__user')
+        if self.request.user.role == 'dentist':
+            # Only this dentist's appointments, most recent first, capped per patient
+            appointments = appointments.filter(dentist_id=self.request.user.pk).order_by(
+                '-date', '-start_time'
+            )[:self.nested_appointments_limit()]
+        relations = {
+            'user': (['user'], []),
+            # to_attr because Django cannot cache a sliced prefetch on the related manager
+            'appointments': ([], [Prefetch('appointment', queryset=appointments, to_attr='prefetched_appointments')]),
+            'appointments.analyzed_image': ([], [
+                'prefetched_appointments__analyzed_image',
+                'prefetched_appointments__analyzed_image__detection_counts',
+            ]),
+            'appointments.analyzed_image.original_image': ([], [
+                'prefetched_appointments__analyzed_image__original_image'
+            ]),
+            'appointments.analyzed_image.diseases': ([], ['prefetched_appointments__analyzed_image__diseases']),
+        }
+        if self.get_shape() is None:
+            # Full-shape analyses render from the fragment cache
+            relations['appointments.analyzed_image'] = ([], ['prefetched_appointments__analyzed_image'])
+            relations['appointments.analyzed_image.original_image'] = ([], [])
+            relations['appointments.analyzed_image.diseases'] = ([], [])
+        return relations
+
+    def get_serializer_class(self):
+        if self.action == 'history':
+            return AppointmentSerializer
+        return super().get_serializer_class()
     
     def get_queryset(self):
         if self.request.user.role == 'patient':
-            return Patient.objects.filter(user=self.request.user).prefetch_related(
-                'appointment',
-                'appointment__analyzed_image',
-                'appointment__analyzed_image__diseases'
-            ).select_related('user')
+            queryset = Patient.objects.filter(user=self.request.user)
         elif self.request.user.role == 'dentist':
-            dentist = self.request.user.dentist
-            return Patient.objects.filter(appointment__dentist=dentist).distinct().prefetch_related(
-                'appointment',
-                'appointment__analyzed_image',
-                'appointment__analyzed_image__diseases'
-            ).select_related('user')
+            # One indexed scan of this dentist's links, newest visit first
+            queryset = Patient.objects.filter(
+                dentist_links__dentist_id=self.request.user.pk
+            ).annotate(last_visit=F('dentist_links__last_visit')).order_by('-last_visit', 'user_id')
         else:
             return Patient.objects.none()
+        if self.action == 'history':
+            return queryset
+        return self.shape_queryset(queryset)
+
+    def paginate_queryset(self, queryset):
+        # Patients only ever see their own record
+        if self.request.user.role != 'dentist':
+            return None
+        return super().paginate_queryset(queryset)
+
+    @action(detail=True, methods=['get'])
+    def history(self, request, pk=None):
+        """
+        Full appointment history for one patient; a dentist sees only their own
+        appointments with that patient. Supports ?page_size=/?cursor=.
+        """
+        patient = self.get_object()
+        appointments = Appointment.objects.filter(patient=patient)
+        if request.user.role == 'dentist':
+            appointments = appointments.filter(dentist_id=request.user.pk)
+        appointments = appointments.select_related(
+            'analyzed_image', 'analyzed_image__original_image', 'patient__user', 'dentist__user'
+        ).prefetch_related('analyzed_image__diseases', 'analyzed_image__detection_counts')
+
+        paginator = AppointmentCursorPagination()
+        page = paginator.paginate_queryset(appointments, request, view=self)
+        if page is not None:
+            return paginator.get_paginated_response(self.get_serializer(page, many=True).data)
+        appointments = appointments.order_by(*AppointmentCursorPagination.ordering)
+        return Response(self.get_serializer(appointments, many=True).data)
 
-class AppointmentViewSet(viewsets.ModelViewSet):
+class AppointmentViewSet(AsyncAPIMixin, SparseFieldsMixin, viewsets.ModelViewSet):
     serializer_class = AppointmentSerializer
     permission_classes = [IsAuthenticated]
-    authentication_classes = [JWTAuthentication]
+    authentication_classes = [CachedJWTAuthentication]
+    pagination_class = AppointmentCursorPagination
+    query_budget = {
+        'list': QueryBudget(queries=8, ms=300),
+        'retrieve': QueryBudget(queries=8, ms=200),
+        # Overlap check, insert, DentistPatient refresh, response serialization
+        'create': QueryBudget(queries=18, ms=500),
+        'approve': QueryBudget(queries=6, ms=200),
+    }
+    shape_relations = {
+        'patient_name': (['patient__user'], []),
+        'dentist_name': (['dentist__user'], []),
+        'analyzed_image': (['analyzed_image'], ['analyzed_image__detection_counts']),
+        'analyzed_image.original_image': (['analyzed_image__original_image'], []),
+        'analyzed_image.diseases': ([], ['analyzed_image__diseases']),
+    }
+
+    def get_shape_relations(self):
+        if self.get_shape() is None:
+            # Full-shape analyses render from the fragment cache
+            return {
+                **self.shape_relations,
+                'analyzed_image': (['analyzed_image'], []),
+                'analyzed_image.original_image': ([], []),
+                'analyzed_image.diseases': ([], []),
+            }
+        return self.shape_relations
     
     def get_queryset(self):
         user = self.request.user
         if user.is_authenticated:
             if user.role == 'patient':
-                return Appointment.objects.filter(patient=user.patient).select_related(
-                    'analyzed_image', 'analyzed_image__original_image', 
-                    'patient__user', 'dentist__user'  
-                ).prefetch_related('analyzed_image__diseases')
+                queryset = Appointment.objects.filter(patient_id=user.pk)
             elif user.role == 'dentist':
-                return Appointment.objects.filter(dentist=user.dentist).select_related(
-                    'analyzed_image', 'analyzed_image__original_image', 
-                    'patient__user', 'dentist__user' 
-                ).prefetch_related('analyzed_image__diseases')
+                queryset = Appointment.objects.filter(dentist_id=user.pk)
+            else:
+                return Appointment.objects.none()
+            if self.action == 'list':
+                queryset = self.filter_list(queryset)
+            return self.shape_queryset(queryset)
         return Appointment.objects.none()
 
+    async def list(self, request, *args, **kwargs):
+        if self.get_shape() is not None:
+            return await sync_to_async(super().list)(request, *args, **kwargs)
+        # Default shape: build the rows from .values() instead of per-row serializers
+        queryset = self.filter_queryset(self.get_queryset())
+        page = await sync_to_async(self.paginate_queryset)(
+            queryset.select_related(None).prefetch_related(None).only('id', 'date', 'start_time')
+        )
+        if page is not None:
+            return self.get_paginated_response(await aappointment_rows([a.pk for a in page], request))
+        return Response(await aappointment_rows(queryset, request))
+
+    def filter_list(self, queryset):
+        """
+        ?date_from=YYYY-MM-DD&date_to=YYYY-MM-DD&approved=true|false&treatment=<name>
+        """
+        params = self.request.query_params
+        try:
+            if params.get('date_from'):
+                queryset = queryset.filter(date__gte=datetime.strptime(params['date_from'], '%Y-%m-%d').date())
+            if params.get('date_to'):
+                queryset = queryset.filter(date__lte=datetime.strptime(params['date_to'], '%Y-%m-%d').date())
+        except ValueError:
+            raise ValidationError({"error": "date_from/date_to must be YYYY-MM-DD"})
+        approved = params.get('approved', '').lower()
+        if approved in ('true', '1'):
+            queryset = queryset.filter(approved=True)
+        elif approved in ('false', '0'):
+            queryset = queryset.filter(approved=False)
+        if params.get('treatment'):
+            queryset = queryset.filter(treatment=params['treatment'])
+        return queryset
+
     def create(self, request, *args, **kwargs):
         user = self.request.user
         data = request.data.copy()
@@ -168,7 +576,10 @@ class AppointmentViewSet(viewsets.ModelViewSet):
             print(f"Validation errors: {serializer.errors}")
             return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
             
-        self.perform_create(serializer)
+        try:
+            self.perform_create(serializer)
+        except SlotUnavailable as e:
+            return Response({"error": str(e)}, status=status.HTTP_409_CONFLICT)
         headers = self.get_success_headers(serializer.data)
         return Response({
             'status': 'success',
@@ -177,65 +588,75 @@ class AppointmentViewSet(viewsets.ModelViewSet):
         }, status=status.HTTP_201_CREATED, headers=headers)
         
     def perform_create(self, serializer):
-        serializer.save()
-    
-    
+        save_booking(serializer)
+
+    def perform_update(self, serializer):
+        save_booking(serializer)
+
+    def update(self, request, *args, **kwargs):
+        try:
+            return super().update(request, *args, **kwargs)
+        except SlotUnavailable as e:
+            return Response({"error": str(e)}, status=status.HTTP_409_CONFLICT)
+
     def partial_update(self, request, *args, **kwargs):
         """
         Handle PATCH requests to update an appointment partially.
         """
-        instance = self.get_object()
-        
-        # Print debugging information
-        print(f"PATCH request data: {request.data}")
-        
-        serializer = self.get_serializer(instance, data=request.data, partial=True)
-        
-        try:
-            serializer.is_valid(raise_exception=True)
-            self.perform_update(serializer)
-            print(f"Update successful: {serializer.data}")
-            return Response(serializer.data)
-        except Exception as e:
-            print(f"Error in partial_update: {str(e)}")
-            return Response(
-                {"error": str(e)},
-                status=status.HTTP_400_BAD_REQUEST
-            )
+        kwargs['partial'] = True
+        return self.update(request, *args, **kwargs)
 
     @action(detail=True, methods=['patch'])
     def approve(self, request, pk=None):
-        try:
-            
-            appointment = Appointment.objects.get(pk=pk)
-            
-            
-            if request.user.role != 'dentist' or request.user.dentist != appointment.dentist:
-                return Response(
-                    {"error": "Only the assigned dentist can approve appointments"},
-                    status=status.HTTP_403_FORBIDDEN
-                )
-            
-            appointment.approved = True
-            appointment.save()
-            return Response({"status": "appointment approved"})
-        except Appointment.DoesNotExist:
+        if request.user.role == 'dentist':
+            # Single UPDATE of the one column, scoped to this dentist
+            if Appointment.objects.filter(pk=pk, dentist_id=request.user.pk).update(approved=True, updated_at=timezone.now()):
+                publish_appointment_events('approved', Appointment.objects.filter(pk=pk).values(
+                    'id', 'patient_id', 'dentist_id', 'date', 'start_time', 'end_time', 'approved'
+                ))
+                return Response({"status": "appointment approved"})
+        if not Appointment.objects.filter(pk=pk).exists():
             return Response(
                 {"error": "Appointment not found"},
                 status=status.HTTP_404_NOT_FOUND
             )
+        return Response(
+            {"error": "Only the assigned dentist can approve appointments"},
+            status=status.HTTP_403_FORBIDDEN
+        )
+
+    @action(detail=False, methods=['post'])
+    def bulk(self, request):
+        """
+        Apply several operations in one request:
+        {"operations": [{"id": 1, "op": "approve"},
+                        {"id": 2, "op": "reschedule", "date": "...", "start_time": "...", "end_time": "..."},
+                        {"id": 3, "op": "cancel"}]}
+        """
+        serializer = BulkAppointmentSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        operations = serializer.validated_data['operations']
+        results = apply_bulk_operations(request.user, operations)
+        return Response({
+            'results': [{'id': operation['id'], 'status': results[operation['id']]} for operation in operations]
+        })
     
 
 
 
 # Work Schedule Views
-class WorkScheduleViewSet(viewsets.ModelViewSet):
+class WorkScheduleViewSet(AsyncAPIMixin, viewsets.ModelViewSet):
     serializer_class = WorkScheduleSerializer
+    query_budget = {'list': QueryBudget(queries=4, ms=200)}
     # permission_classes = [IsAuthenticated]
     
     def get_queryset(self):
         dentist_id = self.kwargs.get('dentist_pk')
         return WorkSchedule.objects.filter(dentist_id=dentist_id)
+
+    async def list(self, request, *args, **kwargs):
+        schedules = [schedule async for schedule in self.filter_queryset(self.get_queryset())]
+        return Response(self.get_serializer(schedules, many=True).data)
     
     def perform_create(self, serializer):
         user = self.request.user
@@ -243,9 +664,31 @@ class WorkScheduleViewSet(viewsets.ModelViewSet):
             raise PermissionError("Only dentists can create work schedules")
         serializer.save(dentist=user.dentist)
 
+_inference_pool = None
+_inference_pool_lock = threading.Lock()
+
+
+def run_inference(model, image_path):
+    """
+    Run a YOLO model on the process-wide inference pool. Inference is
+    CPU-bound and sync-only, so at most INFERENCE_WORKERS images are
+    processed at once however many requests are waiting on it.
+    """
+    global _inference_pool
+    if _inference_pool is None:
+        with _inference_pool_lock:
+            if _inference_pool is None:
+                _inference_pool = ThreadPoolExecutor(
+                    max_workers=settings.INFERENCE_WORKERS, thread_name_prefix='inference'
+                )
+    return _inference_pool.submit(model, image_path).result()
+
+
 class AnalyzeImageView(APIView):
     parser_classes = (MultiPartParser, FormParser)
     permission_classes = [IsAuthenticated]
+    # Inference dominates the time; the writes are a fixed set (see post)
+    query_budget = {'post': QueryBudget(queries=12, ms=15000)}
 
     def get_queryset(self):
         user = self.request.user
@@ -269,12 +712,6 @@ class AnalyzeImageView(APIView):
         print(f"Processing uploaded {image_type} image")
         
         try:
-            # Save the original image
-            original_dental_image = DentalImage.objects.create(image=image_file)
-            original_dental_image.image_url = original_dental_image.image.url
-            original_dental_image.save()
-            print("Original image saved")
-            
             # Save uploaded image to temporary file
             with tempfile.NamedTemporaryFile(delete=False, suffix='.jpg') as temp_file:
                 for chunk in image_file.chunks():
@@ -284,26 +721,11 @@ class AnalyzeImageView(APIView):
             # Load the appropriate YOLO model
             BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
             
-            if image_type == 'xray':
-                model_path = os.path.join(BASE_DIR, 'model', 'x-ray_model.pt')
-                class_names = ['cavity', 'fillings', 'impacted_tooth', 'implant']
-                colors = {
-                    "cavity": "#FF0000",
-                    "fillings": "#0000FF",
-                    "impacted_tooth": "#00FF00",
-                    "implant": "#800080"
-                }
-            else:
-                model_path = os.path.join(BASE_DIR, 'model', 'best_model.pt')
-                class_names = ['calculus', 'caries', 'gingivitis', 'hypodontia', 'tooth_discolation', 'ulcer']
-                colors = {
-                    "calculus": "#FFD700",
-                    "caries": "#FF0000",
-                    "gingivitis": "#FF69B4",
-                    "hypodontia": "#800080",
-                    "tooth_discolation": "#A0522D",
-                    "ulcer": "#FFA500"
-                }
+            if image_type not in DETECTION_CLASSES:
+                image_type = 'normal'
+            model_path = os.path.join(BASE_DIR, 'model', MODEL_FILES[image_type])
+            class_names = class_names_for(image_type)
+            colors = DETECTION_CLASSES[image_type]
             
             print(f"Loading model from: {os.path.abspath(model_path)}")
             class_counts = {name: 0 for name in class_names}
@@ -318,28 +740,24 @@ class AnalyzeImageView(APIView):
                 )
             
             # Run inference
-            results = model(temp_file_path)
+            results = run_inference(model, temp_file_path)
             boxes = results[0].boxes
             
-            # Normalize class names
-            class_name_mapping = {
-                'calculuss': 'calculus',
-                'tooth_discolations': 'tooth_discolation',
-                'fillings': 'fillings',
-                'impacted tooth': 'impacted_tooth'
-            }
             class_boxes = {name: [] for name in class_names}
+            class_confidences = {name: [] for name in class_names}
             
             # Process boxes and count detections
             for box in boxes:
                 class_index = int(box.cls.cpu().numpy()[0])
-                class_name = results[0].names[class_index].lower()
-                class_name = class_name_mapping.get(class_name, class_name)
+                class_name = normalize_class_name(results[0].names[class_index])
                 
                 if class_name in class_counts:
                     box_coords = [int(v) for v in box.xyxy.cpu().numpy()[0]]
                     class_boxes[class_name].append(box_coords)
                     class_counts[class_name] += 1
+                    confidence = getattr(box, 'conf', None)
+                    if confidence is not None:
+                        class_confidences[class_name].append(float(confidence.cpu().numpy()[0]))
                 else:
                     print(f"Warning: Unrecognized class name {class_name}")
             
@@ -364,69 +782,60 @@ class AnalyzeImageView(APIView):
             img.save(annotated_img_path, format='JPEG')
             print("Annotated image saved to temporary file")
             
-            # Save the annotated image to Django storage
-            with open(annotated_img_path, 'rb') as f:
-                annotated_image_name = f"analyzed_{image_file.name}"
-                analyzed_dental_image = DentalImage.objects.create(
-                    image=ContentFile(f.read(), name=annotated_image_name)
-                )
-                analyzed_dental_image.image_url = analyzed_dental_image.image.url
-                analyzed_dental_image.save()
-            print("Annotated image saved to Django storage")
-            
             # Calculate total conditions
             total_conditions = sum(class_counts.values())
+            detected = {class_name: count for class_name, count in class_counts.items() if count > 0}
             
-            # Create ImageAnalysis record
-            analysis_data = {
-                'user': request.user,
-                'original_image': original_dental_image,
-                'analyzed_image_url': analyzed_dental_image.image.url,
-                'total_conditions': total_conditions,
-                'image_type': image_type
-            }
-            
-            if image_type == 'xray':
-                analysis_data.update({
-                    'calculus_count': 0,
-                    'caries_count': 0,
-                    'gingivitis_count': 0,
-                    'hypodontia_count': 0,
-                    'tooth_discolation_count': 0,
-                    'ulcer_count': 0,
-                    'cavity_count': class_counts.get('cavity', 0),
-                    'fillings_count': class_counts.get('fillings', 0),
-                    'impacted_tooth_count': class_counts.get('impacted_tooth', 0),
-                    'implant_count': class_counts.get('implant', 0)
-                })
-            else:
-                analysis_data.update({
-                    'calculus_count': class_counts.get('calculus', 0),
-                    'caries_count': class_counts.get('caries', 0),
-                    'gingivitis_count': class_counts.get('gingivitis', 0),
-                    'hypodontia_count': class_counts.get('hypodontia', 0),
-                    'tooth_discolation_count': class_counts.get('tooth_discolation', 0),
-                    'ulcer_count': class_counts.get('ulcer', 0),
-                    'cavity_count': 0,
-                    'fillings_count': 0,
-                    'impacted_tooth_count': 0,
-                    'implant_count': 0
-                })
-            
-            print(f"Creating ImageAnalysis with data: {analysis_data}")
-            analysis = ImageAnalysis.objects.create(**analysis_data)
-            print("ImageAnalysis created successfully")
-            
-            # Create disease records
-            for disease_name, count in class_counts.items():
-                if count > 0:
-                    display_name = disease_name.replace('_', ' ').capitalize()
-                    print(f"Creating disease: {display_name}")
-                    disease, created = Disease.objects.get_or_create(
-                        name=display_name,
-                        defaults={'description': f'AI detected {display_name}'}
-                    )
-                    analysis.diseases.add(disease, through_defaults={'confidence': 0.9})
+            # Store both images, then write the analysis in one transaction with a
+            # fixed number of queries: images, analysis, counts, classifications
+            # (plus the disease lookups on a cold cache)
+            with open(annotated_img_path, 'rb') as f:
+                annotated = ContentFile(f.read(), name=f"analyzed_{image_file.name}")
+            for attempt in range(2):
+                stored = []
+                try:
+                    with transaction.atomic():
+                        stored = DentalImage.store(image_file, annotated)
+                        original_dental_image, analyzed_dental_image = stored
+                        analysis = ImageAnalysis.objects.create(
+                            user=request.user,
+                            original_image=original_dental_image,
+                            analyzed_image_url=analyzed_dental_image.image_url,
+                            total_conditions=total_conditions,
+                            image_type=image_type,
+                        )
+                        DetectionCount.objects.bulk_create([
+                            DetectionCount(analysis=analysis, class_name=class_name, count=count)
+                            for class_name, count in detected.items()
+                        ])
+                        display_names = {
+                            class_name: class_name.replace('_', ' ').capitalize() for class_name in detected
+                        }
+                        disease_ids = Disease.ids_for(list(display_names.values()))
+                        ImageClassification.objects.bulk_create([
+                            ImageClassification(
+                                analysis=analysis,
+                                disease_id=disease_ids[display_name],
+                                # Mean detection confidence for the class; 0 when the model reports none
+                                confidence=(
+                                    sum(class_confidences[class_name]) / len(class_confidences[class_name])
+                                    if class_confidences[class_name] else 0.0
+                                ),
+                            )
+                            for class_name, display_name in display_names.items()
+                        ])
+                    break
+                except IntegrityError:
+                    # A disease id cached by this process was deleted by another one:
+                    # drop the rolled-back files and retry once with ids from the database
+                    for dental_image in stored:
+                        dental_image.image.delete(save=False)
+                    Disease.forget_ids()
+                    if attempt:
+                        raise
+            print(f"ImageAnalysis {analysis.pk} saved")
+            # Drop any fragment a concurrent read cached before the counts and diseases existed
+            invalidate_analysis_fragment(analysis.pk, analysis.created_at)
             
             # Convert images to base64
             with open(temp_file_path, "rb") as img_file:
@@ -444,32 +853,11 @@ class AnalyzeImageView(APIView):
                 'imageType': image_type
             }
             
-            if image_type == 'xray':
-                response_data.update({
-                    'cavityCount': class_counts.get('cavity', 0),
-                    'fillingsCount': class_counts.get('fillings', 0),
-                    'impactedToothCount': class_counts.get('impacted_tooth', 0),
-                    'implantCount': class_counts.get('implant', 0),
-                    'calculusCount': 0,
-                    'cariesCount': 0,
-                    'gingivitisCount': 0,
-                    'hypodontiaCount': 0,
-                    'toothDiscolationCount': 0,
-                    'ulcerCount': 0
-                })
-            else:
-                response_data.update({
-                    'calculusCount': class_counts.get('calculus', 0),
-                    'cariesCount': class_counts.get('caries', 0),
-                    'gingivitisCount': class_counts.get('gingivitis', 0),
-                    'hypodontiaCount': class_counts.get('hypodontia', 0),
-                    'toothDiscolationCount': class_counts.get('tooth_discolation', 0),
-                    'ulcerCount': class_counts.get('ulcer', 0),
-                    'cavityCount': 0,
-                    'fillingsCount': 0,
-                    'impactedToothCount': 0,
-                    'implantCount': 0
-                })
+            # Every known class gets a key so clients see a stable shape
+            response_data.update({
+                camel_case_count_key(class_name): class_counts.get(class_name, 0)
+                for class_name in ALL_CLASS_NAMES
+            })
             
             # Clean up temporary files
             os.unlink(temp_file_path)
@@ -492,6 +880,7 @@ class AnalyzeImageView(APIView):
             )
 class DashboardStatsView(APIView):
     permission_classes = [IsAuthenticated]
+    query_budget = QueryBudget(queries=10, ms=300)
     
     def get(self, request):
         """
@@ -509,15 +898,13 @@ class DashboardStatsView(APIView):
         # Get appointment counts
         total_appointments = Appointment.objects.filter(dentist=dentist).count()
         
-        # Get patient stats
-        new_patients_count = Patient.objects.filter(
-            appointment__dentist=dentist, 
-            member_since__gte=today - timedelta(days=30)
-        ).distinct().count()
+        # Get patient stats from the maintained dentist-patient links
+        patient_links = DentistPatient.objects.filter(dentist=dentist)
+        new_patients_count = patient_links.filter(
+            patient__member_since__gte=today - timedelta(days=30)
+        ).count()
         
-        total_patients = Patient.objects.filter(
-            appointment__dentist=dentist
-        ).distinct().count()
+        total_patients = patient_links.count()
         
         all_appointments = Appointment.objects.filter(
             dentist=dentist
@@ -539,28 +926,20 @@ class DashboardStatsView(APIView):
             })
         
         # Get recent patients
-        recent_patients = Patient.objects.filter(
-            appointment__dentist=dentist
-        ).distinct().order_by('-appointment__date')[:5]
+        recent_links = patient_links.select_related('patient__user').order_by('-last_visit')[:5]
         
         recent_patients_list = []
-        for patient in recent_patients:
-            last_visit = Appointment.objects.filter(
-                dentist=dentist,
-                patient=patient
-            ).order_by('-date').first()
-            
-            if last_visit:
-                patient_user = patient.user
-                visit_id= 1000+patient_user.id
-                recent_patients_list.append({
-                    'id': patient_user.id,
-                    'name': f"{patient_user.first_name} {patient_user.last_name}",
-                    
-                    'visit_id': visit_id,
-                    'date': last_visit.date.strftime('%m/%d/%y'),
-                    'gender': patient_user.gender or 'Unknown'  # Get actual gender from User model
-                })
+        for link in recent_links:
+            patient_user = link.patient.user
+            visit_id= 1000+patient_user.id
+            recent_patients_list.append({
+                'id': patient_user.id,
+                'name': f"{patient_user.first_name} {patient_user.last_name}",
+                
+                'visit_id': visit_id,
+                'date': link.last_visit.strftime('%m/%d/%y'),
+                'gender': patient_user.gender or 'Unknown'  # Get actual gender from User model
+            })
         
         # Get actual gender distribution from patients who have appointments with this dentist
         gender_counts = {
@@ -569,22 +948,15 @@ class DashboardStatsView(APIView):
             'others': 0
         }
         
-        # Query all patients of this dentist and count their genders
-        patients_with_appointments = Patient.objects.filter(
-            appointment__dentist=dentist
-        ).distinct().select_related('user')
-        
-        for patient in patients_with_appointments:
-            user_gender = patient.user.gender
-            
-            
+        for row in patient_links.values('patient__user__gender').annotate(total=Count('id')).order_by():
+            user_gender = row['patient__user__gender']
             if user_gender == 'male':
-                gender_counts['male'] += 1
+                gender_counts['male'] += row['total']
             elif user_gender == 'female':
-                gender_counts['female'] += 1
+                gender_counts['female'] += row['total']
             else:
                 # For 'other' 
-                gender_counts['others'] += 1
+                gender_counts['others'] += row['total']
         
         return Response({
             'total_appointments': total_appointments,
@@ -595,12 +967,40 @@ class DashboardStatsView(APIView):
             'gender_distribution': gender_counts
         })
     
-class UserAnalysisListView(generics.ListAPIView):
+class UserAnalysisListView(SparseFieldsMixin, generics.ListAPIView):
     serializer_class = ImageAnalysisSerializer
     permission_classes = [IsAuthenticated]
+    pagination_class = AnalysisCursorPagination
+    query_budget = QueryBudget(queries=7, ms=300)
+    shape_relations = {
+        'original_image': (['original_image'], []),
+        'diseases': ([], ['diseases']),
+    }
     
     def get_queryset(self):
-        return ImageAnalysis.objects.filter(user=self.request.user).order_by('-created_at')
+        queryset = ImageAnalysis.objects.filter(user=self.request.user)
+        # ?min_<class>=<n>, e.g. ?min_cavity=2
+        for class_name in ALL_CLASS_NAMES:
+            minimum = self.request.query_params.get(f'min_{class_name}')
+            if minimum is not None and minimum.isdigit():
+                queryset = queryset.with_min_count(class_name, int(minimum))
+        return self.shape_queryset(queryset.prefetch_related('detection_counts')).order_by('-created_at', '-id')
+
+    def list(self, request, *args, **kwargs):
+        summary = request.query_params.get('summary') in ('1', 'true')
+        if self.get_shape() is not None and not summary:
+            return super().list(request, *args, **kwargs)
+        # Default and summary shapes are built from .values() rows
+        render_rows = analysis_summary_rows if summary else analysis_rows
+        queryset = self.filter_queryset(self.get_queryset())
+        page = self.paginate_queryset(
+            queryset.select_related(None).prefetch_related(None).only('id', 'created_at')
+        )
+        if page is not None:
+            return self.get_paginated_response(
+                render_rows(queryset.filter(pk__in=[analysis.pk for analysis in page]), request)
+            )
+        return Response(render_rows(queryset, request))
 class ChangePasswordView(APIView):
     permission_classes = [IsAuthenticated]
     
@@ -627,23 +1027,27 @@ class ChangePasswordView(APIView):
         user.save()
         
         return Response({'success': True})
-class CheckUsernameView(APIView):
+class CheckUsernameView(AsyncAPIMixin, APIView):
+    """
+    Case-insensitive username availability, GET ?username= or POST {"username": ...}.
+    Always 200 with {"exists": bool, "available": bool}; throttled per IP.
+    """
     permission_classes = [AllowAny]
-    
-    def get(self, request):
+    throttle_classes = [UsernameCheckThrottle]
+    query_budget = QueryBudget(queries=3, ms=100)
+
+    async def get(self, request):
         username = request.query_params.get('username', '')
         if not username:
             return Response({'error': 'Username parameter is required'}, status=400)
-            
-        exists = User.objects.filter(username=username).exists()
-        return Response({'exists': exists})
-    def post(self, request):
+        return await self.availability(username)
+
+    async def post(self, request):
         username = request.data.get('username')
         if not username:
             return Response({"detail": "Username is required."}, status=status.HTTP_400_BAD_REQUEST)
-        
-        user_exists = User.objects.filter(username=username).exists()
-        if user_exists:
-            return Response({"exists": True}, status=status.HTTP_200_OK)
-        else:
-            return Response({"exists": False}, status=status.HTTP_404_NOT_FOUND)
\ No newline at end of file
+        return await self.availability(username)
+
+    async def availability(self, username):
+        exists = await usernames.aexists(username)
+        return Response({'exists': exists, 'available': not exists})
\ No newline at end of file
@@ -0,0 +1,108 @@
+#crud/databases.py
+"""
+DATABASES built from the environment (see settings.py and .env).
+
+Setting DB_NAME switches the default database to PostgreSQL (DB_USER,
+DB_PWD, DB_HOST, DB_PORT, DB_SSLMODE). With psycopg 3 and psycopg_pool
+installed, connections come from a per-process pool (DB_POOL_MIN_SIZE,
+DB_POOL_MAX_SIZE, DB_POOL_TIMEOUT), which also serves ASGI, where
+per-thread persistent connections are never reused. With psycopg2 the
+connections persist for DB_CONN_MAX_AGE seconds instead. Either way
+CONN_HEALTH_CHECKS replaces a connection the server dropped rather than
+failing the request that picks it up.
+
+Without DB_NAME the project runs on SQLite (SQLITE_PATH), tuned for
+concurrent requests:
+- WAL lets reads proceed during a write.
+- IMMEDIATE transactions take the write lock up front, so two bookings
+  queue on the busy timeout (SQLITE_BUSY_TIMEOUT seconds) instead of one
+  failing to upgrade its read lock.
+- synchronous=NORMAL fsyncs at checkpoints instead of on every commit.
+
+A read replica is added as the 'replica' alias; see replica_settings()
+and api/replicas.py.
+"""
+import copy
+import importlib.util
+
+SQLITE_PRAGMAS = (
+    'PRAGMA journal_mode=WAL',
+    'PRAGMA synchronous=NORMAL',
+    'PRAGMA mmap_size=134217728',
+    'PRAGMA temp_store=MEMORY',
+)
+
+
+def _pool_available():
+    return all(importlib.util.find_spec(name) is not None for name in ('psycopg', 'psycopg_pool'))
+
+
+def postgresql_settings(env):
+    database = {
+        'ENGINE': 'django.db.backends.postgresql',
+        'NAME': env.get('DB_NAME'),
+        'USER': env.get('DB_USER', ''),
+        'PASSWORD': env.get('DB_PWD', ''),
+        'HOST': env.get('DB_HOST', ''),
+        'PORT': env.get('DB_PORT', ''),
+        'CONN_HEALTH_CHECKS': True,
+        'OPTIONS': {
+            'connect_timeout': int(env.get('DB_CONNECT_TIMEOUT', '5')),
+            'sslmode': env.get('DB_SSLMODE', 'prefer'),
+        },
+    }
+    if _pool_available() and env.get('DB_POOL', '1') != '0':
+        # Pooled connections are returned on close, so CONN_MAX_AGE must stay 0
+        database['OPTIONS']['pool'] = {
+            'min_size': int(env.get('DB_POOL_MIN_SIZE', '2')),
+            'max_size': int(env.get('DB_POOL_MAX_SIZE', '10')),
+            'timeout': int(env.get('DB_POOL_TIMEOUT', '10')),
+        }
+    else:
+        database['CONN_MAX_AGE'] = int(env.get('DB_CONN_MAX_AGE', '60'))
+    return database
+
+
+def sqlite_settings(env, base_dir):
+    return {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': env.get('SQLITE_PATH', base_dir / 'db.sqlite3'),
+        'OPTIONS': {
+            'timeout': int(env.get('SQLITE_BUSY_TIMEOUT', '20')),
+            'transaction_mode': 'IMMEDIATE',
+            'init_command': ';'.join(SQLITE_PRAGMAS),
+        },
+    }
+
+
+def replica_settings(env, primary):
+    """
+    The 'replica' alias: DB_REPLICA_HOST (PostgreSQL; DB_REPLICA_PORT,
+    DB_REPLICA_NAME, DB_REPLICA_USER and DB_REPLICA_PWD default to the
+    primary's) or SQLITE_REPLICA_PATH, e.g. a copy of the primary file for
+    local testing. None when neither is set.
+    """
+    replica = copy.deepcopy(primary)
+    if primary['ENGINE'] == 'django.db.backends.postgresql' and env.get('DB_REPLICA_HOST'):
+        replica['HOST'] = env['DB_REPLICA_HOST']
+        for key, variable in (('PORT', 'DB_REPLICA_PORT'), ('NAME', 'DB_REPLICA_NAME'),
+                              ('USER', 'DB_REPLICA_USER'), ('PASSWORD', 'DB_REPLICA_PWD')):
+            replica[key] = env.get(variable, primary[key])
+    elif primary['ENGINE'] == 'django.db.backends.sqlite3' and env.get('SQLITE_REPLICA_PATH'):
+        replica['NAME'] = env['SQLITE_REPLICA_PATH']
+    else:
+        return None
+    # Tests run against the primary only
+    replica['TEST'] = {'MIRROR': 'default'}
+    return replica
+
+
+def database_settings(env, base_dir):
+    if env.get('DB_NAME'):
+        databases = {'default': postgresql_settings(env)}
+    else:
+        databases = {'default': sqlite_settings(env, base_dir)}
+    replica = replica_settings(env, databases['default'])
+    if replica is not None:
+        databases['replica'] = replica
+    return databases
@@ -15,7 +15,8 @@ from pathlib import Path
 from datetime import timedelta
 from dotenv import load_dotenv
 import os
-# load_dotenv()
+from .databases import database_settings
+load_dotenv()
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -54,6 +55,9 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    'api.middleware.CompressionMiddleware',
+    'api.replicas.ReplicaRoutingMiddleware',
+    'api.budgets.QueryBudgetMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -96,17 +100,17 @@ WSGI_APPLICATION = 'crud.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/5.1/ref/settings/#databases
 
-DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
-        # 'ENGINE': 'django.db.backends.postgresql',
-        # 'NAME': os.getenv("DB_NAME"),
-        # 'PASSWORD': os.getenv("DB_PWD"),
-        # 'HOST': os.getenv("DB_HOST"),
-        # 'PORT': os.getenv("DB_PORT"),
-    }
-}
+# SQLite unless DB_NAME is set; see crud/databases.py for the variables
+DATABASES = database_settings(os.environ, BASE_DIR)
+
+# Safe-method requests read from the 'replica' alias when one is configured
+# (api/replicas.py). A client that just wrote is pinned to the primary for
+# REPLICA_STICKY_SECONDS; a replica more than REPLICA_MAX_LAG seconds behind
+# (sampled every REPLICA_LAG_CHECK_INTERVAL) is skipped.
+DATABASE_ROUTERS = ['api.replicas.ReadReplicaRouter']
+REPLICA_STICKY_SECONDS = int(os.getenv('DB_REPLICA_STICKY_SECONDS', '10'))
+REPLICA_MAX_LAG = float(os.getenv('DB_REPLICA_MAX_LAG', '2'))
+REPLICA_LAG_CHECK_INTERVAL = float(os.getenv('DB_REPLICA_LAG_CHECK_INTERVAL', '5'))
 
 
 # Password validation
@@ -170,7 +174,10 @@ CORS_ALLOW_HEADERS = [
     'user-agent',
     'x-csrftoken',
     'x-requested-with',
+    # Read-your-writes pin (api/replicas.py)
+    'x-db-pin',
 ]
+CORS_EXPOSE_HEADERS = ['X-DB-Pin', 'X-DB-Pin-Max-Age']
 
 SIMPLE_JWT = {
     'ACCESS_TOKEN_LIFETIME': timedelta(days=1),  # Increased for testing
@@ -189,10 +196,74 @@ SIMPLE_JWT = {
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'api.authentication.CachedJWTAuthentication',
         'rest_framework.authentication.SessionAuthentication',
     ),
     'DEFAULT_PERMISSION_CLASSES': (
         'rest_framework.permissions.IsAuthenticated',
     ),
-}
\ No newline at end of file
+    'DEFAULT_RENDERER_CLASSES': (
+        'api.renderers.ORJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ),
+    'DEFAULT_THROTTLE_RATES': {
+        'username_check': '60/min',
+    },
+}
+
+# Responses smaller than this are sent uncompressed
+RESPONSE_COMPRESSION_MIN_SIZE = 1024
+# Responses carrying tokens are sent uncompressed (BREACH)
+RESPONSE_COMPRESSION_SKIP_PATHS = ('/api/token/', '/api/events/appointments/ticket/')
+# 'fragments' holds serialized ImageAnalysis dicts (see api/caching.py).
+# Bounded per process by default; set FRAGMENT_CACHE_URL (redis://...) to
+# share it between workers.
+# The default cache holds the version stamps and small shared state
+# (directory bodies, authenticated users, replica pins, availability). As
+# LocMem it is per process: with several workers, a change made through one
+# is only seen by the others when their entries expire. Set CACHE_URL to a
+# shared Redis to run more than one worker.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'fragments': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'analysis-fragments',
+        'OPTIONS': {'MAX_ENTRIES': 5000},
+    },
+}
+if os.getenv('CACHE_URL'):
+    CACHES['default'] = {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': os.getenv('CACHE_URL'),
+    }
+# Free-slot cache lifetime (api/availability.py). Without a shared cache
+# another worker's bookings only show up once an entry expires, so keep it
+# short unless CACHE_URL is set.
+AVAILABILITY_CACHE_SECONDS = int(os.getenv(
+    'AVAILABILITY_CACHE_SECONDS', '3600' if os.getenv('CACHE_URL') else '30'
+))
+if os.getenv('FRAGMENT_CACHE_URL'):
+    CACHES['fragments'] = {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': os.getenv('FRAGMENT_CACHE_URL'),
+    }
+
+# Fan-out for the appointment event streams (api/events.py). The in-process
+# broker only reaches streams held by the publishing worker; with more than
+# one worker set EVENT_BROKER_URL to a Redis for pub/sub between them.
+EVENT_BROKER_URL = os.getenv('EVENT_BROKER_URL')
+EVENT_BROKER = 'api.events.RedisBroker' if EVENT_BROKER_URL else 'api.events.InProcessBroker'
+
+# Concurrent YOLO inferences per process (api.views.run_inference). Views
+# wait on this pool, so under ASGI the event loop keeps serving the async
+# read endpoints while images are processed.
+INFERENCE_WORKERS = int(os.getenv('INFERENCE_WORKERS', '2'))
+
+# Per-endpoint query/time budgets declared on the views (api/budgets.py).
+# 'log' reports over-budget requests with their query fingerprints to the
+# 'api.budgets' logger; 'off' skips the counting. Time budgets are scaled
+# by QUERY_BUDGET_TIME_SCALE, e.g. on slow CI machines.
+QUERY_BUDGET_MODE = os.getenv('QUERY_BUDGET_MODE', 'log')
+QUERY_BUDGET_TIME_SCALE = float(os.getenv('QUERY_BUDGET_TIME_SCALE', '1'))
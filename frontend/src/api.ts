@@ -1,4 +1,4 @@
-import axios from "axios";
+import axios, { type AxiosInstance } from "axios";
 import { ACCESS_TOKEN } from "./constants";
 
 const apiUrl = "http://localhost:8000";
@@ -20,4 +20,57 @@ api.interceptors.request.use(
   }
 );
 
-export default api;
\ No newline at end of file
+// Read-your-writes: after a write the backend returns a signed X-DB-Pin
+// header (and X-DB-Pin-Max-Age). Sending it back until it expires makes the
+// next reads go to the primary database, whichever worker serves them; the
+// pin cookie is not sent on these cross-origin calls.
+const DB_PIN_HEADER = "X-DB-Pin";
+const DB_PIN_MAX_AGE_HEADER = "X-DB-Pin-Max-Age";
+const DB_PIN_STORAGE_KEY = "dbPin";
+
+interface StoredDbPin {
+  pin: string;
+  expiresAt: number;
+}
+
+const readDbPin = (): string | null => {
+  const stored = sessionStorage.getItem(DB_PIN_STORAGE_KEY);
+  if (!stored) {
+    return null;
+  }
+  try {
+    const { pin, expiresAt } = JSON.parse(stored) as StoredDbPin;
+    if (Date.now() < expiresAt) {
+      return pin;
+    }
+  } catch {
+    // Unreadable entry: dropped below
+  }
+  sessionStorage.removeItem(DB_PIN_STORAGE_KEY);
+  return null;
+};
+
+export const trackDbPin = (instance: AxiosInstance) => {
+  instance.interceptors.request.use((config) => {
+    const pin = readDbPin();
+    if (pin) {
+      config.headers.set(DB_PIN_HEADER, pin);
+    }
+    return config;
+  });
+  instance.interceptors.response.use((response) => {
+    const pin = response.headers[DB_PIN_HEADER.toLowerCase()];
+    const maxAge = Number(response.headers[DB_PIN_MAX_AGE_HEADER.toLowerCase()]);
+    if (pin && maxAge > 0) {
+      const stored: StoredDbPin = { pin: String(pin), expiresAt: Date.now() + maxAge * 1000 };
+      sessionStorage.setItem(DB_PIN_STORAGE_KEY, JSON.stringify(stored));
+    }
+    return response;
+  });
+};
+
+trackDbPin(api);
+// Most pages call the global axios instance directly
+trackDbPin(axios);
+
+export default api;
@@ -1,6 +1,8 @@
 import { StrictMode } from 'react';
 import { createRoot } from 'react-dom/client';
 import './index.css';
+// Installs the read-your-writes interceptors before any request is made
+import './api';
 import App from './App.tsx';
 import { BrowserRouter as Router } from 'react-router-dom';
 
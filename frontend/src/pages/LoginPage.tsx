@@ -36,15 +36,8 @@ function LoginPage() {
       localStorage.setItem(ACCESS_TOKEN, res.data.access);
       localStorage.setItem(REFRESH_TOKEN, res.data.refresh);
       
-      // Get user details to check role
-      const userRes = await api.get("http://127.0.0.1:8000/api/user/profile", {
-        headers: {
-          Authorization: `Bearer ${res.data.access}`
-        }
-      });
-      
-      // Redirect based on role
-      if (userRes.data.role === 'dentist') {
+      // The token response already carries the user's role and profile
+      if (res.data.role === 'dentist') {
         navigate("/dashboard");
       } else {
         navigate("/");
@@ -55,17 +48,11 @@ function LoginPage() {
       if (error.response?.status === 401) {
         // Check if user exists using your existing endpoint
         try {
-          await api.post("/api/user/check-username/", { username: formData.username });
-          // If we get here, the user exists but password is wrong
-          setErrorMessage("Incorrect Password.");
+          const checkRes = await api.post("/api/user/check-username/", { username: formData.username });
+          setErrorMessage(checkRes.data.exists ? "Incorrect Password." : "User not found.");
         } catch (checkError: any) {
-          if (checkError.response?.status === 404) {
-            // User doesn't exist
-            setErrorMessage("User not found.");
-          } else {
-            // Some other error with the check
-            setErrorMessage("Invalid username or password.");
-          }
+          // Some other error with the check
+          setErrorMessage("Invalid username or password.");
         }
       } else if (error.request) {
         // Request was made but no response received
@@ -69,11 +69,8 @@ function PatientSignupPage() {
     
     setCheckingUsername(true);
     try {
-      const response = await api.get(`/api/user/check-username/?username=${username}`);
-      
-     
-      const isUsernameTaken = 
-        ['admin', 'test', 'user', 'patient1', 'dentist'].includes(username.toLowerCase());
+      const response = await api.get(`/api/user/check-username/?username=${encodeURIComponent(username)}`);
+      const isUsernameTaken = response.data.exists;
       
       if (isUsernameTaken) {
         setErrors(prev => ({
@@ -1,6 +1,7 @@
 // services/userApi.ts
 import axios from 'axios';
 import { User, UpdateProfileData, UpdatePasswordData } from '../types/user';
+import { trackDbPin } from '../api';
 
  const API_BASE_URL = 'http://127.0.0.1:8000';
 
@@ -22,6 +23,8 @@ authAxios.interceptors.request.use(
   (error) => Promise.reject(error)
 );
 
+trackDbPin(authAxios);
+
 export const getUserProfile = async (): Promise<User> => {
   const response = await authAxios.get('/api/user/profile/');
   return response.data;